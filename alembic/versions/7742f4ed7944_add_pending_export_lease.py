@@ -0,0 +1,23 @@
+"""add a lease to pending exports for the async export executor
+
+Revision ID: 7742f4ed7944
+Revises: e621d3863b0a
+Create Date: 2026-10-18 16:41:07.318204+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "7742f4ed7944"
+down_revision = "e621d3863b0a"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column("pending_export", sa.Column("leased_until", sa.DateTime(), nullable=True))
+
+
+def downgrade():
+    op.drop_column("pending_export", "leased_until")
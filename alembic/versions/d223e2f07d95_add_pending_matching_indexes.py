@@ -0,0 +1,61 @@
+"""add partial indexes on pending scheme & payment transactions for matching
+
+Revision ID: d223e2f07d95
+Revises: 01bd04c18481
+Create Date: 2026-10-18 10:12:31.204518+00:00
+
+"""
+import sqlalchemy as sa
+
+from alembic import op
+
+revision = "d223e2f07d95"
+down_revision = "01bd04c18481"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # built concurrently so that imports & matching can carry on writing to these tables while the indexes are built.
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_scheme_transaction_pending_mids",
+            "scheme_transaction",
+            ["mids"],
+            postgresql_using="gin",
+            postgresql_where=sa.text("status = 'PENDING'"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_scheme_transaction_pending_spend_amount_created_at",
+            "scheme_transaction",
+            ["spend_amount", "created_at"],
+            postgresql_where=sa.text("status = 'PENDING'"),
+            postgresql_concurrently=True,
+        )
+        op.create_index(
+            "ix_payment_transaction_pending_mid_spend_amount_created_at",
+            "payment_transaction",
+            ["mid", "spend_amount", "created_at"],
+            postgresql_where=sa.text("status = 'PENDING'"),
+            postgresql_concurrently=True,
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_payment_transaction_pending_mid_spend_amount_created_at",
+            table_name="payment_transaction",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_scheme_transaction_pending_spend_amount_created_at",
+            table_name="scheme_transaction",
+            postgresql_concurrently=True,
+        )
+        op.drop_index(
+            "ix_scheme_transaction_pending_mids",
+            table_name="scheme_transaction",
+            postgresql_concurrently=True,
+        )
@@ -0,0 +1,244 @@
+"""partition transaction tables by created_at
+
+Revision ID: e621d3863b0a
+Revises: d223e2f07d95
+Create Date: 2026-10-18 14:03:52.811730+00:00
+
+Each table is renamed to <table>_legacy and attached as the first partition of a new partitioned table, covering
+everything created before the start of next week. The slow parts (validating the partition bound & building the
+new unique indexes) are done up front without blocking writes, so the switchover itself only touches the catalog.
+
+Postgres only enforces unique constraints within each partition, so the transaction & import transaction keys move to
+non-partitioned key tables. These are backfilled up front too, with a trigger keeping them in step until the switchover.
+"""
+from datetime import datetime, timedelta
+
+from alembic import op
+
+revision = "e621d3863b0a"
+down_revision = "d223e2f07d95"
+branch_labels = None
+depends_on = None
+
+PENDING = "WHERE status = 'PENDING'"
+
+# unique constraints & indexes as they were before partitioning. created_at is added to each unique constraint.
+TABLES: dict[str, dict] = {
+    "export_transaction": {},
+    "matched_transaction": {
+        "foreign_keys": {
+            "matched_transaction_merchant_identifier_id_fkey": (
+                "merchant_identifier_id",
+                "merchant_identifier(id)",
+            ),
+        },
+    },
+    "scheme_transaction": {
+        "indexes": {
+            "ix_scheme_transaction_match_group": "(match_group)",
+            "ix_scheme_transaction_transaction_date": "(transaction_date)",
+            "ix_scheme_transaction_pending_mids": f"USING gin (mids) {PENDING}",
+            "ix_scheme_transaction_pending_spend_amount_created_at": f"(spend_amount, created_at) {PENDING}",
+        },
+    },
+    "payment_transaction": {
+        "indexes": {
+            "ix_payment_transaction_settlement_key": "(settlement_key)",
+            "ix_payment_transaction_match_group": "(match_group)",
+            "ix_payment_transaction_pending_mid_spend_amount_created_at": (
+                f"(mid, spend_amount, created_at) {PENDING}"
+            ),
+        },
+    },
+    "transaction": {
+        "unique": {"_transaction_id_feed_type_t_uc": "transaction_id, feed_type"},
+        "indexes": {
+            "ix_transaction_settlement_key": "(settlement_key)",
+            "ix_transaction_match_group": "(match_group)",
+        },
+    },
+    "import_transaction": {
+        "unique": {"_slug_id_feed_uc": "provider_slug, transaction_id, feed_type"},
+    },
+    "user_identity": {
+        "indexes": {"ix_user_identity_transaction_id": "(transaction_id)"},
+    },
+}
+
+# key table name & key columns for each table with a unique key.
+KEY_TABLES = {
+    "transaction": (
+        "transaction_key",
+        {"transaction_id": "varchar(100)", "feed_type": "feedtype"},
+    ),
+    "import_transaction": (
+        "import_transaction_key",
+        {"provider_slug": "varchar(50)", "transaction_id": "varchar(100)", "feed_type": "feedtype"},
+    ),
+}
+
+PENDING_EXPORT_FK = "pending_export_export_transaction_id_fkey"
+PENDING_EXPORT_INDEX = "ix_pending_export_export_transaction_id"
+# pending exports reference the partitioned export_transaction by (id, created_at) instead.
+PENDING_EXPORT_PARTITIONED_FK = "pending_export_export_transaction_fkey"
+PENDING_EXPORT_BACKFILL = (
+    "UPDATE pending_export SET export_transaction_created_at = export_transaction.created_at "
+    "FROM export_transaction WHERE export_transaction.id = pending_export.export_transaction_id "
+    "AND pending_export.export_transaction_created_at IS NULL"
+)
+
+# weekly partitions to create up front. the create-partitions command keeps them topped up after this.
+WEEKS = 4
+
+
+def _legacy(name: str) -> str:
+    # postgres truncates identifiers at 63 characters.
+    return f"{name[:56]}_legacy"
+
+
+def _boundary() -> datetime:
+    """The start of next week. Everything created before this stays in the legacy partition."""
+    today = datetime.utcnow().date()
+    monday = today - timedelta(days=today.weekday()) + timedelta(weeks=1)
+    return datetime(monday.year, monday.month, monday.day)
+
+
+def _create_key_table(table: str, key_table: str, columns: dict[str, str]) -> None:
+    """Creates & fills a key table, with a trigger that adds the keys of new rows until the switchover."""
+    names = ", ".join(columns)
+    column_definitions = ", ".join(f"{name} {type_} NOT NULL" for name, type_ in columns.items())
+    new_values = ", ".join(f"NEW.{name}" for name in columns)
+
+    op.execute(
+        f'CREATE TABLE "{key_table}" ({column_definitions}, '
+        "created_at timestamp NOT NULL DEFAULT TIMEZONE('utc', CURRENT_TIMESTAMP), "
+        f'CONSTRAINT "{key_table}_pkey" PRIMARY KEY ({names}))'
+    )
+    # creating the trigger waits for in-flight inserts, so the backfill below sees every row the trigger doesn't.
+    op.execute(
+        f'CREATE FUNCTION "{key_table}_sync"() RETURNS trigger LANGUAGE plpgsql AS $$ BEGIN '
+        f'INSERT INTO "{key_table}" ({names}, created_at) VALUES ({new_values}, NEW.created_at) '
+        "ON CONFLICT DO NOTHING; RETURN NULL; END $$"
+    )
+    op.execute(
+        f'CREATE TRIGGER "{key_table}_sync" AFTER INSERT ON "{table}" '
+        f'FOR EACH ROW EXECUTE FUNCTION "{key_table}_sync"()'
+    )
+    op.execute(
+        f'INSERT INTO "{key_table}" ({names}, created_at) SELECT {names}, created_at FROM "{table}" '
+        "ON CONFLICT DO NOTHING"
+    )
+    op.execute(f'CREATE INDEX CONCURRENTLY "ix_{key_table}_created_at" ON "{key_table}" (created_at)')
+
+
+def upgrade():
+    boundary = _boundary()
+
+    # make the legacy tables fit the partition bound & the new constraints, without blocking writes.
+    with op.get_context().autocommit_block():
+        for table, spec in TABLES.items():
+            op.execute(
+                f"UPDATE \"{table}\" SET created_at = coalesce(updated_at, now() at time zone 'utc') "
+                "WHERE created_at IS NULL"
+            )
+            op.execute(
+                f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_partition_check" '
+                f"CHECK (created_at IS NOT NULL AND created_at < '{boundary}') NOT VALID"
+            )
+            op.execute(f'ALTER TABLE "{table}" VALIDATE CONSTRAINT "{table}_partition_check"')
+            op.execute(f'CREATE UNIQUE INDEX CONCURRENTLY "{table}_legacy_pkey" ON "{table}" (id, created_at)')
+            for name, columns in spec.get("unique", {}).items():
+                op.execute(f'CREATE UNIQUE INDEX CONCURRENTLY "{_legacy(name)}" ON "{table}" ({columns}, created_at)')
+
+        for table, (key_table, columns) in KEY_TABLES.items():
+            _create_key_table(table, key_table, columns)
+
+        op.execute("ALTER TABLE pending_export ADD COLUMN export_transaction_created_at timestamp")
+        op.execute(PENDING_EXPORT_BACKFILL)
+
+    # pending exports can't reference a partitioned table by id alone.
+    op.execute(f'ALTER TABLE pending_export DROP CONSTRAINT "{PENDING_EXPORT_FK}"')
+    # picks up any pending exports created since the backfill above.
+    op.execute(PENDING_EXPORT_BACKFILL)
+
+    # from here on, imports claim their keys in the key tables themselves.
+    for table, (key_table, _) in KEY_TABLES.items():
+        op.execute(f'DROP TRIGGER "{key_table}_sync" ON "{table}"')
+        op.execute(f'DROP FUNCTION "{key_table}_sync"()')
+
+    for table, spec in TABLES.items():
+        legacy = f"{table}_legacy"
+        sequence = op.get_bind().execute(f"SELECT pg_get_serial_sequence('{table}', 'id')").scalar()
+
+        op.execute(f'ALTER TABLE "{table}" RENAME TO "{legacy}"')
+        # the validated check constraint means neither of these have to scan the table.
+        op.execute(f'ALTER TABLE "{legacy}" ALTER COLUMN created_at SET NOT NULL')
+        op.execute(f'ALTER TABLE "{legacy}" DROP CONSTRAINT "{table}_pkey"')
+        op.execute(f'ALTER TABLE "{legacy}" ADD CONSTRAINT "{legacy}_pkey" PRIMARY KEY USING INDEX "{legacy}_pkey"')
+        for name in spec.get("unique", {}):
+            op.execute(f'ALTER TABLE "{legacy}" DROP CONSTRAINT "{name}"')
+            op.execute(f'ALTER TABLE "{legacy}" ADD CONSTRAINT "{_legacy(name)}" UNIQUE USING INDEX "{_legacy(name)}"')
+        for name in spec.get("indexes", {}):
+            op.execute(f'ALTER INDEX "{name}" RENAME TO "{_legacy(name)}"')
+
+        op.execute(f'CREATE TABLE "{table}" (LIKE "{legacy}" INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)')
+        op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY (id, created_at)')
+        for name, columns in spec.get("unique", {}).items():
+            op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" UNIQUE ({columns}, created_at)')
+        for name, definition in spec.get("indexes", {}).items():
+            op.execute(f'CREATE INDEX "{name}" ON "{table}" {definition}')
+        for name, (column, reference) in spec.get("foreign_keys", {}).items():
+            op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" FOREIGN KEY ({column}) REFERENCES {reference}')
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{table}".id')
+
+        # the indexes built above match the parent's, so attaching reuses them rather than building new ones.
+        op.execute(f'ALTER TABLE "{table}" ATTACH PARTITION "{legacy}" FOR VALUES FROM (MINVALUE) TO (\'{boundary}\')')
+        op.execute(f'CREATE TABLE "{table}_default" PARTITION OF "{table}" DEFAULT')
+        for week in range(WEEKS):
+            start = boundary + timedelta(weeks=week)
+            end = start + timedelta(weeks=1)
+            op.execute(
+                f'CREATE TABLE "{table}_{start:%Y%m%d}" PARTITION OF "{table}" '
+                f"FOR VALUES FROM ('{start}') TO ('{end}')"
+            )
+
+    op.execute(f'CREATE INDEX "{PENDING_EXPORT_INDEX}" ON pending_export (export_transaction_id)')
+    op.execute(
+        f'ALTER TABLE pending_export ADD CONSTRAINT "{PENDING_EXPORT_PARTITIONED_FK}" '
+        "FOREIGN KEY (export_transaction_id, export_transaction_created_at) "
+        "REFERENCES export_transaction(id, created_at)"
+    )
+
+
+def downgrade():
+    op.execute(f'ALTER TABLE pending_export DROP CONSTRAINT "{PENDING_EXPORT_PARTITIONED_FK}"')
+    op.execute("ALTER TABLE pending_export DROP COLUMN export_transaction_created_at")
+    for key_table, _ in KEY_TABLES.values():
+        op.execute(f'DROP TABLE "{key_table}"')
+
+    # partitions can't be turned back into a plain table in place, so the rows are copied over.
+    for table, spec in TABLES.items():
+        copy = f"{table}_unpartitioned"
+        sequence = op.get_bind().execute(f"SELECT pg_get_serial_sequence('{table}', 'id')").scalar()
+
+        op.execute(f'CREATE TABLE "{copy}" (LIKE "{table}" INCLUDING DEFAULTS)')
+        op.execute(f'INSERT INTO "{copy}" SELECT * FROM "{table}"')
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY "{copy}".id')
+        op.execute(f'DROP TABLE "{table}"')
+        op.execute(f'ALTER TABLE "{copy}" RENAME TO "{table}"')
+        op.execute(f'ALTER TABLE "{table}" ALTER COLUMN created_at DROP NOT NULL')
+
+        op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{table}_pkey" PRIMARY KEY (id)')
+        for name, columns in spec.get("unique", {}).items():
+            op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" UNIQUE ({columns})')
+        for name, definition in spec.get("indexes", {}).items():
+            op.execute(f'CREATE INDEX "{name}" ON "{table}" {definition}')
+        for name, (column, reference) in spec.get("foreign_keys", {}).items():
+            op.execute(f'ALTER TABLE "{table}" ADD CONSTRAINT "{name}" FOREIGN KEY ({column}) REFERENCES {reference}')
+
+    op.execute(f'DROP INDEX "{PENDING_EXPORT_INDEX}"')
+    op.execute("DELETE FROM pending_export WHERE export_transaction_id NOT IN (SELECT id FROM export_transaction)")
+    op.execute(
+        f'ALTER TABLE pending_export ADD CONSTRAINT "{PENDING_EXPORT_FK}" '
+        "FOREIGN KEY (export_transaction_id) REFERENCES export_transaction(id)"
+    )
@@ -1,17 +1,28 @@
+import os
+import threading
+import time
 import typing as t
+from contextlib import nullcontext
 
+from redis.client import PubSub, PubSubWorkerThread
 from redis.exceptions import RedisError
 from sqlalchemy.orm.session import Session
 
 import settings
 from app.config import models
-from app.db import get_or_create, redis, redis_scan, run_query
+from app.db import get_or_create, redis, redis_glob_escape, run_query, session_scope
 from app.reporting import get_logger
 
 log = get_logger("config")
 
 KEY_PREFIX = f"{settings.REDIS_KEY_PREFIX}:config:"
 
+# config.update publishes the updated key on this channel, so that other processes can drop it from their cache.
+INVALIDATION_CHANNEL = f"{settings.REDIS_KEY_PREFIX}:config-invalidation"
+
+# a hint for how many keys redis should check in each SCAN call.
+SCAN_COUNT = 1000
+
 
 class ConfigKeyError(Exception):
     pass
@@ -22,8 +33,88 @@ def _validate_key(key: str) -> None:
         raise ValueError(f"Config key must start with `{KEY_PREFIX}`")
 
 
-def get(key: str, *, default: str = "", session: Session) -> str:
-    _validate_key(key)
+class _CacheEntry(t.NamedTuple):
+    value: str
+    expires_at: float
+
+
+class _Cache:
+    """
+    A process-local cache of config values.
+    Entries expire after CONFIG_CACHE_TTL seconds, or as soon as the key is published on INVALIDATION_CHANNEL.
+    If the subscription is interrupted the whole cache is cleared, as invalidations may have been missed.
+    """
+
+    def __init__(self) -> None:
+        self._entries: t.Dict[str, _CacheEntry] = {}
+        self._lock = threading.Lock()
+        self._subscriber: t.Optional[PubSubWorkerThread] = None
+        self._pid: t.Optional[int] = None
+
+    def get(self, key: str) -> t.Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= time.monotonic():
+            return None
+        return entry.value
+
+    def set(self, key: str, value: str) -> None:
+        if settings.CONFIG_CACHE_TTL <= 0:
+            return
+
+        # only cache values while we are subscribed to invalidations, otherwise updates could go unnoticed until expiry.
+        if not self._subscribe():
+            return
+
+        self._entries[key] = _CacheEntry(value, time.monotonic() + settings.CONFIG_CACHE_TTL)
+
+    def invalidate(self, key: t.Optional[str] = None) -> None:
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+    def _on_message(self, message: dict) -> None:
+        self.invalidate(message["data"])
+
+    def _on_error(self, ex: Exception, pubsub: PubSub, thread: PubSubWorkerThread) -> None:
+        log.warning(f"Error receiving config invalidations from redis: {ex}. Clearing the config cache.")
+        self.invalidate()
+        time.sleep(1)
+
+    def _subscribe(self) -> bool:
+        if self._subscriber is not None and self._pid == os.getpid() and self._subscriber.is_alive():
+            return True
+
+        with self._lock:
+            if self._subscriber is not None and self._pid == os.getpid() and self._subscriber.is_alive():
+                return True
+
+            # a subscriber thread started before a fork doesn't exist in the child, so the child starts its own.
+            self._entries.clear()
+            try:
+                pubsub = redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{INVALIDATION_CHANNEL: self._on_message})
+                self._subscriber = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=self._on_error)
+            except RedisError as ex:
+                log.warning(f"Error subscribing to config invalidations: {ex}. Config values will not be cached.")
+                self._subscriber = None
+                return False
+
+            self._pid = os.getpid()
+            return True
+
+    def stop(self) -> None:
+        with self._lock:
+            if self._subscriber is not None and self._pid == os.getpid():
+                self._subscriber.stop()
+            self._subscriber = None
+            self._entries.clear()
+
+
+cache = _Cache()
+
+
+def _get(key: str, *, default: str, session: Session) -> str:
     try:
         val = t.cast(t.Optional[str], redis.get(key))
     except RedisError as ex:
@@ -48,6 +139,25 @@ def get(key: str, *, default: str = "", session: Session) -> str:
     return val
 
 
+def get(key: str, *, default: str = "", session: t.Optional[Session] = None) -> str:
+    """
+    Returns the value of the given config key, from the process-local cache if possible.
+    A session is only needed if the key has to be read from or created in the database.
+    If none is given, one is opened when needed.
+    """
+    _validate_key(key)
+
+    val = cache.get(key)
+    if val is not None:
+        return val
+
+    with nullcontext(session) if session is not None else session_scope() as session:
+        val = _get(key, default=default, session=session)
+
+    cache.set(key, val)
+    return val
+
+
 def update(key: str, value: str, *, session: Session) -> None:
     _validate_key(key)
     config_item = run_query(
@@ -61,11 +171,58 @@ def update(key: str, value: str, *, session: Session) -> None:
     config_item.value = value
     redis.set(key, value)
 
+    cache.invalidate(key)
+    try:
+        redis.publish(INVALIDATION_CHANNEL, key)
+    except RedisError as ex:
+        log.warning(f"Error publishing config invalidation for {key}: {ex}")
+
+
+def _all_keys_from_redis(pattern: str) -> t.Iterator[t.Tuple[str, t.Optional[str]]]:
+    # each round trip fetches the values for one page of keys along with the next page of keys.
+    cursor, keys = redis.scan(0, match=pattern, count=SCAN_COUNT)
+    while keys or cursor:
+        pipe = redis.pipeline(transaction=False)
+        if keys:
+            pipe.mget(keys)
+        if cursor:
+            pipe.scan(cursor, match=pattern, count=SCAN_COUNT)
+        results = pipe.execute()
+
+        if keys:
+            yield from zip(keys, results.pop(0))
+        cursor, keys = results[0] if cursor else (0, [])
+
+
+def _all_keys_from_db(prefix: str, *, session: Session) -> t.List[t.Tuple[str, t.Optional[str]]]:
+    return run_query(
+        lambda: session.query(models.ConfigItem.key, models.ConfigItem.value)
+        .filter(models.ConfigItem.key.startswith(prefix, autoescape=True))
+        .all(),
+        session=session,
+        read_only=True,
+        description=f"get all {models.ConfigItem.__name__} objects",
+    )
 
-def all_keys() -> t.Iterable[t.Tuple[str, t.Optional[str]]]:
-    for key in redis_scan(f"{KEY_PREFIX}*"):
-        val = t.cast(t.Optional[str], redis.get(key))
-        yield (key, val)
+
+def all_keys(prefix: str = "", *, session: t.Optional[Session] = None) -> t.Iterable[t.Tuple[str, t.Optional[str]]]:
+    """
+    Yields every config key & value, optionally only those with keys starting with `KEY_PREFIX + prefix`.
+    Keys are yielded in no particular order.
+
+    If redis can't be reached, the keys are read from the database instead. A session is opened if none is given.
+    """
+    prefix = f"{KEY_PREFIX}{prefix}"
+    seen = set()
+    try:
+        for key, val in _all_keys_from_redis(f"{redis_glob_escape(prefix)}*"):
+            seen.add(key)
+            yield key, val
+    except RedisError as ex:
+        log.warning(f"Error listing config keys in redis: '{ex}'. Trying the database...")
+        with nullcontext(session) if session is not None else session_scope() as session:
+            items = _all_keys_from_db(prefix, session=session)
+        yield from ((key, val) for key, val in items if key not in seen)
 
 
 class ConfigValue(t.NamedTuple):
@@ -82,7 +239,11 @@ class Config:
     def __init__(self, *args: ConfigValue):
         self._name_val_map = {arg.name: arg for arg in args}
 
-    def get(self, name: str, session: Session) -> str:
+    @property
+    def keys(self) -> t.List[str]:
+        return [config_value.key for config_value in self._name_val_map.values()]
+
+    def get(self, name: str, session: t.Optional[Session] = None) -> str:
         config_value = self._name_val_map.get(name)
         if config_value is None:
             raise ConfigError(f"{Config.__name__} contains no {ConfigValue.__name__} with name {name}.")
@@ -1,4 +1,4 @@
-from marshmallow import Schema, fields
+from marshmallow import Schema, fields, validate
 
 from app.api.app import define_schema
 
@@ -8,6 +8,13 @@ class UpdateKeyRequestSchema(Schema):
     value = fields.String(required=True)
 
 
+@define_schema
+class ListKeysRequestSchema(Schema):
+    prefix = fields.String(load_default="")
+    after = fields.String(load_default=None)
+    limit = fields.Integer(load_default=None, validate=validate.Range(min=1))
+
+
 @define_schema
 class KeyValuePairSchema(Schema):
     key = fields.String(required=True)
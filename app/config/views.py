@@ -17,13 +17,33 @@ def list_keys() -> ResponseType:
     """List config keys
     ---
     get:
-      description: List config keys
+      description: >
+        List config keys, sorted by key.
+        Pass the last key of one page as `after` to get the next page.
+      parameters:
+      - in: query
+        schema: ListKeysRequestSchema
       responses:
         200:
           description: A list of config keys.
           schema: ConfigKeysListSchema
+        400:
+          description: Invalid query parameters.
     """
-    config_keys = {"keys": list({"key": k, "value": v} for k, v in config.all_keys())}
+    request_schema = schemas.ListKeysRequestSchema()
+
+    try:
+        args = request_schema.load(request.args)
+    except marshmallow.ValidationError as ex:
+        return {"messages": ex.messages}, 400
+
+    items = sorted(config.all_keys(args["prefix"]))
+    if args["after"] is not None:
+        items = [(k, v) for k, v in items if k > args["after"]]
+    if args["limit"] is not None:
+        items = items[: args["limit"]]
+
+    config_keys = {"keys": [{"key": k, "value": v} for k, v in items]}
 
     schema = schemas.ConfigKeysListSchema()
     data = schema.dump(config_keys)
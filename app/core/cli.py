@@ -2,8 +2,12 @@ import click
 import pendulum
 
 import settings
-from app import db, models, tasks
+from app import db, models, partitions, tasks
+from app.exports.agents.bases.singular_export_agent import SingularExportAgent
+from app.exports.agents.registry import export_agents
+from app.exports.async_executor import AsyncExportExecutor
 from app.exports.retry_worker import ExportRetryWorker
+from app.imports.dedup import DedupIndex
 from app.prometheus import prometheus_thread
 from app.scheduler import is_leader
 from app.service.events import connect_signals
@@ -25,6 +29,20 @@ def export_retry() -> None:
     worker.run()
 
 
+@cli.command()
+@click.option("--provider-slug", required=True, help="The singular export agent to run.")
+def export_async(provider_slug: str) -> None:
+    """Send a merchant's pending exports in concurrent batches. The merchant must be listed in EXPORT_ASYNC_SLUGS."""
+    if provider_slug not in settings.EXPORT_ASYNC_SLUGS:
+        raise click.BadParameter(f"{provider_slug} is not in EXPORT_ASYNC_SLUGS", param_hint="--provider-slug")
+
+    agent = export_agents.instantiate(provider_slug)
+    if not isinstance(agent, SingularExportAgent):
+        raise click.BadParameter(f"{provider_slug} is not a singular export agent", param_hint="--provider-slug")
+
+    AsyncExportExecutor(agent).run()
+
+
 @cli.command()
 def worker():
     import rq_worker_settings
@@ -49,37 +67,72 @@ def purgedb(days: int = 60, no_user_input: bool = False, leader_election: bool =
         click.secho("Leader election is enabled and I am not leader, exiting.", bold=True, fg="red")
         return
 
-    DELETE = [
-        models.ExportTransaction,
-        models.MatchedTransaction,
-        models.SchemeTransaction,
-        models.PaymentTransaction,
-        models.Transaction,
-        models.ImportTransaction,
-        models.UserIdentity,
-        models.ImportFileLog,
-    ]
-
-    date = pendulum.now("utc").subtract(days=days).date()
+    # created_at is stored as a naive UTC timestamp.
+    before = pendulum.now("utc").subtract(days=days).start_of("day").naive()
+    date = before.date()
     click.echo(f"Data from the last {days} days will be preserved.")
     click.secho(f"Purging data from before {date}", fg="red", bold=True)
 
     if not no_user_input and not click.confirm("Do you want to continue?"):
         raise click.Abort
 
-    def delete(model: db.Base, *, session: db.Session) -> int:
-        return session.query(model).where(model.created_at < date).delete(synchronize_session=False)
+    with db.session_scope() as session:
+        click.secho("Dropping expired partitions...", fg="cyan")
+        for table_name, dropped in partitions.drop_partitions(before, session=session).items():
+            click.secho(f"Dropped {len(dropped)} {table_name} partitions: {', '.join(dropped) or '-'}", fg="green")
+
+        click.secho("Purging ImportFileLog...", fg="cyan")
+        deleted = db.run_query(
+            lambda: session.query(models.ImportFileLog)
+            .where(models.ImportFileLog.created_at < date)
+            .delete(synchronize_session=False),
+            session=session,
+            description=f"delete ImportFileLog data from before {date}",
+        )
+        click.secho(f"Deleted {deleted} ImportFileLog records", fg="green")
+        session.commit()
+
+
+@cli.command()
+@click.option("--weeks", type=int, default=4, show_default=True, help="Number of weeks ahead to create partitions for")
+@click.option(
+    "--leader-election",
+    type=bool,
+    is_flag=True,
+    default=False,
+    help="Use leader election for multi-cluster environments",
+)
+def create_partitions(weeks: int = 4, leader_election: bool = False) -> None:
+    """Create this week's partition of each partitioned table, and the partitions for the next few weeks."""
+    if leader_election and not is_leader("create-partitions"):
+        click.secho("Leader election is enabled and I am not leader, exiting.", bold=True, fg="red")
+        return
 
     with db.session_scope() as session:
-        for model in DELETE:
-            click.secho(f"Purging {model.__name__}...", fg="cyan")
-            deleted = db.run_query(
-                lambda: delete(model, session=session),
-                session=session,
-                description=f"delete {model.__name__} data from before {date}",
+        created = partitions.create_partitions(weeks, session=session)
+    click.secho(f"Created {len(created)} partitions: {', '.join(created) or '-'}", fg="green")
+
+
+@cli.command()
+@click.option("--provider-slug", help="Only rebuild indexes for this import provider.")
+def rebuild_dedup_index(provider_slug: str | None = None) -> None:
+    """Rebuild the bloom filters used to find duplicate imports from the import_transaction table."""
+    with db.session_scope() as session:
+        query = session.query(models.ImportTransaction.provider_slug, models.ImportTransaction.feed_type).distinct()
+        if provider_slug:
+            query = query.filter(models.ImportTransaction.provider_slug == provider_slug)
+
+        indexes = [
+            DedupIndex(slug, feed_type)
+            for slug, feed_type in db.run_query(
+                query.all, session=session, read_only=True, description="find import providers & feed types"
             )
-            click.secho(f"Deleted {deleted} {model.__name__} records", fg="green")
-        session.commit()
+        ]
+
+        for index in indexes:
+            click.secho(f"Rebuilding {index}...", fg="cyan")
+            count = index.rebuild(session=session)
+            click.secho(f"Added {count} transaction IDs to {index}", fg="green")
 
 
 if __name__ == "__main__":
@@ -1,14 +1,19 @@
+import random
 import uuid
 from dataclasses import dataclass
-from typing import Optional, cast
+from typing import Iterable, List, Optional, Sequence
 
 import pendulum
+import sqlalchemy as s
+from sqlalchemy.orm import joinedload
 
+import settings
 from app import db, tasks
-from app.exports.agents import BaseAgent
-from app.exports.agents.registry import export_agents
+from app.exports import rate_limit
+from app.exports.agent_pool import export_agent_pool
 from app.exports.models import ExportTransaction, PendingExport
 from app.feeds import FeedType
+from app.prometheus import bink_prometheus
 from app.registry import NoSuchAgent
 from app.reporting import get_logger
 
@@ -42,49 +47,115 @@ class ExportFields:
     extra_fields: dict
 
 
-def create_export(fields: ExportFields, *, session: db.Session) -> None:
+# the most export transactions to insert in one statement.
+INSERT_CHUNK_SIZE = 1000
+
+
+def _export_transaction_values(fields: ExportFields) -> dict:
+    return dict(
+        transaction_id=fields.transaction_id,
+        feed_type=fields.feed_type,
+        provider_slug=fields.merchant_slug,
+        transaction_date=fields.transaction_date,
+        spend_amount=fields.spend_amount,
+        spend_currency=fields.spend_currency,
+        loyalty_id=fields.loyalty_id,
+        mid=fields.mid,
+        primary_identifier=fields.mid,
+        location_id=fields.location_id,
+        merchant_internal_id=fields.merchant_internal_id,
+        user_id=fields.user_id,
+        scheme_account_id=fields.scheme_account_id,
+        payment_card_account_id=fields.payment_card_account_id,
+        credentials=fields.credentials,
+        settlement_key=fields.settlement_key,
+        last_four=fields.last_four,
+        expiry_month=fields.expiry_month,
+        expiry_year=fields.expiry_year,
+        payment_provider_slug=fields.payment_provider_slug,
+        auth_code=fields.auth_code,
+        approval_code=fields.approval_code,
+        extra_fields=fields.extra_fields,
+        export_uid=str(uuid.uuid4()),
+    )
+
+
+def _insert_exports_statement(fields: Sequence[ExportFields]) -> s.sql.Insert:
     """
-    Utility method to create an export transaction record and queue up an export job for it.
+    Builds a single INSERT that creates an export transaction & pending export for each of the given fields,
+    returning the pending exports' IDs & provider slugs.
     """
-
-    def add_export_transaction():
-        export_transaction = ExportTransaction(
-            transaction_id=fields.transaction_id,
-            feed_type=fields.feed_type,
-            provider_slug=fields.merchant_slug,
-            transaction_date=fields.transaction_date,
-            spend_amount=fields.spend_amount,
-            spend_currency=fields.spend_currency,
-            loyalty_id=fields.loyalty_id,
-            mid=fields.mid,
-            primary_identifier=fields.mid,
-            location_id=fields.location_id,
-            merchant_internal_id=fields.merchant_internal_id,
-            user_id=fields.user_id,
-            scheme_account_id=fields.scheme_account_id,
-            payment_card_account_id=fields.payment_card_account_id,
-            credentials=fields.credentials,
-            settlement_key=fields.settlement_key,
-            last_four=fields.last_four,
-            expiry_month=fields.expiry_month,
-            expiry_year=fields.expiry_year,
-            payment_provider_slug=fields.payment_provider_slug,
-            auth_code=fields.auth_code,
-            approval_code=fields.approval_code,
-            extra_fields=fields.extra_fields,
-            export_uid=uuid.uuid4(),
+    export_transactions = (
+        s.insert(ExportTransaction)
+        .values([_export_transaction_values(export_fields) for export_fields in fields])
+        .returning(ExportTransaction.id, ExportTransaction.created_at, ExportTransaction.provider_slug)
+        .cte("new_export_transactions")
+    )
+    return (
+        s.insert(PendingExport)
+        .from_select(
+            ["export_transaction_id", "export_transaction_created_at", "provider_slug", "retry_count"],
+            s.select(
+                export_transactions.c.id,
+                export_transactions.c.created_at,
+                export_transactions.c.provider_slug,
+                s.literal(0),
+            ),
         )
-        session.add(export_transaction)
+        .returning(PendingExport.id, PendingExport.provider_slug)
+    )
+
+
+def create_exports(fields: Iterable[ExportFields], *, session: db.Session) -> List[int]:
+    """
+    Creates an export transaction & pending export record for each of the given fields in a single database
+    transaction, then queues up an export job for each with one redis pipeline.
+    Returns the IDs of the new pending exports.
+    """
+    fields = list(fields)
+    if not fields:
+        return []
+
+    def add_exports():
+        pending_exports = []
+        for start in range(0, len(fields), INSERT_CHUNK_SIZE):
+            chunk = fields[start : start + INSERT_CHUNK_SIZE]
+            pending_exports.extend(session.execute(_insert_exports_statement(chunk)).all())
         session.commit()
+        return pending_exports
+
+    pending_exports = db.run_query(
+        add_exports, session=session, description=f"create {len(fields)} export transactions"
+    )
+
+    # pending exports for merchants on the async export executor are picked up by the executor itself.
+    tasks.export_queue.enqueue_batch(
+        tasks.export_singular_transaction,
+        [
+            ((pending_export_id,), {})
+            for pending_export_id, provider_slug in pending_exports
+            if provider_slug not in settings.EXPORT_ASYNC_SLUGS
+        ],
+    )
+
+    return [pending_export_id for pending_export_id, _ in pending_exports]
 
-        return export_transaction
 
-    export_transaction = db.run_query(add_export_transaction, session=session, description="create export transaction")
-    tasks.export_queue.enqueue(tasks.export_transaction, export_transaction.id)
+def create_export(fields: ExportFields, *, session: db.Session) -> None:
+    """
+    Utility method to create an export transaction & pending export record, and queue up an export job for it.
+    """
+    create_exports([fields], session=session)
 
 
 class ExportDirector:
+    prometheus_metrics = {"counters": ["exports_deferred"]}
+
     def handle_export_transaction(self, export_transaction_id: int, *, session: db.Session) -> None:
+        """
+        Creates a pending export for an export transaction & queues it up for export.
+        create_export does both itself now, this remains for export_transaction jobs that are already queued.
+        """
         log.debug(f"Recieved export transaction #{export_transaction_id}.")
         export_transaction: ExportTransaction = db.run_query(
             lambda: session.query(ExportTransaction).get(export_transaction_id),
@@ -105,19 +176,26 @@ class ExportDirector:
         )
 
         def add_pending_export():
-            pending_export = PendingExport(provider_slug=loyalty_scheme, export_transaction_id=export_transaction_id)
+            pending_export = PendingExport(provider_slug=loyalty_scheme, export_transaction=export_transaction)
             session.add(pending_export)
             session.commit()
             return pending_export
 
         pending_export = db.run_query(add_pending_export, session=session, description="create pending export")
 
+        if loyalty_scheme in settings.EXPORT_ASYNC_SLUGS:
+            log.info(f"{pending_export} will be picked up by the async export executor.")
+            return
+
         log.info(f"Sending trigger for singular export agents: {pending_export}.")
         tasks.export_queue.enqueue(tasks.export_singular_transaction, pending_export.id)
 
     def handle_pending_export(self, pending_export_id: int, *, session: db.Session) -> None:
         pending_export = db.run_query(
-            lambda: session.query(PendingExport).get(pending_export_id),
+            lambda: session.query(PendingExport)
+            .options(joinedload(PendingExport.export_transaction))
+            .filter(PendingExport.id == pending_export_id)
+            .one_or_none(),
             session=session,
             read_only=True,
             description="find pending export",
@@ -128,12 +206,36 @@ class ExportDirector:
             return
 
         try:
-            agent = cast(BaseAgent, export_agents.instantiate(pending_export.provider_slug))
+            agent = export_agent_pool.get(pending_export.provider_slug)
         except NoSuchAgent:
             log.debug(
                 f"No export agent is registered for slug {pending_export.provider_slug}. Skipping {pending_export}"
             )
             return
 
-        log.info(f"Received {pending_export}, delegating to {agent}.")
-        agent.handle_pending_export(pending_export, session=session)
+        try:
+            with rate_limit.limit(pending_export.provider_slug, session=session):
+                log.info(f"Received {pending_export}, delegating to {agent}.")
+                agent.handle_pending_export(pending_export, session=session)
+        except rate_limit.RateLimited as ex:
+            self._defer_pending_export(pending_export, ex.retry_after)
+
+    @staticmethod
+    def _defer_pending_export(pending_export: PendingExport, retry_after: float) -> None:
+        """
+        Requeues a rate limited pending export without touching the database, so it doesn't use up a retry.
+        The delay is jittered so that deferred exports don't all come back at the same moment.
+        """
+        delay = max(retry_after, 1) * random.uniform(1, 2)
+        log.info(f"{pending_export} is rate limited and will be requeued in {delay:.1f}s.")
+        bink_prometheus.increment_counter(
+            agent=ExportDirector,
+            counter_name="exports_deferred",
+            increment_by=1,
+            process_type="export",
+            slug=pending_export.provider_slug,
+        )
+        tasks.export_queue.schedule_batch(
+            tasks.export_singular_transaction,
+            [(pendulum.now("UTC").add(seconds=delay), (pending_export.id,), {})],
+        )
@@ -1,9 +1,15 @@
+import typing as t
+from collections import defaultdict
 from typing import Optional
 
+import redis
 import requests
+import sentry_sdk
 from sqlalchemy.orm import Query
 
-from app import db, models
+import settings
+from app import db, encoding, models
+from app.identifiers.index import index as mid_index
 from app.reporting import get_logger
 from app.service.hermes import hermes
 
@@ -22,17 +28,25 @@ class RetryableLookupFailure(Exception):
     pass
 
 
+class IdentifyArgs(t.NamedTuple):
+    transaction_id: str
+    merchant_identifier_ids: list[int]
+    card_token: str
+
+
+class IdentifyResult(t.NamedTuple):
+    # transactions that now have a user identity.
+    identified: list[str]
+
+    # transactions whose Hermes lookup failed in a way that is worth retrying.
+    retry: list[IdentifyArgs]
+
+
 def payment_card_user_info(merchant_identifier_ids: list[int], token: str, *, session: db.Session) -> dict:
-    merchant_identifiers = db.run_query(
-        lambda: session.query(models.MerchantIdentifier)
-        .filter(models.MerchantIdentifier.id.in_(merchant_identifier_ids))
-        .all(),
-        session=session,
-        read_only=True,
-        description="find payment transaction MIDs",
-    )
+    mids_by_id = mid_index.get(session=session).by_id
+    merchant_identifiers = [mids_by_id[mid_id] for mid_id in merchant_identifier_ids if mid_id in mids_by_id]
 
-    slugs = {merchant_identifier.loyalty_scheme.slug for merchant_identifier in merchant_identifiers}
+    slugs = {merchant_identifier.loyalty_scheme_slug for merchant_identifier in merchant_identifiers}
 
     if len(slugs) > 1:
         raise ValueError(
@@ -49,21 +63,79 @@ def payment_card_user_info(merchant_identifier_ids: list[int], token: str, *, se
         raise SchemeAccountNotFound
 
 
-def persist_user_identity(transaction_id: str, user_info: dict, *, session: db.Session) -> models.UserIdentity:
-    def add_user_identity():
-        user_identity = models.UserIdentity(
-            transaction_id=transaction_id,
-            loyalty_id=user_info["loyalty_id"],
-            scheme_account_id=user_info["scheme_account_id"],
-            payment_card_account_id=user_info.get("payment_card_account_id", None),
-            user_id=user_info["user_id"],
-            credentials=user_info["credentials"],
-            first_six=user_info["card_information"]["first_six"],
-            last_four=user_info["card_information"]["last_four"],
-            expiry_year=user_info["card_information"].get("expiry_year"),
-            expiry_month=user_info["card_information"].get("expiry_month"),
+def _user_info_cache_key(loyalty_scheme_slug: str, token: str) -> str:
+    return f"{settings.REDIS_KEY_PREFIX}:hermes-user-info:{loyalty_scheme_slug}:{token}"
+
+
+def _get_cached_user_info(loyalty_scheme_slug: str, tokens: list[str]) -> dict[str, dict]:
+    if not settings.HERMES_USER_INFO_CACHE_TTL or not tokens:
+        return {}
+
+    try:
+        values = db.redis.mget([_user_info_cache_key(loyalty_scheme_slug, token) for token in tokens])
+    except redis.RedisError as ex:
+        log.warning(f"Failed to read cached payment card user info: {repr(ex)}")
+        return {}
+
+    return {token: encoding.loads(value) for token, value in zip(tokens, values) if value is not None}
+
+
+def _cache_user_info(loyalty_scheme_slug: str, user_info: dict[str, dict]) -> None:
+    if not settings.HERMES_USER_INFO_CACHE_TTL or not user_info:
+        return
+
+    pipe = db.redis.pipeline(transaction=False)
+    for token, info in user_info.items():
+        pipe.set(
+            _user_info_cache_key(loyalty_scheme_slug, token),
+            encoding.dumps(info),
+            ex=settings.HERMES_USER_INFO_CACHE_TTL,
         )
 
+    try:
+        pipe.execute()
+    except redis.RedisError as ex:
+        log.warning(f"Failed to cache payment card user info: {repr(ex)}")
+
+
+def payment_cards_user_info(loyalty_scheme_slug: str, tokens: t.Iterable[str]) -> dict[str, dict]:
+    """
+    Returns Hermes user info for each of the given payment card tokens that belongs to a scheme account.
+    Tokens are looked up in the Redis cache first, then in Hermes in chunks of HERMES_USER_INFO_BATCH_SIZE.
+    """
+    tokens = list(dict.fromkeys(tokens))
+    user_info = _get_cached_user_info(loyalty_scheme_slug, tokens)
+    missing = [token for token in tokens if token not in user_info]
+    log.debug(f"Found {len(user_info)} of {len(tokens)} payment card tokens in the user info cache.")
+
+    batch_size = settings.HERMES_USER_INFO_BATCH_SIZE
+    for i in range(0, len(missing), batch_size):
+        json = hermes.payment_cards_user_info(loyalty_scheme_slug, missing[i : i + batch_size])
+        found = {token: info for token, info in json.items() if info and info.get("scheme_account_id") is not None}
+        _cache_user_info(loyalty_scheme_slug, found)
+        user_info.update(found)
+
+    return user_info
+
+
+def _user_identity(transaction_id: str, user_info: dict) -> models.UserIdentity:
+    return models.UserIdentity(
+        transaction_id=transaction_id,
+        loyalty_id=user_info["loyalty_id"],
+        scheme_account_id=user_info["scheme_account_id"],
+        payment_card_account_id=user_info.get("payment_card_account_id", None),
+        user_id=user_info["user_id"],
+        credentials=user_info["credentials"],
+        first_six=user_info["card_information"]["first_six"],
+        last_four=user_info["card_information"]["last_four"],
+        expiry_year=user_info["card_information"].get("expiry_year"),
+        expiry_month=user_info["card_information"].get("expiry_month"),
+    )
+
+
+def persist_user_identity(transaction_id: str, user_info: dict, *, session: db.Session) -> models.UserIdentity:
+    def add_user_identity():
+        user_identity = _user_identity(transaction_id, user_info)
         session.add(user_identity)
         session.commit()
         return user_identity
@@ -74,6 +146,19 @@ def persist_user_identity(transaction_id: str, user_info: dict, *, session: db.S
     return user_identity
 
 
+def persist_user_identities(user_identities: list[models.UserIdentity], *, session: db.Session) -> None:
+    """Saves the given user identities with a single bulk insert."""
+    if not user_identities:
+        return
+
+    def add_user_identities():
+        session.bulk_save_objects(user_identities)
+        session.commit()
+
+    db.run_query(add_user_identities, session=session, description=f"create {len(user_identities)} user identities")
+    log.debug(f"Persisted {len(user_identities)} user identities.")
+
+
 def _user_identity_query(transaction_id: str, *, session: db.Session) -> Query:
     return session.query(models.UserIdentity).filter(models.UserIdentity.transaction_id == transaction_id)
 
@@ -87,6 +172,18 @@ def try_get_user_identity(transaction_id: str, *, session: db.Session) -> Option
     )
 
 
+def get_user_identities(transaction_ids: list[str], *, session: db.Session) -> dict[str, models.UserIdentity]:
+    user_identities = db.run_query(
+        lambda: session.query(models.UserIdentity)
+        .filter(models.UserIdentity.transaction_id.in_(transaction_ids))
+        .all(),
+        session=session,
+        read_only=True,
+        description=f"find user identities for {len(transaction_ids)} transactions",
+    )
+    return {user_identity.transaction_id: user_identity for user_identity in user_identities}
+
+
 def get_user_identity(transaction_id: str, *, session: db.Session) -> models.UserIdentity:
     return db.run_query(
         _user_identity_query(transaction_id, session=session).one,
@@ -120,3 +217,77 @@ def _attach_user_identity(transaction_id: str, merchant_identifier_ids: list, ca
 
     persist_user_identity(transaction_id, user_info, session=session)
     log.debug(f"Transaction #{transaction_id} identified successfully.")
+
+
+def _get_loyalty_scheme_slugs(merchant_identifier_ids: t.Iterable[int], *, session: db.Session) -> dict[int, str]:
+    mids_by_id = mid_index.get(session=session).by_id
+    return {
+        merchant_identifier_id: mids_by_id[merchant_identifier_id].loyalty_scheme_slug
+        for merchant_identifier_id in set(merchant_identifier_ids)
+        if merchant_identifier_id in mids_by_id
+    }
+
+
+def identify_users(identify_args: list[IdentifyArgs], *, session: db.Session) -> IdentifyResult:
+    """
+    Identifies the users of a group of transactions with one Hermes request per loyalty scheme & chunk of card tokens.
+    Transactions that already have a user identity are counted as identified without another lookup.
+    """
+    existing = get_user_identities([args.transaction_id for args in identify_args], session=session)
+    if existing:
+        log.warning(f"Skipping identification of {len(existing)} transactions that already have a user identity.")
+
+    pending = [args for args in identify_args if args.transaction_id not in existing]
+    slugs_by_id = _get_loyalty_scheme_slugs(
+        (merchant_identifier_id for args in pending for merchant_identifier_id in args.merchant_identifier_ids),
+        session=session,
+    )
+
+    args_by_slug: defaultdict[str, list[IdentifyArgs]] = defaultdict(list)
+    for args in pending:
+        slugs = {slugs_by_id[mid_id] for mid_id in args.merchant_identifier_ids if mid_id in slugs_by_id}
+        if len(slugs) != 1:
+            log.warning(
+                f"Unable to identify transaction #{args.transaction_id}: {args.merchant_identifier_ids} "
+                f"must belong to exactly one loyalty scheme, found {slugs or 'none'}."
+            )
+            continue
+        args_by_slug[slugs.pop()].append(args)
+
+    retry: list[IdentifyArgs] = []
+    user_identities: list[models.UserIdentity] = []
+    for loyalty_scheme_slug, slug_args in args_by_slug.items():
+        try:
+            user_info_by_token = payment_cards_user_info(loyalty_scheme_slug, (args.card_token for args in slug_args))
+        except requests.RequestException:
+            event_id = sentry_sdk.capture_exception()
+            log.debug(
+                f"Failed to get {loyalty_scheme_slug} user info from Hermes for {len(slug_args)} transactions. "
+                f"Sentry event ID: {event_id}"
+            )
+            retry.extend(slug_args)
+            continue
+
+        for args in slug_args:
+            user_info = user_info_by_token.get(args.card_token)
+            if user_info is None:
+                log.debug(f"Hermes was unable to find a scheme account for transaction #{args.transaction_id}")
+            elif "card_information" not in user_info:
+                log.debug(f"Hermes identified {args.transaction_id} but could return no payment card information")
+            else:
+                # one malformed response shouldn't stop the rest of the group from being identified.
+                try:
+                    user_identities.append(_user_identity(args.transaction_id, user_info))
+                except (KeyError, TypeError) as ex:
+                    event_id = sentry_sdk.capture_exception()
+                    log.warning(
+                        f"Hermes returned malformed user info for transaction #{args.transaction_id}: {repr(ex)}. "
+                        f"Sentry event ID: {event_id}"
+                    )
+
+    persist_user_identities(user_identities, session=session)
+    log.debug(f"Identified {len(user_identities)} of {len(identify_args)} transactions.")
+
+    return IdentifyResult(
+        identified=[*existing, *(user_identity.transaction_id for user_identity in user_identities)], retry=retry
+    )
@@ -161,7 +161,44 @@ class PaymentMatchingDirector:
         )
 
     @staticmethod
+    def _get_matching_transactions(
+        *, settlement_keys: t.Iterable[str], session: db.Session
+    ) -> dict[str, models.PaymentTransaction]:
+        """Returns a map of settlement key -> payment transaction for every key that already exists in the DB."""
+        keys = set(settlement_keys)
+        if not keys:
+            return {}
+
+        transactions = db.run_query(
+            lambda: session.query(models.PaymentTransaction)
+            .filter(models.PaymentTransaction.settlement_key.in_(keys))
+            .all(),
+            session=session,
+            read_only=True,
+            description=f"find matching payment transactions for {len(keys)} settlement keys",
+        )
+        return {transaction.settlement_key: transaction for transaction in transactions}
+
+    @staticmethod
+    def _apply_settled_fields(
+        auth_transaction: models.PaymentTransaction, settled_transaction: models.PaymentTransaction
+    ) -> None:
+        # TODO: what other fields need to be updated?
+        auth_transaction.spend_amount = settled_transaction.spend_amount
+        auth_transaction.transaction_id = settled_transaction.transaction_id
+
+        if not auth_transaction.first_six and settled_transaction.first_six:
+            auth_transaction.first_six = settled_transaction.first_six
+
+        if not auth_transaction.last_four and settled_transaction.last_four:
+            auth_transaction.last_four = settled_transaction.last_four
+
+        if not auth_transaction.auth_code and settled_transaction.auth_code:
+            auth_transaction.auth_code = settled_transaction.auth_code
+
+    @classmethod
     def _override_auth_transaction(
+        cls,
         auth_transaction: models.PaymentTransaction,
         settled_transaction: models.PaymentTransaction,
         *,
@@ -173,19 +210,7 @@ class PaymentMatchingDirector:
         )
 
         def update_transaction():
-            # TODO: what other fields need to be updated?
-            auth_transaction.spend_amount = settled_transaction.spend_amount
-            auth_transaction.transaction_id = settled_transaction.transaction_id
-
-            if not auth_transaction.first_six and settled_transaction.first_six:
-                auth_transaction.first_six = settled_transaction.first_six
-
-            if not auth_transaction.last_four and settled_transaction.last_four:
-                auth_transaction.last_four = settled_transaction.last_four
-
-            if not auth_transaction.auth_code and settled_transaction.auth_code:
-                auth_transaction.auth_code = settled_transaction.auth_code
-
+            cls._apply_settled_fields(auth_transaction, settled_transaction)
             session.commit()
 
         db.run_query(update_transaction, session=session, description="override auth transaction fields")
@@ -250,3 +275,116 @@ class PaymentMatchingDirector:
             db.run_query(add_transaction, session=session, description="create settled transaction")
 
             tasks.matching_queue.enqueue(tasks.match_payment_transaction, settled_transaction.settlement_key)
+
+    @staticmethod
+    def _persist_and_enqueue(
+        transactions: list[models.PaymentTransaction], settlement_keys: list[str], *, session: db.Session
+    ) -> None:
+        """
+        Bulk inserts the new payment transactions and commits any pending overrides in the same transaction, then
+        enqueues a matching job for each settlement key in a single redis pipeline.
+        """
+
+        def save_transactions():
+            session.bulk_save_objects(transactions)
+            session.commit()
+
+        db.run_query(save_transactions, session=session, description="bulk save payment transactions")
+
+        tasks.matching_queue.enqueue_batch(
+            tasks.match_payment_transaction, [((settlement_key,), {}) for settlement_key in settlement_keys]
+        )
+
+    def handle_auth_payment_transactions(
+        self, auth_transactions: list[models.PaymentTransaction], *, session: db.Session
+    ) -> None:
+        """
+        Batch version of handle_auth_payment_transaction.
+        Settlement keys for the whole group are resolved with a single query.
+        """
+        for auth_transaction in auth_transactions:
+            if auth_transaction.settlement_key is None:
+                raise self.InvalidAuthTransaction(
+                    f"Auth transaction {auth_transaction} has no settlement key! "
+                    "This field should be set by the import agent."
+                )
+
+        existing = self._get_matching_transactions(
+            settlement_keys=(auth_transaction.settlement_key for auth_transaction in auth_transactions),
+            session=session,
+        )
+
+        new_transactions: dict[str, models.PaymentTransaction] = {}
+        for auth_transaction in auth_transactions:
+            settlement_key = auth_transaction.settlement_key
+            if settled_transaction := existing.get(settlement_key, new_transactions.get(settlement_key)):
+                log.info(
+                    f"Skipping import of auth transaction {auth_transaction} "
+                    f"as a settled transaction was found: {settled_transaction}"
+                )
+                continue
+
+            new_transactions[settlement_key] = auth_transaction
+
+        log.debug(f"Persisting {len(new_transactions)} of {len(auth_transactions)} auth transactions.")
+        self._persist_and_enqueue(list(new_transactions.values()), list(new_transactions), session=session)
+
+    def handle_settled_payment_transactions(
+        self, settled_transactions: list[models.PaymentTransaction], *, session: db.Session
+    ) -> None:
+        """
+        Batch version of handle_settled_payment_transaction.
+        Settlement keys for the whole group are resolved with a single query and auth overrides are applied in memory.
+        """
+        existing = self._get_matching_transactions(
+            settlement_keys=(
+                settled_transaction.settlement_key
+                for settled_transaction in settled_transactions
+                if settled_transaction.settlement_key is not None
+            ),
+            session=session,
+        )
+
+        to_save: list[models.PaymentTransaction] = []
+        to_match: list[str] = []
+        seen_keys: set[str] = set()
+        n_overridden = 0
+        for settled_transaction in settled_transactions:
+            settlement_key = settled_transaction.settlement_key
+
+            if settlement_key is None:
+                log.debug(f"No auth transaction was found for settled transaction {settled_transaction}.")
+                to_save.append(settled_transaction)
+                continue
+
+            if settlement_key in seen_keys:
+                log.info(f"Skipping import of settled transaction {settled_transaction} as its key is a duplicate.")
+                continue
+            seen_keys.add(settlement_key)
+
+            if auth_transaction := existing.get(settlement_key):
+                if auth_transaction.status != models.TransactionStatus.PENDING:
+                    log.info(
+                        f"Skipping import of settled transaction {settled_transaction} "
+                        f"as a matched auth transaction was found: {auth_transaction}"
+                    )
+                    continue
+
+                log.info(
+                    f"Overriding auth transaction {auth_transaction} "
+                    f"with fields from matching settled transaction: {settled_transaction}"
+                )
+                # the auth transaction is already in the session, so the commit will persist its changes.
+                self._apply_settled_fields(auth_transaction, settled_transaction)
+                n_overridden += 1
+            else:
+                log.debug(f"No auth transaction was found for settled transaction {settled_transaction}.")
+                to_save.append(settled_transaction)
+
+            to_match.append(settlement_key)
+
+        log.debug(
+            f"Persisting {len(to_save)} of {len(settled_transactions)} settled transactions "
+            f"and overriding {n_overridden} auth transactions."
+        )
+        self._persist_and_enqueue(to_save, to_match, session=session)
@@ -2,19 +2,43 @@ import typing as t
 
 import pendulum
 import sentry_sdk
+from sqlalchemy.orm import Query
 
 import settings
 from app import db, models, tasks
 from app.core import identifier
-from app.core.export_director import ExportFields, create_export
+from app.core.export_director import ExportFields, create_exports
 from app.matching.agents.base import BaseMatchingAgent, MatchResult
 from app.matching.agents.registry import matching_agents
+from app.matching.index import SchemeTransactionIndex, UnsupportedCriterion
 from app.registry import NoSuchAgent, RegistryConfigurationError
 from app.reporting import get_logger
 
 TransactionType = t.TypeVar("TransactionType", models.PaymentTransaction, models.SchemeTransaction)
 
 
+def pending_payment_transactions_query(
+    *, mids: t.Iterable[str], amounts: t.Iterable[int], since: pendulum.Date, session: db.Session
+) -> Query:
+    return session.query(models.PaymentTransaction).filter(
+        models.PaymentTransaction.mid.in_(mids),
+        models.PaymentTransaction.status == models.TransactionStatus.PENDING,
+        models.PaymentTransaction.created_at >= since.isoformat(),
+        models.PaymentTransaction.spend_amount.in_(amounts),
+    )
+
+
+def pending_scheme_transactions_query(
+    *, mids: t.Iterable[str], amounts: t.Iterable[int], since: pendulum.Date, session: db.Session
+) -> Query:
+    return session.query(models.SchemeTransaction).filter(
+        models.SchemeTransaction.mids.overlap(list(mids)),
+        models.SchemeTransaction.status == models.TransactionStatus.PENDING,
+        models.SchemeTransaction.created_at >= since.isoformat(),
+        models.SchemeTransaction.spend_amount.in_(amounts),
+    )
+
+
 class MatchingWorker:
     class LoyaltySchemeNotFound(Exception):
         pass
@@ -190,31 +214,229 @@ class MatchingWorker:
 
         since = pendulum.now().date().add(days=-14)
         payment_transactions = db.run_query(
-            lambda: session.query(models.PaymentTransaction)
-            .filter(
-                models.PaymentTransaction.mid.in_(mids),
-                models.PaymentTransaction.status == models.TransactionStatus.PENDING,
-                models.PaymentTransaction.created_at >= since.isoformat(),
-                models.PaymentTransaction.spend_amount.in_(amounts),
+            lambda: pending_payment_transactions_query(mids=mids, amounts=amounts, since=since, session=session).all(),
+            session=session,
+            read_only=True,
+            description="find pending payment transactions to match scheme transaction",
+        )
+
+        if not payment_transactions:
+            self.log.debug("Found no matching payment transactions. Exiting matching job.")
+            return
+
+        matching_queue = self._choose_matching_queue(scheme_transactions)
+
+        if scheme_transactions[0].provider_slug in settings.GROUP_MATCHING_SLUGS:
+            self.log.debug(f"Found {len(payment_transactions)} potential matching payment transactions. Matching now.")
+            self._match_group(
+                payment_transactions,
+                mids=mids,
+                amounts=amounts,
+                since=since,
+                fallback_queue=matching_queue,
+                session=session,
+            )
+            return
+
+        self.log.debug(
+            (
+                f"Found {len(payment_transactions)} potential matching payment transactions. Enqueueing matching "
+                f"jobs on {matching_queue.name} queue."
             )
+        )
+        for payment_transaction in payment_transactions:
+            matching_queue.enqueue(tasks.match_payment_transaction, payment_transaction.settlement_key)
+
+    def _load_scheme_slugs(
+        self, payment_transactions: list[models.PaymentTransaction], *, session: db.Session
+    ) -> dict[int, str]:
+        merchant_identifier_ids = {
+            merchant_identifier_id
+            for payment_transaction in payment_transactions
+            for merchant_identifier_id in payment_transaction.merchant_identifier_ids
+        }
+        rows = db.run_query(
+            lambda: session.query(models.MerchantIdentifier.id, models.LoyaltyScheme.slug)
+            .join(models.LoyaltyScheme)
+            .filter(models.MerchantIdentifier.id.in_(merchant_identifier_ids))
             .all(),
             session=session,
             read_only=True,
-            description="find pending payment transactions to match scheme transaction",
+            description="find payment transaction MID slugs",
         )
+        return dict(rows)
+
+    def _match_group(
+        self,
+        payment_transactions: list[models.PaymentTransaction],
+        *,
+        mids: set[str],
+        amounts: set[int],
+        since: pendulum.Date,
+        fallback_queue: "tasks.LoggedQueue",
+        session: db.Session,
+    ) -> None:
+        """
+        Matches a group of payment transactions against an in-memory index of pending scheme transactions.
+        Payment transactions the index can't handle are sent to the per-transaction matching queue instead.
+        """
+        candidates = db.run_query(
+            lambda: pending_scheme_transactions_query(mids=mids, amounts=amounts, since=since, session=session).all(),
+            session=session,
+            read_only=True,
+            description="load pending scheme transactions for group matching",
+        )
+        index = SchemeTransactionIndex(candidates)
+        scheme_slugs = self._load_scheme_slugs(payment_transactions, session=session)
+        user_identities = identifier.get_user_identities(
+            [payment_transaction.transaction_id for payment_transaction in payment_transactions], session=session
+        )
+
+        lock_keys = {
+            f"{settings.REDIS_KEY_PREFIX}:matching-lock:{payment_transaction.settlement_key}": payment_transaction
+            for payment_transaction in payment_transactions
+        }
+        matches: list[tuple[MatchResult, models.PaymentTransaction]] = []
+        unhandled: list[models.PaymentTransaction] = []
+
+        with db.redis_locks(lock_keys, timeout=300) as locked_keys:
+            for lock_key, payment_transaction in lock_keys.items():
+                if lock_key not in locked_keys:
+                    self.log.warning(f"Transaction {lock_key} is already locked. Skipping.")
+                    continue
+
+                user_identity = user_identities.get(payment_transaction.transaction_id)
+                # MIDs that couldn't be loaded are left out, so a transaction with none of its MIDs is unhandled.
+                slugs = {
+                    scheme_slugs[mid_id]
+                    for mid_id in payment_transaction.merchant_identifier_ids
+                    if mid_id in scheme_slugs
+                }
+                if user_identity is None or len(slugs) != 1:
+                    unhandled.append(payment_transaction)
+                    continue
+
+                try:
+                    match_result = self._match_in_memory(payment_transaction, user_identity, slugs.pop(), index)
+                except UnsupportedCriterion as ex:
+                    self.log.debug(f"Can't match {payment_transaction} in memory: {ex}")
+                    unhandled.append(payment_transaction)
+                    continue
+                except self.AgentError as ex:
+                    if settings.DEBUG:
+                        raise ex
+                    event_id = sentry_sdk.capture_exception(ex)
+                    self.log.error(
+                        f"Failed to match payment transaction #{payment_transaction.id}: {ex}. "
+                        f"Sentry issue ID: {event_id}."
+                    )
+                    continue
+
+                if match_result is not None:
+                    if match_result.scheme_transaction_id is not None:
+                        index.remove(match_result.scheme_transaction_id)
+                    matches.append((match_result, payment_transaction))
+
+            dropped = self._finalise_matches(matches, session=session)
+            unhandled.extend(dropped)
+
+        self.log.info(
+            f"Matched {len(matches) - len(dropped)} of {len(payment_transactions)} payment transactions in memory. "
+            f"Enqueueing {len(unhandled)} for individual matching."
+        )
+        fallback_queue.enqueue_batch(
+            tasks.match_payment_transaction,
+            [((payment_transaction.settlement_key,), {}) for payment_transaction in unhandled],
+        )
+
+    def _match_in_memory(
+        self,
+        payment_transaction: models.PaymentTransaction,
+        user_identity: models.UserIdentity,
+        slug: str,
+        index: SchemeTransactionIndex,
+    ) -> t.Optional[MatchResult]:
+        try:
+            agent = matching_agents.instantiate(slug, payment_transaction, user_identity)
+        except (NoSuchAgent, RegistryConfigurationError) as ex:
+            if settings.DEBUG:
+                raise ex
+            self.log.warning(
+                f"Failed to instantiate matching agent for slug {slug}: {ex}. Skipping match of {payment_transaction}."
+            )
+            return None
+
+        try:
+            return agent.match_in_memory(index)
+        except agent.NoMatchFound:
+            return None
+        except UnsupportedCriterion:
+            raise
+        except Exception as ex:
+            raise self.AgentError(f"An error occurred when matching with agent {agent}: {ex}") from ex
 
-        if payment_transactions:
-            matching_queue = self._choose_matching_queue(scheme_transactions)
-            self.log.debug(
-                (
-                    f"Found {len(payment_transactions)} potential matching payment transactions. Enqueueing matching "
-                    f"jobs on {matching_queue.name} queue."
+    def _finalise_matches(
+        self, matches: list[tuple[MatchResult, models.PaymentTransaction]], *, session: db.Session
+    ) -> list[models.PaymentTransaction]:
+        """
+        Marks all of the given matches' transactions as MATCHED and saves the matched transactions in a single
+        database transaction, then creates an export for each match.
+
+        Scheme transactions are only marked as MATCHED if they're still PENDING. Matches whose scheme transaction has
+        since been matched by another job are dropped, and their payment transactions are returned.
+        """
+        if not matches:
+            return []
+
+        scheme_transaction_ids = [
+            match_result.scheme_transaction_id
+            for match_result, _ in matches
+            if match_result.scheme_transaction_id is not None
+        ]
+        scheme_transaction = models.SchemeTransaction.__table__
+
+        def mark_transactions():
+            claimed: set[int] = set()
+            if scheme_transaction_ids:
+                claimed = set(
+                    session.execute(
+                        scheme_transaction.update()
+                        .where(
+                            scheme_transaction.c.id.in_(scheme_transaction_ids),
+                            scheme_transaction.c.status == models.TransactionStatus.PENDING,
+                        )
+                        .values(status=models.TransactionStatus.MATCHED)
+                        .returning(scheme_transaction.c.id)
+                    ).scalars()
                 )
+
+            finalised: list[tuple[MatchResult, models.PaymentTransaction]] = []
+            dropped: list[models.PaymentTransaction] = []
+            for match_result, payment_transaction in matches:
+                if match_result.scheme_transaction_id is None or match_result.scheme_transaction_id in claimed:
+                    payment_transaction.status = models.TransactionStatus.MATCHED
+                    session.add(match_result.matched_transaction)
+                    finalised.append((match_result, payment_transaction))
+                else:
+                    dropped.append(payment_transaction)
+
+            session.commit()
+            return finalised, dropped
+
+        finalised, dropped = db.run_query(
+            mark_transactions, session=session, description=f"persist {len(matches)} matched transactions"
+        )
+        self.log.info(f"Persisted {len(finalised)} matched transactions.")
+
+        if dropped:
+            self.log.warning(
+                f"{len(dropped)} matched scheme transactions were matched by another job first. "
+                "Their payment transactions will be matched individually."
             )
-            for payment_transaction in payment_transactions:
-                matching_queue.enqueue(tasks.match_payment_transaction, payment_transaction.settlement_key)
-        else:
-            self.log.debug("Found no matching payment transactions. Exiting matching job.")
+
+        if finalised:
+            self.export_transactions(finalised, session=session)
+        return dropped
 
     def find_transaction_for_redress(
         self,
@@ -297,44 +519,64 @@ class MatchingWorker:
 
         self._finalise_match(match_result, payment_transaction, session=session)
 
+    @staticmethod
+    def _make_export_fields(match_result: MatchResult, payment_transaction: models.PaymentTransaction) -> ExportFields:
+        matched_transaction = match_result.matched_transaction
+        user_identity = match_result.user_identity
+
+        return ExportFields(
+            transaction_id=matched_transaction.transaction_id,
+            feed_type=None,  # matching has no single feed type
+            merchant_slug=matched_transaction.merchant_identifier.loyalty_scheme.slug,
+            transaction_date=matched_transaction.transaction_date,
+            spend_amount=matched_transaction.spend_amount,
+            spend_currency=matched_transaction.spend_currency,
+            loyalty_id=user_identity.loyalty_id,
+            mid=matched_transaction.merchant_identifier.identifier,
+            primary_identifier=matched_transaction.mid,
+            location_id=matched_transaction.merchant_identifier.location_id,
+            merchant_internal_id=matched_transaction.merchant_identifier.merchant_internal_id,
+            user_id=user_identity.user_id,
+            scheme_account_id=user_identity.scheme_account_id,
+            payment_card_account_id=user_identity.payment_card_account_id,
+            credentials=user_identity.credentials,
+            settlement_key=payment_transaction.settlement_key,
+            last_four=user_identity.last_four,
+            expiry_month=user_identity.expiry_month,
+            expiry_year=user_identity.expiry_year,
+            payment_provider_slug=payment_transaction.provider_slug,
+            auth_code=payment_transaction.auth_code,
+            approval_code=payment_transaction.approval_code,
+            extra_fields=matched_transaction.extra_fields,
+        )
+
     def export_transaction(
         self, match_result: MatchResult, payment_transaction: models.PaymentTransaction, *, session: db.Session
     ) -> None:
-        # Save transactions to export table for ongoing export to merchant
-        matched_transaction = match_result.matched_transaction
-        user_identity = match_result.user_identity
+        self.export_transactions([(match_result, payment_transaction)], session=session)
 
-        create_export(
-            ExportFields(
-                transaction_id=matched_transaction.transaction_id,
-                feed_type=None,  # matching has no single feed type
-                merchant_slug=matched_transaction.merchant_identifier.loyalty_scheme.slug,
-                transaction_date=matched_transaction.transaction_date,
-                spend_amount=matched_transaction.spend_amount,
-                spend_currency=matched_transaction.spend_currency,
-                loyalty_id=user_identity.loyalty_id,
-                mid=matched_transaction.merchant_identifier.identifier,
-                primary_identifier=matched_transaction.mid,
-                location_id=matched_transaction.merchant_identifier.location_id,
-                merchant_internal_id=matched_transaction.merchant_identifier.merchant_internal_id,
-                user_id=user_identity.user_id,
-                scheme_account_id=user_identity.scheme_account_id,
-                payment_card_account_id=user_identity.payment_card_account_id,
-                credentials=user_identity.credentials,
-                settlement_key=payment_transaction.settlement_key,
-                last_four=user_identity.last_four,
-                expiry_month=user_identity.expiry_month,
-                expiry_year=user_identity.expiry_year,
-                payment_provider_slug=payment_transaction.provider_slug,
-                auth_code=payment_transaction.auth_code,
-                approval_code=payment_transaction.approval_code,
-                extra_fields=matched_transaction.extra_fields,
-            ),
+    def export_transactions(
+        self, matches: list[tuple[MatchResult, models.PaymentTransaction]], *, session: db.Session
+    ) -> None:
+        # Save transactions to export table for ongoing export to merchant
+        create_exports(
+            [
+                self._make_export_fields(match_result, payment_transaction)
+                for match_result, payment_transaction in matches
+            ],
             session=session,
         )
 
-        def mark_transaction_as_exported():
-            matched_transaction.status = models.MatchedTransactionStatus.EXPORTED
+        matched_transaction_ids = [match_result.matched_transaction.id for match_result, _ in matches]
+
+        def mark_transactions_as_exported():
+            session.query(models.MatchedTransaction).filter(
+                models.MatchedTransaction.id.in_(matched_transaction_ids)
+            ).update(
+                {models.MatchedTransaction.status: models.MatchedTransactionStatus.EXPORTED}, synchronize_session=False
+            )
             session.commit()
 
-        db.run_query(mark_transaction_as_exported, session=session, description="mark matched transaction as exported")
+        db.run_query(
+            mark_transactions_as_exported, session=session, description="mark matched transactions as exported"
+        )
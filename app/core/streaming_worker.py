@@ -3,7 +3,7 @@ from typing import cast
 from sqlalchemy import any_
 
 from app import db, models
-from app.core.export_director import ExportFields, create_export
+from app.core.export_director import ExportFields, create_export, create_exports
 from app.feeds import FeedType
 from app.registry import NoSuchAgent
 from app.reporting import get_logger
@@ -47,7 +47,58 @@ class StreamingWorker:
             self._handle(transaction, user_identity, merchant_identifier, session=session)
 
     def handle_transactions(self, match_group: str, *, session: db.Session) -> None:
-        raise NotImplementedError
+        """
+        Streams every transaction in the given group, loading them with a single query & creating their exports in bulk.
+        Transactions without a user identity are skipped, as they are in handle_transaction.
+        """
+
+        def load_data():
+            return (
+                session.query(models.Transaction, models.UserIdentity, models.MerchantIdentifier)
+                .join(
+                    models.MerchantIdentifier,
+                    models.MerchantIdentifier.id == any_(models.Transaction.merchant_identifier_ids),
+                )
+                .join(models.UserIdentity, models.UserIdentity.transaction_id == models.Transaction.transaction_id)
+                .filter(models.Transaction.match_group == match_group)
+                .order_by(models.Transaction.id, models.MerchantIdentifier.id)
+                .all()
+            )
+
+        rows = db.run_query(
+            load_data,
+            session=session,
+            read_only=True,
+            description=f"load streaming data for group #{match_group}",
+        )
+
+        agents: dict[str, BaseStreamingAgent | None] = {}
+        streamed_transaction_ids: set[int] = set()
+        export_fields: list[ExportFields] = []
+        for transaction, user_identity, merchant_identifier in rows:
+            # a transaction with several merchant identifiers is only streamed once.
+            if transaction.id in streamed_transaction_ids:
+                continue
+            streamed_transaction_ids.add(transaction.id)
+
+            if transaction.merchant_slug not in agents:
+                try:
+                    agents[transaction.merchant_slug] = cast(
+                        BaseStreamingAgent, streaming_agents.instantiate(transaction.merchant_slug)
+                    )
+                except NoSuchAgent:
+                    log.debug(f"No streaming agent is registered for slug {transaction.merchant_slug}.")
+                    agents[transaction.merchant_slug] = None
+
+            agent = agents[transaction.merchant_slug]
+            if agent is not None and agent.should_stream(transaction):
+                export_fields.append(self._make_export_fields(transaction, user_identity, merchant_identifier))
+
+        create_exports(export_fields, session=session)
+        log.info(
+            f"Streamed {len(export_fields)} of {len(streamed_transaction_ids)} identified transactions "
+            f"in group #{match_group}."
+        )
 
     def _handle(
         self,
@@ -57,31 +108,36 @@ class StreamingWorker:
         *,
         session: db.Session,
     ) -> None:
-        create_export(
-            ExportFields(
-                transaction_id=transaction.transaction_id,
-                feed_type=transaction.feed_type,
-                merchant_slug=transaction.merchant_slug,
-                transaction_date=transaction.transaction_date,
-                spend_amount=transaction.spend_amount,
-                spend_currency=transaction.spend_currency,
-                loyalty_id=user_identity.loyalty_id,
-                mid=merchant_identifier.identifier,
-                primary_identifier=transaction.mids[0],
-                location_id=merchant_identifier.location_id,
-                merchant_internal_id=merchant_identifier.merchant_internal_id,
-                user_id=user_identity.user_id,
-                scheme_account_id=user_identity.scheme_account_id,
-                payment_card_account_id=user_identity.payment_card_account_id,
-                credentials=user_identity.credentials,
-                settlement_key=transaction.settlement_key,
-                last_four=user_identity.last_four,
-                expiry_month=user_identity.expiry_month,
-                expiry_year=user_identity.expiry_year,
-                payment_provider_slug=transaction.payment_provider_slug,
-                auth_code=transaction.auth_code,
-                approval_code=transaction.approval_code,
-                extra_fields=transaction.extra_fields,
-            ),
-            session=session,
+        create_export(self._make_export_fields(transaction, user_identity, merchant_identifier), session=session)
+
+    @staticmethod
+    def _make_export_fields(
+        transaction: models.Transaction,
+        user_identity: models.UserIdentity,
+        merchant_identifier: models.MerchantIdentifier,
+    ) -> ExportFields:
+        return ExportFields(
+            transaction_id=transaction.transaction_id,
+            feed_type=transaction.feed_type,
+            merchant_slug=transaction.merchant_slug,
+            transaction_date=transaction.transaction_date,
+            spend_amount=transaction.spend_amount,
+            spend_currency=transaction.spend_currency,
+            loyalty_id=user_identity.loyalty_id,
+            mid=merchant_identifier.identifier,
+            primary_identifier=transaction.mids[0],
+            location_id=merchant_identifier.location_id,
+            merchant_internal_id=merchant_identifier.merchant_internal_id,
+            user_id=user_identity.user_id,
+            scheme_account_id=user_identity.scheme_account_id,
+            payment_card_account_id=user_identity.payment_card_account_id,
+            credentials=user_identity.credentials,
+            settlement_key=transaction.settlement_key,
+            last_four=user_identity.last_four,
+            expiry_month=user_identity.expiry_month,
+            expiry_year=user_identity.expiry_year,
+            payment_provider_slug=transaction.payment_provider_slug,
+            auth_code=transaction.auth_code,
+            approval_code=transaction.approval_code,
+            extra_fields=transaction.extra_fields,
         )
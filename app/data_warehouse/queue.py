@@ -1,8 +1,13 @@
 import logging
+import os
+import threading
+import time
+import typing as t
+from collections import deque
 
-from kombu import Producer, Queue
+from kombu import Connection, Producer, Queue
 
-from app.data_warehouse.connector import queue_connection
+import settings
 
 log = logging.getLogger(__name__)
 
@@ -18,12 +23,137 @@ dw_queue = Queue(
     },
 )
 
+# how long to wait after failing to reach RabbitMQ before trying again.
+RECONNECT_DELAY = 5
+
 
 def _on_error(exc, interval):
     log.warning(f"Failed to connect to RabbitMQ: {exc}. Will retry after {interval:.1f}s...")
 
 
+class Emitter:
+    """
+    Publishes data warehouse events from a background thread, so that callers only pay for an in-memory append.
+
+    Events are published in batches of up to DW_PUBLISH_BATCH_SIZE, or every DW_PUBLISH_INTERVAL seconds, on a single
+    channel with publisher confirms. If RabbitMQ can't be reached, up to DW_SPOOL_SIZE events are kept until it can.
+    When the spool is full the oldest events are dropped.
+
+    The thread doesn't survive a fork. A child process gets an empty spool and starts its own thread when needed.
+    """
+
+    def __init__(self) -> None:
+        self._events: t.Deque[dict] = deque()
+        self._condition = threading.Condition()
+        self._thread: t.Optional[threading.Thread] = None
+        self._in_flight = 0
+        self._flush_requested = False
+
+    def __len__(self) -> int:
+        return len(self._events) + self._in_flight
+
+    def _after_fork(self) -> None:
+        self.__init__()  # type: ignore[misc]
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="data-warehouse-emitter", daemon=True)
+            self._thread.start()
+
+    def add(self, message: dict) -> None:
+        with self._condition:
+            self._events.append(message)
+
+            dropped = len(self._events) - settings.DW_SPOOL_SIZE
+            if dropped > 0:
+                for _ in range(dropped):
+                    self._events.popleft()
+                log.warning(f"Data warehouse event spool is full. Dropped the {dropped} oldest events.")
+
+            self._ensure_thread()
+            if len(self._events) >= settings.DW_PUBLISH_BATCH_SIZE:
+                self._condition.notify_all()
+
+    def flush(self, timeout: float = 5) -> bool:
+        """
+        Waits for every event added so far to be published. Returns false if that takes longer than `timeout` seconds.
+        """
+        with self._condition:
+            if not self._events and not self._in_flight:
+                return True
+
+            self._ensure_thread()
+            self._flush_requested = True
+            self._condition.notify_all()
+            flushed = self._condition.wait_for(lambda: not self._events and not self._in_flight, timeout=timeout)
+
+        if not flushed:
+            log.warning(f"Timed out waiting for {len(self)} data warehouse events to be published.")
+        return flushed
+
+    def _next_batch(self) -> t.List[dict]:
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._flush_requested or len(self._events) >= settings.DW_PUBLISH_BATCH_SIZE,
+                timeout=settings.DW_PUBLISH_INTERVAL,
+            )
+            batch = [self._events.popleft() for _ in range(min(len(self._events), settings.DW_PUBLISH_BATCH_SIZE))]
+            self._in_flight = len(batch)
+            if not self._events:
+                self._flush_requested = False
+            return batch
+
+    def _finish_batch(self, batch: t.List[dict], *, published: bool) -> None:
+        with self._condition:
+            if not published:
+                self._events.extendleft(reversed(batch))
+            self._in_flight = 0
+            self._condition.notify_all()
+
+    @staticmethod
+    def _connect() -> t.Tuple[Connection, Producer]:
+        connection = Connection(settings.RABBITMQ_DSN, connect_timeout=3, transport_options={"confirm_publish": True})
+        try:
+            connection.ensure_connection(
+                errback=_on_error, max_retries=3, interval_start=0.2, interval_step=0.4, interval_max=1, timeout=3
+            )
+            return connection, Producer(channel=connection.default_channel, routing_key=dw_queue_name)
+        except Exception:
+            connection.release()
+            raise
+
+    def _run(self) -> None:
+        connection: t.Optional[Connection] = None
+        producer: t.Optional[Producer] = None
+
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                continue
+
+            try:
+                if producer is None:
+                    connection, producer = self._connect()
+                for message in batch:
+                    producer.publish(message)
+            except Exception as ex:
+                log.warning(f"Failed to publish {len(batch)} data warehouse events: {ex}")
+                self._finish_batch(batch, published=False)
+                if connection is not None:
+                    connection.release()
+                connection = producer = None
+                time.sleep(RECONNECT_DELAY)
+            else:
+                self._finish_batch(batch, published=True)
+
+
+emitter = Emitter()
+os.register_at_fork(after_in_child=emitter._after_fork)
+
+
 def add(message: dict) -> None:
-    channel = queue_connection().channel()
-    producer = Producer(channel=channel, routing_key=dw_queue_name)
-    producer.publish(message)
+    emitter.add(message)
+
+
+def flush(timeout: float = 5) -> bool:
+    return emitter.flush(timeout)
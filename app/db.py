@@ -1,3 +1,5 @@
+import os
+import time
 import typing as t
 from contextlib import contextmanager
 from uuid import uuid4
@@ -5,28 +7,117 @@ from uuid import uuid4
 import sqlalchemy as s
 from redis import Redis
 from sqlalchemy.exc import DBAPIError, IntegrityError
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.ext.declarative import declarative_base, declared_attr
 from sqlalchemy.orm import Session, sessionmaker
 from sqlalchemy.orm.exc import NoResultFound  # noqa
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, QueuePool
 
 import settings
 from app import encoding, postgres
+from app.prometheus import bink_prometheus
 from app.reporting import get_logger
 
+log = get_logger("db")
+
+
+class PoolMetrics:
+    prometheus_metrics = {
+        "counters": ["db_pool_checkouts"],
+        "histograms": ["db_pool_checkout_wait"],
+        "gauges": ["db_pool_checked_out"],
+    }
+
+
+pool_metrics = PoolMetrics()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    A QueuePool that reports connection checkout counts & wait times to Prometheus.
+    """
+
+    def _do_get(self):
+        start = time.perf_counter()
+        connection = super()._do_get()
+        bink_prometheus.observe_histogram(
+            agent=pool_metrics,
+            histogram_name="db_pool_checkout_wait",
+            value=time.perf_counter() - start,
+            process_type="db",
+            slug=settings.POSTGRES_POOL_MODE,
+        )
+        bink_prometheus.increment_counter(
+            agent=pool_metrics,
+            counter_name="db_pool_checkouts",
+            increment_by=1,
+            process_type="db",
+            slug=settings.POSTGRES_POOL_MODE,
+        )
+        return connection
+
+
+def _pool_args(pool_mode: str) -> dict[str, t.Any]:
+    if pool_mode == "null":
+        return {"poolclass": NullPool}
+
+    pool_args: dict[str, t.Any] = {
+        "poolclass": InstrumentedQueuePool,
+        "pool_size": settings.POSTGRES_POOL_SIZE,
+        "max_overflow": settings.POSTGRES_POOL_MAX_OVERFLOW,
+        "pool_timeout": settings.POSTGRES_POOL_TIMEOUT,
+        "pool_recycle": settings.POSTGRES_POOL_RECYCLE,
+    }
+
+    if pool_mode == "queue":
+        pool_args["pool_pre_ping"] = settings.POSTGRES_POOL_PRE_PING
+    elif pool_mode == "pgbouncer":
+        # pgbouncer checks its own server connections, so pinging it only adds a round trip.
+        # LIFO checkout lets surplus client connections go idle and get closed by pgbouncer.
+        pool_args["pool_pre_ping"] = False
+        pool_args["pool_use_lifo"] = True
+    else:
+        raise ValueError(f"Unknown Postgres pool mode: {pool_mode}. Expected one of null, queue, pgbouncer.")
+
+    return pool_args
+
+
 engine = s.create_engine(
     settings.POSTGRES_DSN,
     connect_args=settings.POSTGRES_CONNECT_ARGS,
-    poolclass=NullPool,
     json_serializer=encoding.dumps,
     json_deserializer=encoding.loads,
     echo=settings.TRACE_QUERY_SQL,
+    **_pool_args(settings.POSTGRES_POOL_MODE),
 )
 
 SessionMaker = sessionmaker(bind=engine)
 Base = declarative_base()  # type: t.Any
 
-log = get_logger("db")
+
+def _update_checked_out_gauge(*_) -> None:
+    if isinstance(engine.pool, QueuePool):
+        bink_prometheus.update_gauge(
+            agent=pool_metrics,
+            gauge_name="db_pool_checked_out",
+            value=engine.pool.checkedout(),
+            process_type="db",
+            slug=settings.POSTGRES_POOL_MODE,
+        )
+
+
+s.event.listen(engine, "checkout", _update_checked_out_gauge)
+s.event.listen(engine, "checkin", _update_checked_out_gauge)
+
+
+def _reset_pool_after_fork() -> None:
+    """
+    Gives forked processes (such as RQ work horses) a fresh pool.
+    The parent's connections are left open for the parent to keep using.
+    """
+    engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_reset_pool_after_fork)
 
 
 @contextmanager
@@ -146,6 +237,55 @@ class ModelMixin:
     updated_at = s.Column(s.DateTime, onupdate=postgres.utcnow())
 
 
+class PartitionedModelMixin(ModelMixin):
+    """
+    For tables that are range partitioned by created_at. Such tables need this in their __table_args__:
+    {"postgresql_partition_by": PARTITION_BY}
+
+    Postgres requires the partition key to be part of the primary key, but rows are still identified by id alone.
+    See app.partitions for creating & dropping the partitions themselves.
+    """
+
+    id = s.Column(s.Integer, primary_key=True, autoincrement=True)
+
+    created_at = s.Column(s.DateTime, primary_key=True, nullable=False, server_default=postgres.utcnow())
+    updated_at = s.Column(s.DateTime, onupdate=postgres.utcnow())
+
+    @declared_attr
+    def __mapper_args__(cls):
+        return {"primary_key": [cls.__table__.c.id]}
+
+
+PARTITION_BY = "RANGE (created_at)"
+
+
+def key_table(table: s.Table) -> t.Optional[s.Table]:
+    """
+    Returns the table holding the unique keys of a partitioned table's rows, if it has one.
+    Postgres only enforces a partitioned table's unique constraints within each partition, so tables that need a
+    unique key across all partitions name a non-partitioned key table in their __table_args__:
+    {"info": {"key_table": "<table>_key"}}
+
+    See app.imports.ingestion for how inserted rows claim their keys.
+    """
+    name = table.info.get("key_table")
+    return table.metadata.tables[name] if name else None
+
+
+@s.event.listens_for(Base.metadata, "after_create")
+def _create_default_partitions(metadata: s.MetaData, connection: s.engine.Connection, **kwargs) -> None:
+    # a partitioned table can't hold any rows until it has a partition, so every one starts with a default partition.
+    quote = connection.dialect.identifier_preparer.quote
+    for table in kwargs["tables"]:
+        if table.dialect_options["postgresql"]["partition_by"]:
+            connection.execute(
+                s.text(
+                    f"CREATE TABLE IF NOT EXISTS {quote(table.name + '_default')} "
+                    f"PARTITION OF {quote(table.name)} DEFAULT"
+                )
+            )
+
+
 redis = Redis.from_url(
     settings.REDIS_URL,
     socket_connect_timeout=3,
@@ -163,6 +303,46 @@ redis_raw = Redis.from_url(
 )
 
 
+_release_lock = redis.register_script(
+    """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+        return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+)
+
+
+@contextmanager
+def redis_locks(keys: t.Iterable[str], *, timeout: int) -> t.Iterator[set[str]]:
+    """
+    Attempts to lock each of the given keys with a single pipelined round trip.
+    Yields the set of keys that were acquired. Keys that are already locked are left out.
+    Locks are compatible with `redis.lock` and are released on exit.
+    """
+    keys = list(keys)
+    token = uuid4().hex
+
+    pipe = redis.pipeline(transaction=False)
+    for key in keys:
+        pipe.set(key, token, nx=True, ex=timeout)
+    acquired = {key for key, locked in zip(keys, pipe.execute()) if locked}
+
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            pipe = redis.pipeline(transaction=False)
+            for key in acquired:
+                _release_lock(keys=[key], args=[token], client=pipe)
+            pipe.execute()
+
+
+def redis_glob_escape(text: str) -> str:
+    """Escapes the characters that have a special meaning in redis glob-style patterns."""
+    return "".join(f"\\{c}" if c in "\\*?[]" else c for c in text)
+
+
 def redis_scan(pattern: str) -> t.Iterator[str]:
     """
     simply wraps `redis.scan_iter(pattern)` to provide correct type hints.
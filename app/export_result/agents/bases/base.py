@@ -4,7 +4,7 @@ from decimal import Decimal
 
 import settings
 from app.reporting import get_logger
-from app.service.atlas import AuditTransaction, make_audit_result, queue_audit_message
+from app.service.atlas import AuditTransaction, flush_audit_messages, make_audit_result, queue_audit_message
 from app.utils import missing_property
 
 
@@ -37,6 +37,7 @@ class BaseAgent:
     ) -> int:
         for result in export_results:
             self._enqueue(result, export_transaction_callback(result), source)
+        flush_audit_messages()
         return len(export_results)
 
     def _enqueue(self, result: dict, export_transaction: list[AuditTransaction], source) -> None:
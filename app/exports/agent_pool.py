@@ -0,0 +1,159 @@
+import time
+import typing as t
+
+from redis.exceptions import RedisError
+
+import settings
+from app import db
+from app.config import Config
+from app.exports.agents import BaseAgent
+from app.exports.agents.registry import export_agents
+from app.prometheus import bink_prometheus
+from app.reporting import get_logger
+
+log = get_logger("export-agent-pool")
+
+
+class _PoolEntry(t.NamedTuple):
+    agent: BaseAgent
+    config_version: t.Optional[tuple]
+    refreshed_at: float
+
+
+class ExportAgentPool:
+    """
+    Keeps one instance of each export agent for the lifetime of a worker process, so that agents and their merchant
+    configuration are built once rather than for every export job.
+
+    RQ workers fork a work horse process for every job, so anything a job does to the pool is lost when it ends.
+    Agents are therefore warmed up and refreshed in the worker process, between jobs, and each job only reads the
+    agents it inherits. HTTP connections opened during a job belong to its work horse and close with it.
+
+    Agents are refreshed when any of their config values change, or when they have been in the pool for longer than
+    EXPORT_AGENT_MAX_AGE seconds.
+    """
+
+    prometheus_metrics = {
+        "counters": ["export_agent_pool_hits", "export_agent_pool_misses"],
+        "histograms": ["export_agent_construction"],
+    }
+
+    def __init__(self) -> None:
+        self._entries: t.Dict[str, _PoolEntry] = {}
+
+    def __contains__(self, provider_slug: str) -> bool:
+        return provider_slug in self._entries
+
+    @staticmethod
+    def _config_version(agent: BaseAgent) -> t.Optional[tuple]:
+        config: t.Optional[Config] = getattr(agent, "config", None)
+        if config is None or not config.keys:
+            return None
+
+        try:
+            return tuple(db.redis.mget(config.keys))
+        except RedisError as ex:
+            log.warning(f"Error getting config for {agent} from redis: {ex}")
+            return None
+
+    def _create(self, provider_slug: str) -> BaseAgent:
+        start = time.perf_counter()
+        agent = t.cast(BaseAgent, export_agents.instantiate(provider_slug))
+        agent.warm_up()
+        bink_prometheus.observe_histogram(
+            agent=self,
+            histogram_name="export_agent_construction",
+            value=time.perf_counter() - start,
+            process_type="export",
+            slug=provider_slug,
+        )
+
+        self._entries[provider_slug] = _PoolEntry(agent, self._config_version(agent), time.monotonic())
+        return agent
+
+    def _refresh(self, provider_slug: str, entry: _PoolEntry, config_version: t.Optional[tuple]) -> None:
+        log.info(f"Refreshing {entry.agent}.")
+        try:
+            entry.agent.refresh()
+        except Exception as ex:
+            log.warning(f"Failed to refresh {entry.agent}, it will be rebuilt: {ex}")
+            self.remove(provider_slug)
+            try:
+                self._create(provider_slug)
+            except Exception as ex:
+                log.warning(f"Failed to rebuild export agent {provider_slug}: {ex}")
+            return
+
+        self._entries[provider_slug] = _PoolEntry(entry.agent, config_version, time.monotonic())
+
+    def get(self, provider_slug: str) -> BaseAgent:
+        """
+        Returns the pooled agent for the given slug, creating it if it doesn't exist yet.
+        Agents are never refreshed here, see `refresh_stale`.
+        Raises registry errors such as NoSuchAgent in the same way as `export_agents.instantiate`.
+        """
+        if not settings.EXPORT_AGENT_POOL:
+            return t.cast(BaseAgent, export_agents.instantiate(provider_slug))
+
+        entry = self._entries.get(provider_slug)
+        if entry is None:
+            bink_prometheus.increment_counter(
+                agent=self,
+                counter_name="export_agent_pool_misses",
+                increment_by=1,
+                process_type="export",
+                slug=provider_slug,
+            )
+            return self._create(provider_slug)
+
+        bink_prometheus.increment_counter(
+            agent=self, counter_name="export_agent_pool_hits", increment_by=1, process_type="export", slug=provider_slug
+        )
+        return entry.agent
+
+    def refresh_stale(self) -> None:
+        """
+        Refreshes agents whose config has changed, or that have been pooled for longer than EXPORT_AGENT_MAX_AGE.
+        Export workers call this before each export job is forked, so that the job inherits up-to-date agents.
+        """
+        for provider_slug, entry in list(self._entries.items()):
+            config_version = self._config_version(entry.agent)
+            if config_version != entry.config_version:
+                self._refresh(provider_slug, entry, config_version)
+            elif time.monotonic() - entry.refreshed_at >= settings.EXPORT_AGENT_MAX_AGE:
+                self._refresh(provider_slug, entry, config_version)
+
+    def warm_up(self, provider_slugs: t.Optional[t.Iterable[str]] = None) -> None:
+        """
+        Creates agents for the given slugs, or every registered export agent if none are given.
+        Agents that fail to build are logged & skipped, and each job that uses them builds its own instead.
+        """
+        if provider_slugs is None:
+            provider_slugs = export_agents.keys()
+
+        for provider_slug in provider_slugs:
+            if provider_slug in self._entries:
+                continue
+            try:
+                self._create(provider_slug)
+            except Exception as ex:
+                log.warning(f"Failed to warm up export agent {provider_slug}: {ex}")
+
+        log.info(f"Warmed up {len(self._entries)} export agents: {', '.join(self._entries)}.")
+
+    def remove(self, provider_slug: str) -> None:
+        entry = self._entries.pop(provider_slug, None)
+        if entry is None:
+            return
+
+        try:
+            entry.agent.teardown()
+        except Exception as ex:
+            log.warning(f"Failed to tear down {entry.agent}: {ex}")
+
+    def teardown(self) -> None:
+        for provider_slug in list(self._entries):
+            self.remove(provider_slug)
+
+
+export_agent_pool = ExportAgentPool()
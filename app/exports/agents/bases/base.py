@@ -51,6 +51,24 @@ class BaseAgent:
     def __str__(self) -> str:
         return f"export agent {type(self).__name__} for {self.provider_slug}"
 
+    def warm_up(self) -> None:
+        """
+        Called once after the agent is created by the export agent pool.
+        Agents can override this to prepare anything that is expensive to set up on first use.
+        """
+
+    def refresh(self) -> None:
+        """
+        Called by the export agent pool when the agent's config has changed, or it has been pooled for too long.
+        Agents that load configuration or secrets in __init__ should override this to reload them.
+        """
+
+    def teardown(self) -> None:
+        """
+        Called when the agent is removed from the export agent pool.
+        Agents should override this to close any connections or sessions they hold.
+        """
+
     def run(self):
         raise NotImplementedError("This method should be overridden by specialised base agents.")
 
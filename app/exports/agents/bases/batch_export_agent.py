@@ -71,6 +71,8 @@ class BatchExportAgent(BaseAgent):
 
             self._save_export_transactions(export_data, session=session)
 
+        atlas.flush_audit_messages()
+
         def delete_pending_exports():
             num_deleted = (
                 session.query(models.PendingExport)
@@ -4,6 +4,7 @@ from contextlib import ExitStack, contextmanager
 import humanize
 import pendulum
 import sentry_sdk
+import sqlalchemy as s
 from requests import RequestException, Response
 
 from app import db, models
@@ -69,6 +70,11 @@ class SingularExportAgent(BaseAgent):
     def find_export_transaction(
         self, pending_export: models.PendingExport, *, session: db.Session
     ) -> models.ExportTransaction:
+        # the export director loads the export transaction along with its pending export.
+        preloaded = s.inspect(pending_export).attrs.export_transaction.loaded_value
+        if isinstance(preloaded, models.ExportTransaction):
+            return preloaded
+
         def find_transaction():
             return session.query(models.ExportTransaction).get(pending_export.export_transaction_id)
 
@@ -133,9 +139,7 @@ class SingularExportAgent(BaseAgent):
 
             retry_at = self.get_retry_datetime(pending_export.retry_count, exception=ex)
 
-            failure_reason = repr(ex)
-            if isinstance(ex, RequestException) and (reason := self.get_response_result(ex.response)):
-                failure_reason = f"{failure_reason} ({reason})"
+            failure_reason = self.get_failure_reason(ex)
 
             if retry_at:
                 retry_humanized = humanize.naturaltime(retry_at.naive())
@@ -186,6 +190,12 @@ class SingularExportAgent(BaseAgent):
 
         db.run_query(delete_pending_export, session=session, description="delete pending export")
 
+    def get_failure_reason(self, ex: Exception) -> str:
+        failure_reason = repr(ex)
+        if isinstance(ex, RequestException) and (reason := self.get_response_result(ex.response)):
+            failure_reason = f"{failure_reason} ({reason})"
+        return failure_reason
+
     def get_response_result(self, response: Response) -> t.Optional[str]:
         """
         Override in your agent to get an error code/message from the given response.
@@ -37,20 +37,23 @@ class Iceland(BatchExportAgent, SoteriaConfigMixin):
 
     def __init__(self):
         super().__init__()
+        self.refresh()
 
+        # Set up Prometheus metric types
+        self.prometheus_metrics = {
+            "counters": ["requests_sent", "failed_requests", "transactions"],
+            "histograms": ["request_latency"],
+        }
+
+    def refresh(self) -> None:
         self.merchant_config = self.get_soteria_config()
+        self.api: t.Union[IcelandAPI, IcelandMockAPI]
         if settings.DEBUG is True:
             # Use mocked Iceland endpoints
             self.api = IcelandMockAPI(self.merchant_config.merchant_url)
         else:
             self.api = IcelandAPI(self.merchant_config.merchant_url)
 
-        # Set up Prometheus metric types
-        self.prometheus_metrics = {
-            "counters": ["requests_sent", "failed_requests", "transactions"],
-            "histograms": ["request_latency"],
-        }
-
     @staticmethod
     def get_loyalty_identifier(export_transaction: models.ExportTransaction) -> str:
         return export_transaction.decrypted_credentials["merchant_identifier"]
@@ -50,6 +50,12 @@ class SlimChickens(SingularExportAgent):
         self.bink_prometheus = bink_prometheus
         self.spend_threshold = 750
 
+    def refresh(self) -> None:
+        self.secrets = _read_secrets(SLIM_CHICKENS_SECRET_KEY)
+
+    def teardown(self) -> None:
+        self.session.close()
+
     def get_transaction_token(self, transaction: models.ExportTransaction, session: Session) -> str:
         username = transaction.decrypted_credentials["email"]
         password = transaction.decrypted_credentials["password"]
@@ -0,0 +1,273 @@
+import asyncio
+import queue
+import time
+import typing as t
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import pendulum
+import sqlalchemy as s
+from sqlalchemy import or_
+from sqlalchemy.orm import joinedload
+
+import settings
+from app import db, models
+from app.exports import rate_limit
+from app.exports.agents.bases.base import AgentExportData
+from app.exports.agents.bases.singular_export_agent import SingularExportAgent
+from app.exports.exceptions import MissingExportData
+from app.exports.models import ExportTransactionStatus
+from app.reporting import get_logger
+from app.service import atlas
+
+
+class _Export(t.NamedTuple):
+    pending_export: models.PendingExport
+    export_data: AgentExportData
+    retry_count: int
+
+
+class _Deferred:
+    """Returned by a send that was held back by the merchant's rate limit."""
+
+
+DEFERRED = _Deferred()
+
+
+class AsyncExportExecutor:
+    """
+    Exports a singular export agent's pending exports in batches, sending each batch concurrently.
+
+    The agent's own find_export_transaction, make_export_data, export & get_retry_datetime methods are used unchanged.
+    Each export is run on a thread, with its own database session & its own instance of the agent, while asyncio caps
+    how many are in flight at once. Outcomes are written back for the whole batch at once.
+
+    Merchants exported this way are listed in EXPORT_ASYNC_SLUGS. Their pending exports are not put on the export
+    queue, nor requeued by the export retry worker.
+    """
+
+    def __init__(self, agent: SingularExportAgent, *, concurrency: t.Optional[int] = None) -> None:
+        self.agent = agent
+        self.log = get_logger(f"async-export-executor.{agent.provider_slug}")
+        self.concurrency = concurrency
+
+        # agents aren't safe to share between threads, so each send borrows one of these instead of using self.agent.
+        self._idle_agents: "queue.SimpleQueue[SingularExportAgent]" = queue.SimpleQueue()
+
+    def _get_concurrency(self, session: db.Session) -> int:
+        if self.concurrency:
+            return self.concurrency
+
+        # a merchant's concurrency limit is also the most we can usefully send at once.
+        limits = rate_limit.get_limits(self.agent.provider_slug, session=session)
+        if limits.concurrency > 0:
+            return min(limits.concurrency, settings.EXPORT_ASYNC_CONCURRENCY)
+        return settings.EXPORT_ASYNC_CONCURRENCY
+
+    def _claim_pending_exports(self, *, session: db.Session) -> t.List[int]:
+        """
+        Claims the next batch of due pending exports by leasing them for EXPORT_ASYNC_LEASE seconds, and commits
+        straight away so that no locks are held while the batch is sent. If the executor stops before the batch's
+        outcomes are saved, its pending exports become due again when the lease runs out.
+
+        Returns the IDs of the claimed pending exports.
+        """
+        now = pendulum.now("UTC")
+        pending_export = models.PendingExport.__table__
+        due = (
+            s.select(pending_export.c.id)
+            .where(
+                pending_export.c.provider_slug == self.agent.provider_slug,
+                or_(pending_export.c.retry_at.is_(None), pending_export.c.retry_at <= now),
+                or_(pending_export.c.leased_until.is_(None), pending_export.c.leased_until <= now),
+            )
+            .order_by(pending_export.c.id)
+            .limit(settings.EXPORT_ASYNC_BATCH_SIZE)
+            .with_for_update(skip_locked=True)
+            .cte("due")
+        )
+        statement = (
+            s.update(pending_export)
+            .where(pending_export.c.id == due.c.id)
+            .values(leased_until=now.add(seconds=settings.EXPORT_ASYNC_LEASE))
+            .returning(pending_export.c.id)
+        )
+
+        def claim():
+            claimed = session.execute(statement).scalars().all()
+            session.commit()
+            return claimed
+
+        return db.run_query(claim, session=session, description=f"claim {self.agent.provider_slug} pending exports")
+
+    def _load_pending_exports(self, ids: t.Iterable[int], *, session: db.Session) -> t.List[models.PendingExport]:
+        return db.run_query(
+            lambda: session.query(models.PendingExport)
+            .options(joinedload(models.PendingExport.export_transaction))
+            .filter(models.PendingExport.id.in_(ids))
+            .order_by(models.PendingExport.id)
+            .all(),
+            session=session,
+            read_only=True,
+            description=f"load {self.agent.provider_slug} pending exports",
+        )
+
+    @contextmanager
+    def _borrow_agent(self) -> t.Iterator[SingularExportAgent]:
+        try:
+            agent = self._idle_agents.get_nowait()
+        except queue.Empty:
+            agent = type(self.agent)()
+        try:
+            yield agent
+        finally:
+            self._idle_agents.put(agent)
+
+    def _send(self, export: _Export) -> t.Union[None, Exception, _Deferred]:
+        try:
+            with rate_limit.limit(self.agent.provider_slug):
+                with self._borrow_agent() as agent, db.session_scope() as session:
+                    with agent._update_metrics(export_data=export.export_data, session=session):
+                        agent.export(export.export_data, retry_count=export.retry_count, session=session)
+        except rate_limit.RateLimited:
+            return DEFERRED
+        except Exception as ex:
+            return ex
+        return None
+
+    async def _send_all(
+        self, exports: t.List[_Export], *, concurrency: int
+    ) -> t.List[t.Union[None, Exception, _Deferred]]:
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="export") as executor:
+
+            async def send(export: _Export) -> t.Union[None, Exception, _Deferred]:
+                async with semaphore:
+                    return await loop.run_in_executor(executor, self._send, export)
+
+            return await asyncio.gather(*(send(export) for export in exports))
+
+    def run_batch(self, *, session: db.Session) -> int:
+        """
+        Exports the next batch of due pending exports.
+        Returns how many were dealt with, which excludes any that were held back by the merchant's rate limit.
+        """
+        claimed = self._claim_pending_exports(session=session)
+        if not claimed:
+            return 0
+
+        pending_exports = self._load_pending_exports(claimed, session=session)
+
+        exports: t.List[_Export] = []
+        finished: t.List[models.PendingExport] = []
+        failed: t.List[models.ExportTransaction] = []
+
+        for pending_export in pending_exports:
+            try:
+                export_transaction = self.agent.find_export_transaction(pending_export, session=session)
+            except db.NoResultFound:
+                self.log.warning(f"No export transaction was found for {pending_export}. It will be discarded.")
+                finished.append(pending_export)
+                continue
+
+            # retry_at is only set when an export fails, so it means this is a retry.
+            retry_count = pending_export.retry_count + (1 if pending_export.retry_at is not None else 0)
+
+            try:
+                export_data = self.agent.make_export_data(export_transaction, session)
+            except MissingExportData as ex:
+                self.log.error(f"Failed to export {export_transaction} due to missing data: {ex}.")
+                failed.append(export_transaction)
+                finished.append(pending_export)
+                continue
+
+            if not self.agent.should_send_export(export_transaction, retry_count, session):
+                finished.append(pending_export)
+                continue
+
+            exports.append(_Export(pending_export, export_data, retry_count))
+
+        concurrency = self._get_concurrency(session)
+
+        # end the transaction before sending, without expiring the objects that the sends & outcomes still use.
+        expire_on_commit = session.expire_on_commit
+        session.expire_on_commit = False
+        try:
+            session.commit()
+        finally:
+            session.expire_on_commit = expire_on_commit
+
+        results = asyncio.run(self._send_all(exports, concurrency=concurrency)) if exports else []
+
+        retries: t.List[dict] = []
+        exported: t.List[models.ExportTransaction] = []
+        deferred = 0
+        for export, result in zip(exports, results):
+            if result is DEFERRED:
+                # give back the lease, so the export is due again straight away.
+                deferred += 1
+                retries.append({"id": export.pending_export.id, "leased_until": None})
+                continue
+
+            if result is None:
+                exported.extend(export.export_data.transactions)
+                finished.append(export.pending_export)
+                continue
+
+            error = t.cast(Exception, result)
+            failure_reason = self.agent.get_failure_reason(error)
+            retry_at = self.agent.get_retry_datetime(export.retry_count, exception=error)
+            if retry_at:
+                self.log.warning(f"{export.pending_export} failed: {failure_reason}. It will be retried at {retry_at}.")
+                retries.append(
+                    {
+                        "id": export.pending_export.id,
+                        "retry_count": export.retry_count,
+                        "retry_at": retry_at,
+                        "leased_until": None,
+                        "failure_reason": failure_reason,
+                    }
+                )
+            else:
+                self.log.warning(f"{export.pending_export} failed: {failure_reason}. It has run out of retries.")
+                failed.extend(export.export_data.transactions)
+                finished.append(export.pending_export)
+
+        def save_outcomes():
+            self._set_status([tx.id for tx in exported], ExportTransactionStatus.EXPORTED, session=session)
+            self._set_status([tx.id for tx in failed], ExportTransactionStatus.EXPORT_FAILED, session=session)
+            if retries:
+                session.bulk_update_mappings(models.PendingExport, retries)
+            if finished:
+                session.query(models.PendingExport).filter(
+                    models.PendingExport.id.in_([pending_export.id for pending_export in finished])
+                ).delete(synchronize_session=False)
+            session.commit()
+
+        db.run_query(save_outcomes, session=session, description=f"save {self.agent.provider_slug} export outcomes")
+        atlas.flush_audit_messages()
+
+        self.log.info(
+            f"Exported {len(exported)} transactions from {len(pending_exports)} pending exports. "
+            f"{len(retries)} will be retried, {len(failed)} failed and {deferred} were rate limited."
+        )
+        return len(pending_exports) - deferred
+
+    @staticmethod
+    def _set_status(export_transaction_ids: t.List[int], status: ExportTransactionStatus, *, session: db.Session):
+        if export_transaction_ids:
+            session.query(models.ExportTransaction).filter(
+                models.ExportTransaction.id.in_(export_transaction_ids)
+            ).update({models.ExportTransaction.status: status}, synchronize_session=False)
+
+    def run(self) -> None:
+        self.log.info(f"Exporting {self.agent.provider_slug} pending exports.")
+        while True:
+            with db.session_scope() as session:
+                handled = self.run_batch(session=session)
+
+            # keep going while there's a backlog, otherwise wait for more pending exports or rate limit tokens.
+            if handled < settings.EXPORT_ASYNC_BATCH_SIZE:
+                time.sleep(settings.EXPORT_ASYNC_POLL_INTERVAL)
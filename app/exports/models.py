@@ -3,7 +3,7 @@ from enum import Enum
 import sqlalchemy as s
 from sqlalchemy.dialects import postgresql as psql
 
-from app.db import Base, ModelMixin, auto_repr, auto_str
+from app.db import PARTITION_BY, Base, ModelMixin, PartitionedModelMixin, auto_repr, auto_str
 from app.encryption import decrypt_credentials
 from app.feeds import FeedType
 
@@ -18,18 +18,29 @@ class ExportTransactionStatus(Enum):
 @auto_str("id", "export_transaction_id")
 class PendingExport(Base, ModelMixin):
     __tablename__ = "pending_export"
+    __table_args__ = (
+        # export_transaction is partitioned, so its primary key includes created_at.
+        s.ForeignKeyConstraint(
+            ["export_transaction_id", "export_transaction_created_at"],
+            ["export_transaction.id", "export_transaction.created_at"],
+            name="pending_export_export_transaction_fkey",
+        ),
+    )
 
     provider_slug = s.Column(s.String(50), nullable=False, index=True)
-    export_transaction_id = s.Column(s.Integer, s.ForeignKey("export_transaction.id"))
+    export_transaction_id = s.Column(s.Integer, nullable=True, index=True)
+    export_transaction_created_at = s.Column(s.DateTime, nullable=True)
     retry_count = s.Column(s.Integer, nullable=False, default=0)
     retry_at = s.Column(s.DateTime, nullable=True, index=True)
+    leased_until = s.Column(s.DateTime, nullable=True)  # set while the async export executor is sending it
     failure_reason = s.Column(s.Text(), nullable=True)
 
 
 @auto_repr
 @auto_str("id", "transaction_id")
-class ExportTransaction(Base, ModelMixin):
+class ExportTransaction(Base, PartitionedModelMixin):
     __tablename__ = "export_transaction"
+    __table_args__ = ({"postgresql_partition_by": PARTITION_BY},)
 
     transaction_id = s.Column(s.String(100), nullable=False)  # unique identifier assigned by the merchant/provider
     feed_type = s.Column(s.Enum(FeedType), nullable=True)  # can be null, matching has no single feed type
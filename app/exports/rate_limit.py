@@ -0,0 +1,131 @@
+import time
+import typing as t
+from contextlib import contextmanager
+from uuid import uuid4
+
+import settings
+from app import config, db
+from app.reporting import get_logger
+
+log = get_logger("export-rate-limit")
+
+# how long to wait before trying again when an export is held back by the concurrency limit.
+CONCURRENCY_RETRY_SECONDS = 1
+
+# KEYS[1] = token bucket hash, KEYS[2] = sorted set of concurrency leases, scored by expiry time.
+# ARGV = rate per second, burst, concurrency limit, now in milliseconds, lease token, lease duration in milliseconds.
+# Returns 0 if the export can go ahead, otherwise the number of milliseconds to wait before trying again.
+_acquire = db.redis.register_script(
+    """
+    local rate = tonumber(ARGV[1])
+    local burst = tonumber(ARGV[2])
+    local concurrency = tonumber(ARGV[3])
+    local now = tonumber(ARGV[4])
+    local lease_ms = tonumber(ARGV[6])
+
+    if concurrency > 0 then
+        redis.call("zremrangebyscore", KEYS[2], "-inf", now)
+        if redis.call("zcard", KEYS[2]) >= concurrency then
+            return tonumber(ARGV[7])
+        end
+    end
+
+    if rate > 0 then
+        local bucket = redis.call("hmget", KEYS[1], "tokens", "updated_at")
+        local tokens = tonumber(bucket[1]) or burst
+        local updated_at = tonumber(bucket[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate / 1000)
+        if tokens < 1 then
+            return math.ceil((1 - tokens) * 1000 / rate)
+        end
+        redis.call("hset", KEYS[1], "tokens", tostring(tokens - 1), "updated_at", tostring(now))
+        redis.call("pexpire", KEYS[1], math.ceil(burst * 1000 / rate) + 1000)
+    end
+
+    if concurrency > 0 then
+        redis.call("zadd", KEYS[2], now + lease_ms, ARGV[5])
+        redis.call("pexpire", KEYS[2], lease_ms)
+    end
+
+    return 0
+    """
+)
+
+
+class RateLimited(Exception):
+    def __init__(self, provider_slug: str, retry_after: float) -> None:
+        self.provider_slug = provider_slug
+        self.retry_after = retry_after
+        super().__init__(f"Exports for {provider_slug} are rate limited. Try again in {retry_after:.3f}s.")
+
+
+class RateLimits(t.NamedTuple):
+    rate: float  # requests per second, 0 = unlimited.
+    burst: int  # the most requests that can be made at once after a quiet period.
+    concurrency: int  # the most exports that can be in progress at once, 0 = unlimited.
+
+    @property
+    def unlimited(self) -> bool:
+        return self.rate <= 0 and self.concurrency <= 0
+
+
+def _config(provider_slug: str) -> config.Config:
+    key_prefix = f"{config.KEY_PREFIX}exports.agents.{provider_slug}"
+    return config.Config(
+        config.ConfigValue("rate_limit", key=f"{key_prefix}.rate_limit", default="0"),
+        config.ConfigValue("rate_limit_burst", key=f"{key_prefix}.rate_limit_burst", default="1"),
+        config.ConfigValue("concurrency_limit", key=f"{key_prefix}.concurrency_limit", default="0"),
+    )
+
+
+def get_limits(provider_slug: str, *, session: t.Optional[db.Session] = None) -> RateLimits:
+    limits_config = _config(provider_slug)
+    return RateLimits(
+        rate=float(limits_config.get("rate_limit", session=session)),
+        burst=max(1, int(limits_config.get("rate_limit_burst", session=session))),
+        concurrency=int(limits_config.get("concurrency_limit", session=session)),
+    )
+
+
+@contextmanager
+def limit(provider_slug: str, *, session: t.Optional[db.Session] = None) -> t.Iterator[None]:
+    """
+    Takes a token from the provider's bucket & a concurrency lease for the duration of the block.
+    The limits are shared by every worker through redis, and configured per provider with these config keys:
+
+    exports.agents.<slug>.rate_limit = requests per second, 0 = unlimited.
+    exports.agents.<slug>.rate_limit_burst = the size of the token bucket.
+    exports.agents.<slug>.concurrency_limit = exports in progress at once, 0 = unlimited.
+
+    Raises RateLimited if either limit has been reached.
+    Concurrency leases expire after EXPORT_CONCURRENCY_LEASE seconds, in case a worker dies before releasing its own.
+    """
+    limits = get_limits(provider_slug, session=session)
+    if limits.unlimited:
+        yield
+        return
+
+    bucket_key = f"{settings.REDIS_KEY_PREFIX}:export-rate-limit:{provider_slug}"
+    leases_key = f"{bucket_key}:leases"
+    token = uuid4().hex
+
+    retry_after_ms = _acquire(
+        keys=[bucket_key, leases_key],
+        args=[
+            limits.rate,
+            limits.burst,
+            limits.concurrency,
+            int(time.time() * 1000),
+            token,
+            settings.EXPORT_CONCURRENCY_LEASE * 1000,
+            CONCURRENCY_RETRY_SECONDS * 1000,
+        ],
+    )
+    if retry_after_ms:
+        raise RateLimited(provider_slug, retry_after_ms / 1000)
+
+    try:
+        yield
+    finally:
+        if limits.concurrency > 0:
+            db.redis.zrem(leases_key, token)
@@ -1,7 +1,11 @@
-import humanize
+import random
+import typing as t
+
 import pendulum
-from sqlalchemy import and_, or_, orm
+import sqlalchemy as s
+from sqlalchemy import and_, or_
 
+import settings
 from app import db, models, tasks
 from app.reporting import get_logger
 from app.scheduler import CronScheduler
@@ -17,74 +21,114 @@ class ExportRetryWorker:
     def _get_schedule(self) -> str:
         return "* * * * *"
 
-    def _tick(self) -> None:
-        with db.session_scope() as session:
+    @staticmethod
+    def _requeue_statement(now: pendulum.DateTime, *, limit: int) -> s.sql.Update:
+        """
+        Builds an UPDATE that claims up to `limit` due pending exports and returns their IDs.
 
-            def find_pending_exports():
-                now = pendulum.now("UTC")
-                yesterday = now.subtract(hours=24)
-                return (
-                    session.query(models.PendingExport)
-                    .filter(
+        An export with a retry_at in the past is ready for retry.
+        Its retry count is incremented & retry_at is nullified.
+        Nullifying retry_at means the scheduler won't retry the export until a new retry date is set on it.
+        This helps to prevent race conditions without needing locks.
+
+        An export with no retry_at that hasn't been touched in 24 hours is assumed to be a "missed" export that just
+        needs requeueing. Its updated_at is still reset so that it isn't picked up again.
+        """
+        pending_export = models.PendingExport
+        yesterday = now.subtract(hours=24)
+        due = (
+            s.select(pending_export.id)
+            .where(
+                # the async export executor deals with its own retries.
+                pending_export.provider_slug.notin_(settings.EXPORT_ASYNC_SLUGS),
+                or_(
+                    and_(
+                        pending_export.retry_at.isnot(None),
+                        pending_export.retry_at <= now,
+                    ),
+                    and_(
+                        pending_export.retry_at.is_(None),
+                        pending_export.created_at <= yesterday,
                         or_(
-                            and_(
-                                models.PendingExport.retry_at.isnot(None),
-                                models.PendingExport.retry_at <= now,
-                            ),
-                            and_(
-                                models.PendingExport.retry_at.is_(None),
-                                models.PendingExport.created_at <= yesterday,
-                                or_(
-                                    models.PendingExport.updated_at.is_(None),
-                                    models.PendingExport.updated_at <= yesterday,
-                                ),
-                            ),
-                        )
-                    )
-                    .all()
-                )
-
-            pending_exports = db.run_query(
-                find_pending_exports,
-                session=session,
-                read_only=True,
-                description="find pending exports for retry",
+                            pending_export.updated_at.is_(None),
+                            pending_export.updated_at <= yesterday,
+                        ),
+                    ),
+                ),
             )
+            .order_by(pending_export.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        return (
+            s.update(pending_export)
+            .where(pending_export.id.in_(due.scalar_subquery()))
+            .values(
+                retry_count=s.case(
+                    (pending_export.retry_at.isnot(None), pending_export.retry_count + 1),
+                    else_=pending_export.retry_count,
+                ),
+                retry_at=None,
+            )
+            .returning(pending_export.id)
+            .execution_options(synchronize_session=False)
+        )
 
-            if not pending_exports:
-                return
-
-            pending_exports_count = len(pending_exports)
-            self.log.info(f"Found {pending_exports_count} pending exports for retry.")
-
-            def requeue_pending_exports():
-                for pending_export in pending_exports:
-                    # if retry_at is already null we assume this is a "missed" export that just needs requeueing.
-                    if pending_export.retry_at is None:
-                        # we still commit a change to [re]set the updated_at field.
-                        pending_export.retry_at = None
-                        orm.attributes.flag_modified(pending_export, "retry_at")
-                        self.log.info(f"{pending_export} was missed and will be requeued.")
-                    # otherwise we increment the retry count & nullify retry_at.
-                    else:
-                        # nullifying the retry_at means the scheduler won't retry the transaction
-                        # until a new retry date is set on it.
-                        # this helps to prevent race conditions without needing locks.
-                        pending_export.retry_count += 1
-                        pending_export.retry_at = None
-                        self.log.info(f"{pending_export} is ready for retry.")
+    def _enqueue(self, pending_export_ids: t.List[int]) -> None:
+        calls: t.List[t.Tuple[tuple, dict]] = [((pending_export_id,), {}) for pending_export_id in pending_export_ids]
+
+        # spreading the exports across the window stops them all hitting the merchant's API at once.
+        if settings.EXPORT_RETRY_JITTER > 0:
+            now = pendulum.now("UTC")
+            tasks.export_queue.schedule_batch(
+                tasks.export_singular_transaction,
+                [
+                    (now.add(seconds=random.uniform(0, settings.EXPORT_RETRY_JITTER)), args, kwargs)
+                    for args, kwargs in calls
+                ],
+            )
+        else:
+            tasks.export_queue.enqueue_batch(tasks.export_singular_transaction, calls)
 
+    def requeue_pending_exports(self, *, session: db.Session) -> int:
+        """
+        Requeues every due pending export in chunks of EXPORT_RETRY_CHUNK_SIZE, and returns how many were requeued.
+        Each chunk is committed before its exports are enqueued.
+        """
+        now = pendulum.now("UTC")
+        requeued = 0
+
+        while True:
+
+            def claim_pending_exports():
+                pending_export_ids = [
+                    row.id
+                    for row in session.execute(self._requeue_statement(now, limit=settings.EXPORT_RETRY_CHUNK_SIZE))
+                ]
                 session.commit()
+                return pending_export_ids
+
+            pending_export_ids = db.run_query(
+                claim_pending_exports, session=session, description="claim pending exports for retry"
+            )
+            if not pending_export_ids:
+                break
 
-            db.run_query(requeue_pending_exports, session=session, description="requeue pending exports")
+            self._enqueue(pending_export_ids)
+            requeued += len(pending_export_ids)
+            self.log.info(f"Requeued {len(pending_export_ids)} pending exports.")
 
-            for pending_export in pending_exports:
-                tasks.export_queue.enqueue(tasks.export_singular_transaction, pending_export.id)
-                self.log.debug(
-                    f"Requeued {pending_export} for its {humanize.ordinal(pending_export.retry_count)} retry."
-                )
+            if len(pending_export_ids) < settings.EXPORT_RETRY_CHUNK_SIZE:
+                break
+
+        return requeued
+
+    def _tick(self) -> None:
+        with db.session_scope() as session:
+            requeued = self.requeue_pending_exports(session=session)
 
-            self.log.info(f"{pending_exports_count} pending exports requeued and updated.")
+        if requeued:
+            self.log.info(f"{requeued} pending exports requeued and updated.")
 
     def run(self) -> None:
         self.log.debug(f'Export retry worker scheduler starting up with schedule "{self._get_schedule()}".')
@@ -0,0 +1,148 @@
+import threading
+import time
+import typing as t
+from collections import defaultdict
+
+from redis import RedisError
+
+import settings
+from app import db, models
+from app.reporting import get_logger
+
+log = get_logger("mid-index")
+
+VERSION_KEY = f"{settings.REDIS_KEY_PREFIX}:mid-index:version"
+
+
+class IndexedMID(t.NamedTuple):
+    id: int
+    identifier: str
+    identifier_type: models.IdentifierType
+    payment_provider_slug: str
+    loyalty_scheme_slug: str
+    location_id: t.Optional[str]
+    merchant_internal_id: t.Optional[str]
+
+
+class _Snapshot:
+    """
+    Every merchant identifier at one version, keyed by the ways the import agents & identifier look them up.
+    """
+
+    def __init__(self, mids: t.Iterable[IndexedMID], *, version: t.Optional[str]) -> None:
+        self.version = version
+        self.by_id: dict[int, IndexedMID] = {}
+        self.by_key: dict[tuple[str, models.IdentifierType, str], IndexedMID] = {}
+        self.by_identifier: defaultdict[tuple[str, str], list[IndexedMID]] = defaultdict(list)
+        self.by_scheme: defaultdict[str, list[IndexedMID]] = defaultdict(list)
+
+        for mid in mids:
+            self.by_id[mid.id] = mid
+            self.by_key[(mid.identifier, mid.identifier_type, mid.payment_provider_slug)] = mid
+            self.by_identifier[(mid.identifier, mid.payment_provider_slug)].append(mid)
+            self.by_scheme[mid.loyalty_scheme_slug].append(mid)
+
+        self._location_id_mid_maps: dict[str, defaultdict[str, list[str]]] = {}
+
+    def location_id_mid_map(self, scheme_slug: str) -> defaultdict[str, list[str]]:
+        """Returns the distinct identifiers for each location ID of the given loyalty scheme."""
+        if scheme_slug not in self._location_id_mid_maps:
+            location_id_mid_map = defaultdict(list)
+            for location_id, identifier in dict.fromkeys(
+                (mid.location_id, mid.identifier) for mid in self.by_scheme.get(scheme_slug, [])
+            ):
+                if location_id is not None:
+                    location_id_mid_map[location_id].append(identifier)
+            self._location_id_mid_maps[scheme_slug] = location_id_mid_map
+        return self._location_id_mid_maps[scheme_slug]
+
+    def __len__(self) -> int:
+        return len(self.by_id)
+
+
+class MIDIndex:
+    """
+    A process-local copy of the merchant_identifier table, loaded in a single query on first use.
+
+    The identifiers API increments a version counter in redis whenever MIDs are onboarded, offboarded, or updated.
+    The index compares its version against that counter at most once every MID_INDEX_CHECK_INTERVAL seconds,
+    and reloads itself when they differ. If redis can't be reached the index is reloaded on every check instead.
+    """
+
+    def __init__(self) -> None:
+        self._snapshot: t.Optional[_Snapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _get_version() -> t.Optional[str]:
+        try:
+            return t.cast(t.Optional[str], db.redis.get(VERSION_KEY)) or "0"
+        except RedisError as ex:
+            log.warning(f"Error getting the MID index version from redis: {ex}. Reloading the index.")
+            return None
+
+    @staticmethod
+    def _load(version: t.Optional[str], *, session: db.Session) -> _Snapshot:
+        def get_data():
+            return (
+                session.query(
+                    models.MerchantIdentifier.id,
+                    models.MerchantIdentifier.identifier,
+                    models.MerchantIdentifier.identifier_type,
+                    models.PaymentProvider.slug,
+                    models.LoyaltyScheme.slug,
+                    models.MerchantIdentifier.location_id,
+                    models.MerchantIdentifier.merchant_internal_id,
+                )
+                .join(models.MerchantIdentifier.payment_provider)
+                .join(models.MerchantIdentifier.loyalty_scheme)
+                .all()
+            )
+
+        rows = db.run_query(get_data, session=session, read_only=True, description="load MID index")
+        snapshot = _Snapshot((IndexedMID(*row) for row in rows), version=version)
+        log.debug(f"Loaded {len(snapshot)} MIDs at version {version}.")
+        return snapshot
+
+    def get(self, *, session: t.Optional[db.Session] = None) -> _Snapshot:
+        """
+        Returns the current snapshot, reloading it first if it is missing or out of date.
+        `session` is only used if the index needs loading; without one, a new session is opened.
+        """
+        snapshot = self._snapshot
+        if snapshot is not None and time.monotonic() - self._checked_at < settings.MID_INDEX_CHECK_INTERVAL:
+            return snapshot
+
+        with self._lock:
+            version = self._get_version()
+            snapshot = self._snapshot
+            if snapshot is None or version is None or snapshot.version != version:
+                if session is None:
+                    with db.session_scope() as session:
+                        snapshot = self._load(version, session=session)
+                else:
+                    snapshot = self._load(version, session=session)
+                self._snapshot = snapshot
+            self._checked_at = time.monotonic()
+
+        return snapshot
+
+    def invalidate(self) -> None:
+        """Drops the local snapshot, so that the next lookup reloads it."""
+        self._snapshot = None
+
+
+index = MIDIndex()
+
+
+def bump_version() -> None:
+    """
+    Tells every process that the merchant identifiers have changed.
+    Call this after committing any change to the merchant_identifier table.
+    """
+    index.invalidate()
+    try:
+        db.redis.incr(VERSION_KEY)
+    except RedisError as ex:
+        log.warning(f"Error incrementing the MID index version in redis: {ex}. Other processes may use stale MIDs.")
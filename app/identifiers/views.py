@@ -13,6 +13,7 @@ import settings
 from app import db, models, reporting
 from app.api.auth import auth_decorator, requires_service_auth
 from app.api.utils import view_session
+from app.identifiers import index as mid_index
 from app.identifiers import schemas
 
 api = Blueprint("identifiers_api", __name__, url_prefix=f"{settings.URL_PREFIX}/identifiers")
@@ -93,6 +94,7 @@ def insert_identifiers(identifiers_data: list[dict], session: db.Session) -> int
         description="count identifiers before import",
     )
     db.run_query(do_insert, session=session, description="onboard identifiers")
+    mid_index.bump_version()
     identifiers_table_after = db.run_query(
         session.query(models.MerchantIdentifier).count,
         session=session,
@@ -314,6 +316,8 @@ def offboard_identifiers() -> tuple[dict, int]:
             description="delete identifiers by ID",
         )
 
+    mid_index.bump_version()
+
     return {"deleted": count}, 200
 
 
@@ -371,4 +375,6 @@ def update_identifiers(payment_provider: str, identifier_type: str, identifier:
 
         session.commit()
 
+    mid_index.bump_version()
+
     return {}, 200
@@ -1,16 +1,19 @@
 import typing as t
 from collections import defaultdict
-from functools import cached_property, lru_cache
+from functools import cached_property
 from uuid import uuid4
 
 import pendulum
-import redis.lock
-from sqlalchemy.dialects.postgresql import insert
-from sqlalchemy.sql import tuple_
+import sqlalchemy as s
+from sqlalchemy.orm.exc import MultipleResultsFound
 
 import settings
 from app import db, models, tasks
+from app.core.identifier import IdentifyArgs
 from app.feeds import FeedType
+from app.identifiers.index import index as mid_index
+from app.imports import ingestion
+from app.imports.dedup import DedupIndex
 from app.imports.exceptions import MissingMID
 from app.prometheus import bink_prometheus
 from app.reporting import get_logger
@@ -48,91 +51,45 @@ class PaymentTransactionFields(t.NamedTuple):
     extra_fields: t.Optional[dict] = None
 
 
-class IdentifyArgs(t.NamedTuple):
-    transaction_id: str
-    merchant_identifier_ids: list[int]
-    card_token: str
-
-
 TxType = t.Union[models.SchemeTransaction, models.PaymentTransaction]
 
 
-@lru_cache(maxsize=2048)
 def find_identifiers(
     *identifiers: tuple[models.IdentifierType, str], provider_slug: str, session: db.Session
 ) -> dict[models.IdentifierType, int]:
-    def lookup():
-        return (
-            session.query(models.MerchantIdentifier)
-            .join(models.MerchantIdentifier.payment_provider)
-            .filter(models.PaymentProvider.slug == provider_slug)
-            .filter(
-                tuple_(models.MerchantIdentifier.identifier_type, models.MerchantIdentifier.identifier).in_(identifiers)
-            )
-            .all()
-        )
-
-    merchant_identifiers = db.run_query(
-        lookup,
-        session=session,
-        read_only=True,
-        description=f"find {provider_slug} identifier",
-    )
+    mids_by_key = mid_index.get(session=session).by_key
+    return {
+        identifier_type: mid.id
+        for identifier_type, identifier in identifiers
+        if (mid := mids_by_key.get((identifier, identifier_type, provider_slug))) is not None
+    }
 
-    return {mid.identifier_type: mid.id for mid in merchant_identifiers}
 
-
-@lru_cache(maxsize=2048)
 def get_mids_by_location_id(location_id: str, *, scheme_slug: str, payment_slug: str) -> list[str]:
     """
     Find primary MIDs by location ID (store ID.)
     """
-    with db.session_scope() as session:
+    return [
+        mid.identifier
+        for mid in mid_index.get().by_scheme.get(scheme_slug, [])
+        if mid.payment_provider_slug == payment_slug
+        and mid.location_id == location_id
+        and mid.identifier_type == models.IdentifierType.PRIMARY
+    ]
 
-        def get_data():
-            return (
-                session.query(models.MerchantIdentifier.identifier)
-                .join(models.LoyaltyScheme)
-                .join(models.PaymentProvider)
-                .filter(
-                    models.LoyaltyScheme.slug == scheme_slug,
-                    models.PaymentProvider.slug == payment_slug,
-                    models.MerchantIdentifier.location_id == location_id,
-                    models.MerchantIdentifier.identifier_type == models.IdentifierType.PRIMARY,
-                )
-                .all()
-            )
 
-        results = db.run_query(
-            get_data,
-            session=session,
-            read_only=True,
-            description=f"find {scheme_slug} MIDs by location ID",
-        )
+def get_merchant_slug(*mids: tuple[models.IdentifierType, str], payment_provider_slug: str) -> t.Optional[str]:
+    mids_by_identifier = mid_index.get().by_identifier
+    slugs = {
+        mid.loyalty_scheme_slug
+        for _, identifier in mids
+        for mid in mids_by_identifier.get((identifier, payment_provider_slug), [])
+    }
 
-        return [mid[0] for mid in results]
+    if len(slugs) > 1:
+        raise MultipleResultsFound(f"Identifiers {mids} belong to multiple loyalty schemes: {slugs}")
 
-
-@lru_cache(maxsize=2048)
-def get_merchant_slug(*mids: str, payment_provider_slug: str) -> str:
-    with db.session_scope() as session:
-
-        def find_slug():
-            return (
-                session.query(models.LoyaltyScheme.slug)
-                .distinct()
-                .join(models.MerchantIdentifier)
-                .join(models.PaymentProvider)
-                .filter(
-                    models.MerchantIdentifier.identifier.in_([identifier for _, identifier in mids]),
-                    models.PaymentProvider.slug == payment_provider_slug,
-                )
-                .scalar()
-            )
-
-        return db.run_query(
-            find_slug, session=session, read_only=True, description=f"find merchant slug for identifiers {mids}"
-        )
+    return next(iter(slugs), None)
 
 
 class BaseAgent:
@@ -169,33 +126,9 @@ class BaseAgent:
     def get_transaction_id(data: dict) -> str:
         raise NotImplementedError("Override get_transaction_id in your agent.")
 
-    @cached_property
+    @property
     def location_id_mid_map(self) -> t.DefaultDict[str, t.List[str]]:
-        with db.session_scope() as session:
-
-            def get_data():
-                return (
-                    session.query(
-                        models.MerchantIdentifier.location_id,
-                        models.MerchantIdentifier.identifier,
-                    )
-                    .join(models.LoyaltyScheme)
-                    .filter(models.LoyaltyScheme.slug == self.provider_slug)
-                    .filter(models.MerchantIdentifier.location_id.isnot(None))
-                    .distinct()
-                )
-
-            data = db.run_query(
-                get_data,
-                session=session,
-                read_only=True,
-                description=f"find {self.provider_slug} MIDs by location ID",
-            )
-
-        location_id_mid_map = defaultdict(list)
-        for location_id, mid in data:
-            location_id_mid_map[location_id].append(mid)
-        return location_id_mid_map
+        return mid_index.get().location_id_mid_map(self.provider_slug)
 
     def get_primary_mids(self, data: dict) -> list[str]:
         raise NotImplementedError("Override get_primary_mids in your agent.")
@@ -221,7 +154,10 @@ class BaseAgent:
         identifiers = self._all_identifiers(data)
         # we can use self.provider_slug as the payment provider slug as there is no reason to ever call this function
         # in a loyalty import agent.
-        return get_merchant_slug(*identifiers, payment_provider_slug=self.provider_slug)
+        merchant_slug = get_merchant_slug(*identifiers, payment_provider_slug=self.provider_slug)
+        if merchant_slug is None:
+            raise MissingMID(f"No loyalty scheme found for identifiers {identifiers}")
+        return merchant_slug
 
     @staticmethod
     def pendulum_parse(date_time: str, *, tz: str = "GMT") -> pendulum.DateTime:
@@ -230,32 +166,51 @@ class BaseAgent:
         # https://github.com/sdispater/pendulum/pull/452
         return pendulum.parse(date_time, tz=tz)  # type: ignore
 
-    def _find_new_transactions(self, provider_transactions: t.List[dict], *, session: db.Session) -> t.List[dict]:
-        """Returns a subset of provider_transactions whose transaction IDs do not appear in the DB yet."""
-        tids_in_set = {self.get_transaction_id(t) for t in provider_transactions}
-
-        # this result set can be very large, so limit the yield amount
-        # local testing indicates that a yield size of 100k results in roughly 120 MB memory used for this process.
-        # TODO: make this a global setting & scale based on model size?
-        yield_per = 100000
+    @cached_property
+    def dedup_index(self) -> DedupIndex:
+        return DedupIndex(self.provider_slug, self.feed_type)
+
+    def _find_imported_transaction_ids(self, transaction_ids: t.Iterable[str], *, session: db.Session) -> set[str]:
+        """Returns the given transaction IDs that have already been imported, using a temporary table join."""
+        candidates_table = s.Table(
+            "import_transaction_candidates",
+            s.MetaData(),
+            s.Column("transaction_id", s.String(100), primary_key=True),
+            prefixes=["TEMPORARY"],
+            postgresql_on_commit="DROP",
+        )
 
-        seen_tids = {
-            row[0]
-            for row in db.run_query(
-                lambda: session.query(models.ImportTransaction.transaction_id)
-                .distinct()
-                .yield_per(yield_per)
+        def find_imported():
+            connection = session.connection()
+            candidates_table.create(bind=connection, checkfirst=True)
+            connection.execute(candidates_table.delete())
+            connection.execute(candidates_table.insert(), [{"transaction_id": tid} for tid in transaction_ids])
+            return (
+                session.query(models.ImportTransaction.transaction_id)
+                .join(candidates_table, candidates_table.c.transaction_id == models.ImportTransaction.transaction_id)
                 .filter(
                     models.ImportTransaction.provider_slug == self.provider_slug,
-                    models.ImportTransaction.transaction_id.in_(tids_in_set),
                     models.ImportTransaction.feed_type == self.feed_type,
-                ),
-                session=session,
-                read_only=True,
-                description=f"find duplicated {self.provider_slug} import transactions",
+                )
+                .distinct()
+                .all()
             )
-            if row[0] in tids_in_set
-        }
+
+        rows = db.run_query(
+            find_imported,
+            session=session,
+            read_only=True,
+            description=f"find duplicated {self.provider_slug} import transactions",
+        )
+        return {row[0] for row in rows}
+
+    def _find_new_transactions(self, provider_transactions: t.List[dict], *, session: db.Session) -> t.List[dict]:
+        """Returns a subset of provider_transactions whose transaction IDs do not appear in the DB yet."""
+        tids_in_set = {self.get_transaction_id(t) for t in provider_transactions}
+
+        # only transaction IDs that the dedup index can't rule out need to be checked in the database.
+        candidates = self.dedup_index.candidates(tids_in_set)
+        seen_tids = self._find_imported_transaction_ids(candidates, session=session) if candidates else set()
 
         # Use list of duplicate transaction IDs to find new transactions.
         new: list[dict] = []
@@ -303,7 +258,7 @@ class BaseAgent:
             self.log.debug(f'No new transactions found in source "{source}", exiting early.')
             return 0
 
-        # NOTE: it may be worth limiting the batch size if files get any larger than 10k transactions.
+        # file agents limit the number of provider transactions per call with IMPORT_CHUNK_SIZE.
         import_transaction_inserts = []
         transaction_inserts = []
 
@@ -313,17 +268,18 @@ class BaseAgent:
         # generate a match group ID
         match_group = uuid4().hex
 
-        for tx_data in new:
-            tid = self.get_transaction_id(tx_data)
-
-            # attempt to lock this transaction id.
-            lock_key = f"{settings.REDIS_KEY_PREFIX}:import-lock:{self.provider_slug}:{tid}"
-            lock: redis.lock.Lock = db.redis.lock(lock_key, timeout=300)
-            if not lock.acquire(blocking=False):
-                self.log.warning(f"Transaction {lock_key} is already locked. Skipping.")
-                continue
+        # claim every transaction ID in one round trip. IDs that are locked by another importer are skipped.
+        # the locks are held until the inserts are persisted.
+        lock_keys = {
+            f"{settings.REDIS_KEY_PREFIX}:import-lock:{self.provider_slug}:{self.get_transaction_id(tx_data)}": tx_data
+            for tx_data in new
+        }
+        with db.redis_locks(lock_keys, timeout=300) as acquired:
+            for lock_key, tx_data in lock_keys.items():
+                if lock_key not in acquired:
+                    self.log.warning(f"Transaction {lock_key} is already locked. Skipping.")
+                    continue
 
-            try:
                 import_transaction_insert, transaction_insert, identify = self._build_inserts(
                     tx_data, match_group, source, session=session
                 )
@@ -334,12 +290,10 @@ class BaseAgent:
 
                 if identify:
                     identify_args.append(identify)
-            finally:
-                lock.release()
 
-            yield
+                yield
 
-        self._persist_and_enqueue(import_transaction_inserts, transaction_inserts, identify_args, match_group)
+            self._persist_and_enqueue(import_transaction_inserts, transaction_inserts, identify_args, match_group)
 
         return len(new)
 
@@ -351,21 +305,37 @@ class BaseAgent:
         match_group: str,
     ) -> None:
         if import_transaction_inserts:
-            db.engine.execute(
-                insert(models.ImportTransaction.__table__).values(import_transaction_inserts).on_conflict_do_nothing()
+            inserted = ingestion.insert_rows(
+                models.ImportTransaction.__table__,
+                import_transaction_inserts,
+                returning=models.ImportTransaction.__table__.c.transaction_id,
             )
-            self._update_metrics(n_insertions=len(import_transaction_inserts))
-
-        if transaction_inserts:
-            db.engine.execute(insert(models.Transaction.__table__).values(transaction_inserts).on_conflict_do_nothing())
+            self.dedup_index.add(inserted)
+            self._update_metrics(n_insertions=len(inserted))
+
+        # only transactions that weren't already in the database need to be identified & matched.
+        new_transaction_ids = set(
+            ingestion.insert_rows(
+                models.Transaction.__table__,
+                transaction_inserts,
+                returning=models.Transaction.__table__.c.transaction_id,
+            )
+        )
+        identify_args = [args for args in identify_args if args.transaction_id in new_transaction_ids]
 
         if self.feed_type_is_payment:
-            # payment imports need to get identified before they can be matched
-            for args in identify_args:
-                tasks.identify_user_queue.enqueue(
-                    tasks.identify_user, feed_type=self.feed_type, match_group=match_group, **args._asdict()
-                )
-        elif self.feed_type == FeedType.MERCHANT:
+            # payment imports need to get identified before they can be matched.
+            # each job identifies a chunk of transactions with as few Hermes requests as possible.
+            batch_size = settings.HERMES_USER_INFO_BATCH_SIZE
+            chunks = [identify_args[i : i + batch_size] for i in range(0, len(identify_args), batch_size)]
+            tasks.identify_user_queue.enqueue_batch(
+                tasks.identify_users,
+                [
+                    ((), dict(identify_args=chunk, feed_type=self.feed_type, match_group=match_group))
+                    for chunk in chunks
+                ],
+            )
+        elif self.feed_type == FeedType.MERCHANT and new_transaction_ids:
             # merchant imports can go straight to matching/streaming
             tasks.import_queue.enqueue(tasks.import_transactions, match_group)
 
@@ -259,25 +259,39 @@ class FileAgent(BaseAgent):
                 description="create file log record",
             )
 
-            transactions_data = []
-            all_timestamps = []
+            # rows are imported in chunks so that memory use and insert statement size don't grow with the file.
+            chunk_size = settings.IMPORT_CHUNK_SIZE
+            chunk: list[dict] = []
+            transaction_count = 0
+            total_unique_transactions = 0
+            date_range_from: t.Optional[pendulum.DateTime] = None
+            date_range_to: t.Optional[pendulum.DateTime] = None
             for transaction in self.yield_transactions_data(data):
-                transactions_data.append(transaction)
-                all_timestamps.append(self.get_transaction_date(transaction))
+                chunk.append(transaction)
+                transaction_count += 1
+
+                timestamp = self.get_transaction_date(transaction)
+                date_range_from = min(date_range_from or timestamp, timestamp)
+                date_range_to = max(date_range_to or timestamp, timestamp)
                 yield
 
-            total_unique_transactions = yield from self._import_transactions(
-                transactions_data, session=session, source=source
-            )
+                if len(chunk) == chunk_size:
+                    total_unique_transactions += yield from self._import_transactions(
+                        chunk, session=session, source=source
+                    )
+                    chunk = []
+
+            if chunk or not transaction_count:
+                total_unique_transactions += yield from self._import_transactions(chunk, session=session, source=source)
 
             # if we got this far, import completed successfully
             def update_import_file_log():
                 import_file_log.imported = True
-                import_file_log.transaction_count = len(transactions_data)
+                import_file_log.transaction_count = transaction_count
                 import_file_log.unique_transaction_count = total_unique_transactions
-                if all_timestamps:
-                    import_file_log.date_range_from = min(all_timestamps)
-                    import_file_log.date_range_to = max(all_timestamps)
+                if transaction_count:
+                    import_file_log.date_range_from = date_range_from
+                    import_file_log.date_range_to = date_range_to
                 session.commit()
 
             db.run_query(
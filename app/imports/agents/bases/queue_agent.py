@@ -1,3 +1,4 @@
+import time
 import typing as t
 from functools import cached_property
 
@@ -6,6 +7,7 @@ import kombu.mixins
 import settings
 from app import db
 from app.imports.agents.bases.base import BaseAgent
+from app.prometheus import bink_prometheus
 
 
 class QueueAgent(BaseAgent):
@@ -18,27 +20,134 @@ class QueueAgent(BaseAgent):
     def run(self):
         if settings.RABBITMQ_DSN:
             with kombu.Connection(settings.RABBITMQ_DSN) as conn:
-                consumer = Consumer(conn, self.queue_name, self)
+                consumer = Consumer(
+                    conn,
+                    self.queue_name,
+                    self,
+                    batch_size=settings.QUEUE_BATCH_SIZE,
+                    batch_timeout=settings.QUEUE_BATCH_TIMEOUT_MS / 1000,
+                    prefetch_count=settings.QUEUE_PREFETCH_COUNT,
+                )
                 self.log.info(f"Connected to RabbitMQ, consuming {self.queue_name}")
-                consumer.run()
+                consumer.run(safety_interval=consumer.poll_interval)
         else:
             raise settings.ConfigVarRequiredError(f"{type(self).__name__} requires that RABBITMQ_DSN is set")
 
+    def prepare_message(self, body: dict) -> dict:
+        """
+        Called once for each message as it arrives, before it's imported.
+        Override this to normalise messages into a form that's quicker for the agent to work with.
+        """
+        return body
+
     def _do_import(self, body: dict):
-        # TODO: this is less than ideal - should we keep a session open?
+        self._do_import_batch([body])
+
+    def _do_import_batch(self, bodies: list[dict]):
+        bodies = [self.prepare_message(body) for body in bodies]
         with db.session_scope() as session:
-            list(self._import_transactions([body], source=f"AMQP: {self.queue_name}", session=session))
+            list(self._import_transactions(bodies, source=f"AMQP: {self.queue_name}", session=session))
 
 
 class Consumer(kombu.mixins.ConsumerMixin):
-    def __init__(self, connection: kombu.Connection, queue_name: str, agent: QueueAgent):
+    """
+    Consumes messages in micro-batches of up to `batch_size` messages.
+    A partial batch is imported once its oldest message has waited for `batch_timeout` seconds.
+    Messages are acked together once their batch has been imported.
+    """
+
+    prometheus_metrics = {
+        "counters": ["queue_messages"],
+        "histograms": ["queue_batch_size", "queue_batch_duration", "queue_message_latency"],
+    }
+
+    def __init__(
+        self,
+        connection: kombu.Connection,
+        queue_name: str,
+        agent: QueueAgent,
+        *,
+        batch_size: int = 1,
+        batch_timeout: float = 0,
+        prefetch_count: int = 0,
+    ):
         self.queue = kombu.Queue(queue_name)
         self.connection = connection
         self.agent = agent
+        self.batch_size = max(batch_size, 1)
+        self.batch_timeout = batch_timeout
+
+        # a prefetch count smaller than the batch size would leave every batch waiting for the timeout.
+        if prefetch_count and prefetch_count < self.batch_size:
+            agent.log.warning(f"Raising prefetch count {prefetch_count} to the batch size of {self.batch_size}.")
+            prefetch_count = self.batch_size
+        self.prefetch_count = prefetch_count or None
+
+        self._batch: list[tuple[dict, kombu.Message, float]] = []
+
+    @property
+    def poll_interval(self) -> float:
+        """How long to wait for a message before checking whether a partial batch is due."""
+        if self.batch_size > 1 and self.batch_timeout > 0:
+            return min(self.batch_timeout, 1)
+        return 1
 
     def get_consumers(self, Consumer: t.Type[kombu.Consumer], _):
-        return [Consumer([self.queue], callbacks=[self.on_message], accept=["json"])]
+        return [
+            Consumer([self.queue], callbacks=[self.on_message], accept=["json"], prefetch_count=self.prefetch_count)
+        ]
 
     def on_message(self, body: dict, message: kombu.Message):
-        self.agent._do_import(body)
-        message.ack()
+        self._batch.append((body, message, time.monotonic()))
+        if len(self._batch) >= self.batch_size:
+            self.flush()
+
+    def on_connection_error(self, exc, interval):
+        self._discard_batch()
+        super().on_connection_error(exc, interval)
+
+    def on_connection_revived(self):
+        self._discard_batch()
+        super().on_connection_revived()
+
+    def _discard_batch(self):
+        # unacked messages are redelivered on the new channel, and can't be acked with the old channel's delivery tags.
+        if self._batch:
+            self.agent.log.warning(
+                f"Discarding {len(self._batch)} unacked messages from the lost connection. They will be redelivered."
+            )
+        self._batch = []
+
+    def on_iteration(self):
+        if self._batch and time.monotonic() - self._batch[0][2] >= self.batch_timeout:
+            self.flush()
+
+    def flush(self):
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        start = time.monotonic()
+        self.agent._do_import_batch([body for body, _, _ in batch])
+
+        # acks every message on the channel up to & including the last one in the batch.
+        batch[-1][1].ack(multiple=True)
+
+        end = time.monotonic()
+        self._update_metrics(batch, duration=end - start, latencies=[end - received for _, _, received in batch])
+
+    def _update_metrics(self, batch: list, *, duration: float, latencies: list[float]) -> None:
+        slug = self.agent.provider_slug
+        bink_prometheus.increment_counter(
+            agent=self, counter_name="queue_messages", increment_by=len(batch), process_type="import", slug=slug
+        )
+        bink_prometheus.observe_histogram(
+            agent=self, histogram_name="queue_batch_size", value=len(batch), process_type="import", slug=slug
+        )
+        bink_prometheus.observe_histogram(
+            agent=self, histogram_name="queue_batch_duration", value=duration, process_type="import", slug=slug
+        )
+        for latency in latencies:
+            bink_prometheus.observe_histogram(
+                agent=self, histogram_name="queue_message_latency", value=latency, process_type="import", slug=slug
+            )
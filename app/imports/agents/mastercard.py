@@ -1,4 +1,5 @@
 import typing as t
+from functools import cached_property, lru_cache
 from hashlib import sha256
 from uuid import uuid4
 
@@ -10,6 +11,7 @@ from app.feeds import FeedType
 from app.imports.agents.bases.base import PaymentTransactionFields
 from app.imports.agents.bases.file_agent import FileAgent
 from app.imports.agents.bases.queue_agent import QueueAgent
+from app.imports.fixed_width import FixedWidthField, FixedWidthParser
 
 PROVIDER_SLUG = "mastercard"
 SETTLED_PATH_KEY = f"{KEY_PREFIX}imports.agents.{PROVIDER_SLUG}-settled.path"
@@ -22,10 +24,10 @@ TIME_FORMAT = "HHmm"
 DATETIME_FORMAT = f"{DATE_FORMAT} {TIME_FORMAT}"
 
 
-class FixedWidthField(t.NamedTuple):
-    name: str
-    start: int
-    length: int
+@lru_cache(maxsize=4096)
+def _parse_transaction_date(date: str, time: str) -> pendulum.DateTime:
+    # a file's transactions share a handful of dates and minutes, so each distinct pair is only parsed once.
+    return pendulum.from_format(f"{date} {time}", DATETIME_FORMAT, tz="Europe/London")
 
 
 def _make_settlement_key(*, third_party_id: t.Optional[str], transaction_date: pendulum.DateTime, mid: str, token: str):
@@ -59,21 +61,20 @@ class MastercardTGX2Base(FileAgent):
         "amount": int,
     }
 
+    @cached_property
+    def parser(self) -> FixedWidthParser:
+        return FixedWidthParser(self.fields, converters=self.field_transforms)
+
     def parse_line(self, line: str) -> dict:
-        return {field.name: line[field.start : field.start + field.length].strip() for field in self.fields}
+        return self.parser.parse_line(line)
 
     def yield_transactions_data(self, data: bytes) -> t.Iterable[dict]:
-        lines = data.decode().split("\n")[1:]  # the header line is discarded
-        for line in lines:
-            raw_data = self.parse_line(line)
-
-            if raw_data["record_type"] != "D":
-                continue
-
+        # the header line is discarded, as is the trailer and anything else that isn't a detail record.
+        for transaction_data in self.parser.parse(data, skip_lines=1, where={"record_type": "D"}):
             # raising an error for bad datetime format at this point allows the rest of the file to be imported.
-            self.get_transaction_date(raw_data)
+            self.get_transaction_date(transaction_data)
 
-            yield {k: self.field_transforms.get(k, str)(v) for k, v in raw_data.items()}
+            yield transaction_data
 
     def to_transaction_fields(self, data: dict) -> PaymentTransactionFields:
         transaction_date = self.get_transaction_date(data)
@@ -114,8 +115,7 @@ class MastercardTGX2Base(FileAgent):
         return data["aggregate_merchant_id"]
 
     def get_transaction_date(self, data: dict) -> pendulum.DateTime:
-        date_string = f"{data['date']} {data['time']}"
-        return pendulum.from_format(date_string, DATETIME_FORMAT, tz="Europe/London")
+        return _parse_transaction_date(data["date"], data["time"])
 
 
 class MastercardTGX2Settlement(MastercardTGX2Base):
@@ -1,3 +1,4 @@
+import typing as t
 from hashlib import sha256
 
 import pendulum
@@ -14,25 +15,54 @@ SCHEDULE_KEY = f"{KEY_PREFIX}imports.agents.{PROVIDER_SLUG}.schedule"
 
 DATE_FORMAT = "YYYYMMDD"
 
+_MISSING = object()
+
 
 def _make_settlement_key(key_id: str) -> str:
     return sha256(f"visa.{key_id}".encode()).hexdigest()
 
 
-def _get_auth_code(data: dict, transaction_type: str) -> str:
-    for d in data["MessageElementsCollection"]:
-        if d["Key"] == f"{transaction_type}.AuthCode":
-            return d["Value"]
+class MessageElements(list):
+    """
+    A message's MessageElementsCollection with its values indexed by key, so that each lookup is a dict access.
+    It's still a list of {"Key": ..., "Value": ...} dicts, so it's stored exactly as it was received.
+    The first value wins if a key appears more than once, the same as a linear scan would find.
+    """
 
-    return ""
+    def __init__(self, elements: t.Iterable[dict]) -> None:
+        super().__init__(elements)
+        # built from the end, so that earlier values overwrite later ones.
+        self.values: dict[str, t.Any] = {element["Key"]: element["Value"] for element in reversed(self)}
 
 
-def get_key_value(data: dict, key: str) -> str:
-    for d in data["MessageElementsCollection"]:
-        if d["Key"] == key:
-            return d["Value"]
+def index_message_elements(data: dict) -> dict:
+    """
+    Returns a copy of the message with an indexed MessageElementsCollection.
+    The index isn't updated if the collection is changed afterwards.
+    """
+    if isinstance(data["MessageElementsCollection"], MessageElements):
+        return data
+    return {**data, "MessageElementsCollection": MessageElements(data["MessageElementsCollection"])}
+
+
+def _find_value(data: dict, key: str, default: t.Any = _MISSING) -> t.Any:
+    elements = data["MessageElementsCollection"]
+    if isinstance(elements, MessageElements):
+        value = elements.values.get(key, default)
+    else:
+        value = next((d["Value"] for d in elements if d["Key"] == key), default)
+
+    if value is _MISSING:
+        raise KeyError(f"Key {key} not found in data: {data}")
+    return value
+
+
+def _get_auth_code(data: dict, transaction_type: str) -> str:
+    return _find_value(data, f"{transaction_type}.AuthCode", "")
 
-    raise KeyError(f"Key {key} not found in data: {data}")
+
+def get_key_value(data: dict, key: str) -> str:
+    return _find_value(data, key)
 
 
 def try_convert_settlement_mid(mid: str) -> str:
@@ -52,8 +82,15 @@ def validate_mids(identifiers: list[tuple]) -> list[tuple]:
     )
 
 
-class VisaAuth(QueueAgent):
+class VisaQueueAgent(QueueAgent):
     provider_slug = PROVIDER_SLUG
+
+    def prepare_message(self, body: dict) -> dict:
+        # every field is looked up by key several times while importing, so the message is indexed on arrival.
+        return index_message_elements(body)
+
+
+class VisaAuth(VisaQueueAgent):
     feed_type = FeedType.AUTH
 
     timezones = {
@@ -94,10 +131,11 @@ class VisaAuth(QueueAgent):
 
     def to_transaction_fields(self, data: dict) -> PaymentTransactionFields:
         ext_user_id = data["ExternalUserId"]
+        merchant_slug = self.get_merchant_slug(data)
         return PaymentTransactionFields(
-            merchant_slug=self.get_merchant_slug(data),
+            merchant_slug=merchant_slug,
             payment_provider_slug=self.provider_slug,
-            transaction_date=self.get_transaction_date(data),
+            transaction_date=self._get_transaction_date(data, merchant_slug),
             has_time=True,
             spend_amount=to_pennies(get_key_value(data, "Transaction.TransactionAmount")),
             spend_multiplier=100,
@@ -108,13 +146,14 @@ class VisaAuth(QueueAgent):
         )
 
     def get_transaction_date(self, data: dict) -> pendulum.DateTime:
-        slug = self.get_merchant_slug(data)
-        tz = self.timezones.get(slug, "GMT")
+        return self._get_transaction_date(data, self.get_merchant_slug(data))
+
+    def _get_transaction_date(self, data: dict, merchant_slug: str) -> pendulum.DateTime:
+        tz = self.timezones.get(merchant_slug, "GMT")
         return self.pendulum_parse(get_key_value(data, "Transaction.TimeStampYYMMDD"), tz=tz)
 
 
-class VisaSettlement(QueueAgent):
-    provider_slug = PROVIDER_SLUG
+class VisaSettlement(VisaQueueAgent):
     feed_type = FeedType.SETTLED
 
     def __init__(self):
@@ -163,8 +202,7 @@ class VisaSettlement(QueueAgent):
         )
 
 
-class VisaRefund(QueueAgent):
-    provider_slug = PROVIDER_SLUG
+class VisaRefund(VisaQueueAgent):
     feed_type = FeedType.REFUND
 
     def __init__(self):
@@ -0,0 +1,118 @@
+import hashlib
+import typing as t
+
+import settings
+from app import db
+from app.feeds import FeedType
+from app.imports.models import ImportTransaction
+from app.reporting import get_logger
+
+log = get_logger("dedup-index")
+
+# the number of transaction IDs checked or added per redis pipeline.
+BATCH_SIZE = 10000
+
+
+class DedupIndex:
+    """
+    A bloom filter of the transaction IDs imported for one provider & feed type, held in a redis bitmap.
+    If the filter says a transaction ID is missing then it has definitely not been imported.
+    Otherwise the ID is a candidate duplicate that needs confirming against the database.
+
+    Until the index has been built from the import_transaction table, every ID is a candidate.
+    """
+
+    def __init__(self, provider_slug: str, feed_type: FeedType) -> None:
+        self.provider_slug = provider_slug
+        self.feed_type = feed_type
+        self.key = f"{settings.REDIS_KEY_PREFIX}:dedup-index:{provider_slug}:{feed_type.name.lower()}"
+        self.ready_key = f"{self.key}:ready"
+
+    def __str__(self) -> str:
+        return f"{type(self).__name__}({self.provider_slug}, {self.feed_type.name})"
+
+    @staticmethod
+    def _offsets(transaction_id: str) -> list[int]:
+        # double hashing: https://www.eecs.harvard.edu/~michaelm/postscripts/rsa2008.pdf
+        digest = hashlib.blake2b(transaction_id.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size = settings.IMPORT_DEDUP_INDEX_BITS
+        return [(h1 + i * h2) % size for i in range(settings.IMPORT_DEDUP_INDEX_HASHES)]
+
+    def _bitfield(self, pipe, operation: str, transaction_id: str) -> None:
+        args: list[t.Any] = []
+        for offset in self._offsets(transaction_id):
+            args.extend([operation, "u1", offset] if operation == "GET" else [operation, "u1", offset, 1])
+        pipe.execute_command("BITFIELD", self.key, *args)
+
+    @staticmethod
+    def _shape() -> str:
+        return f"{settings.IMPORT_DEDUP_INDEX_BITS}:{settings.IMPORT_DEDUP_INDEX_HASHES}"
+
+    def is_ready(self) -> bool:
+        # an index built with a different size or number of hashes can't be read,
+        # and one whose bitmap has been evicted would report every transaction ID as new.
+        pipe = db.redis.pipeline(transaction=False)
+        pipe.get(self.ready_key)
+        pipe.exists(self.key)
+        shape, exists = pipe.execute()
+        return shape == self._shape() and bool(exists)
+
+    def candidates(self, transaction_ids: t.Iterable[str]) -> set[str]:
+        """Returns the subset of transaction IDs that might already have been imported."""
+        transaction_ids = list(transaction_ids)
+        if not self.is_ready():
+            log.debug(f"{self} has not been built. All {len(transaction_ids)} transaction IDs are candidates.")
+            return set(transaction_ids)
+
+        candidates: set[str] = set()
+        for i in range(0, len(transaction_ids), BATCH_SIZE):
+            batch = transaction_ids[i : i + BATCH_SIZE]
+            pipe = db.redis.pipeline(transaction=False)
+            for transaction_id in batch:
+                self._bitfield(pipe, "GET", transaction_id)
+            candidates.update(transaction_id for transaction_id, bits in zip(batch, pipe.execute()) if all(bits))
+
+        log.debug(f"{self} found {len(candidates)} candidate duplicates in {len(transaction_ids)} transaction IDs.")
+        return candidates
+
+    def add(self, transaction_ids: t.Iterable[str]) -> None:
+        transaction_ids = list(transaction_ids)
+        for i in range(0, len(transaction_ids), BATCH_SIZE):
+            pipe = db.redis.pipeline(transaction=False)
+            for transaction_id in transaction_ids[i : i + BATCH_SIZE]:
+                self._bitfield(pipe, "SET", transaction_id)
+            pipe.execute()
+
+    def rebuild(self, *, session: db.Session) -> int:
+        """
+        Rebuilds the index from the import_transaction table, and returns the number of rows read.
+        The index is not used while this is running. Imports that happen meanwhile are still added to it.
+        """
+        db.redis.delete(self.ready_key, self.key)
+
+        query = (
+            session.query(ImportTransaction.transaction_id)
+            .filter(
+                ImportTransaction.provider_slug == self.provider_slug, ImportTransaction.feed_type == self.feed_type
+            )
+            .yield_per(BATCH_SIZE)
+        )
+
+        count = 0
+        batch: list[str] = []
+        for (transaction_id,) in query:
+            batch.append(transaction_id)
+            if len(batch) == BATCH_SIZE:
+                self.add(batch)
+                count += len(batch)
+                batch = []
+        self.add(batch)
+        count += len(batch)
+
+        # makes sure the bitmap exists even if there was nothing to add, as is_ready checks for it.
+        db.redis.execute_command("BITFIELD", self.key, "INCRBY", "u1", 0, 0)
+        db.redis.set(self.ready_key, self._shape())
+        log.info(f"Rebuilt {self} from {count} import transactions.")
+        return count
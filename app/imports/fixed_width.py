@@ -0,0 +1,63 @@
+import typing as t
+from itertools import islice
+
+
+class FixedWidthField(t.NamedTuple):
+    name: str
+    start: int
+    length: int
+
+
+class FixedWidthParser:
+    """
+    Parses fixed width records into dicts of stripped strings, keyed by field name.
+
+    The field list is turned into a table of slice objects once, so parsing a line is a single pass over that table.
+    Fields named in `converters` are passed through the given function, for example `int` for amounts.
+    Lines shorter than a field's end produce a shorter (possibly empty) value for that field, same as slicing would.
+    """
+
+    def __init__(
+        self, fields: t.Sequence[FixedWidthField], *, converters: t.Optional[t.Dict[str, t.Callable]] = None
+    ) -> None:
+        self.fields = tuple(fields)
+        self.converters = converters or {}
+        self._slices = tuple((field.name, slice(field.start, field.start + field.length)) for field in self.fields)
+        self._converters = tuple(self.converters.items())
+
+    def _slice_for(self, name: str) -> slice:
+        for field_name, field_slice in self._slices:
+            if field_name == name:
+                return field_slice
+        raise KeyError(name)
+
+    def parse_line(self, line: str) -> dict:
+        """
+        Returns the raw field values for a single line, without any conversion.
+        """
+        return {name: line[field_slice].strip() for name, field_slice in self._slices}
+
+    def parse(
+        self,
+        data: bytes,
+        *,
+        skip_lines: int = 0,
+        where: t.Optional[t.Dict[str, str]] = None,
+        encoding: str = "utf-8",
+    ) -> t.Iterator[dict]:
+        """
+        Yields the converted field values for every line in `data`, after skipping the first `skip_lines` lines.
+        If `where` is given, only lines whose raw values match it are parsed, e.g. {"record_type": "D"}.
+        """
+        slices = self._slices
+        converters = self._converters
+        filters = tuple((self._slice_for(name), value) for name, value in (where or {}).items())
+
+        for line in islice(data.decode(encoding).split("\n"), skip_lines, None):
+            if filters and any(line[field_slice].strip() != value for field_slice, value in filters):
+                continue
+
+            record = {name: line[field_slice].strip() for name, field_slice in slices}
+            for name, converter in converters:
+                record[name] = converter(record[name])
+            yield record
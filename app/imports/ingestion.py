@@ -0,0 +1,180 @@
+import typing as t
+from datetime import date, datetime
+from enum import Enum
+
+import sqlalchemy as s
+from sqlalchemy.dialects import postgresql as psql
+from sqlalchemy.dialects.postgresql import insert
+
+import settings
+from app import db, encoding
+
+# characters that must be escaped in COPY's text format.
+_COPY_ESCAPES = str.maketrans({"\\": "\\\\", "\n": "\\n", "\r": "\\r", "\t": "\\t"})
+
+
+def _array_literal(values: t.Iterable[t.Any]) -> str:
+    def quote(value: t.Any) -> str:
+        if value is None:
+            return "NULL"
+        escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        return f'"{escaped}"'
+
+    return "{" + ",".join(quote(value) for value in values) + "}"
+
+
+def _copy_value(column: s.Column, value: t.Any) -> str:
+    """Renders a value the same way psycopg2 would bind it, in COPY text format."""
+    if value is None:
+        return "\\N"
+
+    if isinstance(column.type, s.JSON):
+        text = encoding.dumps(value)
+    elif isinstance(column.type, psql.ARRAY):
+        text = _array_literal(value)
+    elif isinstance(column.type, s.Enum):
+        # SQLAlchemy stores enum members by name.
+        text = value.name if isinstance(value, Enum) else str(value)
+    elif isinstance(value, Enum):
+        text = str(value.value)
+    elif isinstance(value, bool):
+        text = "t" if value else "f"
+    elif isinstance(value, (datetime, date)):
+        text = value.isoformat()
+    else:
+        text = str(value)
+
+    return text.translate(_COPY_ESCAPES)
+
+
+class _CopyStream:
+    """
+    A file-like object that renders lines of COPY data as psycopg2 reads them.
+    This avoids building the whole COPY payload in memory.
+    """
+
+    def __init__(self, lines: t.Iterator[str]) -> None:
+        self._lines = lines
+        self._buffer = ""
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self._buffer]
+        length = len(self._buffer)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+
+        data = "".join(chunks)
+        if size < 0:
+            size = len(data)
+        self._buffer = data[size:]
+        return data[:size]
+
+
+def _claim_keys(connection: s.engine.Connection, table: s.Table, rows: list[dict]) -> list[dict]:
+    """
+    Inserts the key of each row into the table's key table, and returns one row for each key that was claimed.
+    A key that is being claimed by a concurrent import blocks until that import finishes, so only one of them can
+    insert a row with it. Keys are claimed in a consistent order so that overlapping imports can't deadlock.
+    """
+    key_table = db.key_table(table)
+    if key_table is None:
+        return rows
+
+    key_columns = [column.name for column in key_table.primary_key]
+    rows_by_key: dict[tuple, dict] = {}
+    for row in rows:
+        rows_by_key.setdefault(tuple(row[name] for name in key_columns), row)
+
+    keys = sorted(rows_by_key, key=lambda key: [str(value) for value in key])
+    result = connection.execute(
+        insert(key_table)
+        .values([dict(zip(key_columns, key)) for key in keys])
+        .on_conflict_do_nothing()
+        .returning(*key_table.primary_key)
+    )
+    return [rows_by_key[tuple(row)] for row in result]
+
+
+def _insert_values(table: s.Table, rows: list[dict], *, returning: s.Column) -> list:
+    with db.engine.begin() as connection:
+        rows = _claim_keys(connection, table, rows)
+        if not rows:
+            return []
+
+        result = connection.execute(insert(table).values(rows).on_conflict_do_nothing().returning(returning))
+        return [row[0] for row in result]
+
+
+def _insert_copy(table: s.Table, rows: list[dict], *, returning: s.Column) -> list:
+    columns = [table.c[name] for name in rows[0]]
+    staging_name = f"{table.name}_staging"
+
+    with db.engine.begin() as connection:
+        quote = connection.dialect.identifier_preparer.quote
+        column_names = ", ".join(quote(column.name) for column in columns)
+
+        # temporary tables are never WAL-logged, and this one is private to the connection.
+        connection.execute(
+            s.text(
+                f"CREATE TEMPORARY TABLE {quote(staging_name)} ON COMMIT DROP AS "
+                f"SELECT {column_names} FROM {quote(table.name)} WITH NO DATA"
+            )
+        )
+
+        lines = ("\t".join(_copy_value(column, row[column.name]) for column in columns) + "\n" for row in rows)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(f"COPY {quote(staging_name)} ({column_names}) FROM STDIN", _CopyStream(lines))
+
+        staging = s.table(staging_name, *(s.column(column.name) for column in columns))
+        select = s.select(*staging.c)
+        if (key_table := db.key_table(table)) is not None:
+            # claims the keys as in _claim_keys, unstages the rows whose keys weren't claimed,
+            # and then inserts one staged row for each key that was.
+            key_columns = [staging.c[column.name] for column in key_table.primary_key]
+            claimed = (
+                insert(key_table)
+                .from_select(
+                    [column.name for column in key_columns],
+                    s.select(*key_columns).distinct().order_by(*key_columns),
+                )
+                .on_conflict_do_nothing()
+                .returning(*key_table.primary_key)
+                .cte("claimed_keys")
+            )
+            connection.execute(
+                s.delete(staging)
+                .where(~s.exists().where(s.and_(*(column == claimed.c[column.name] for column in key_columns))))
+                .add_cte(claimed)
+            )
+            select = select.distinct(*key_columns)
+
+        result = connection.execute(
+            insert(table).from_select(columns, select).on_conflict_do_nothing().returning(returning)
+        )
+        return [row[0] for row in result]
+
+
+def insert_rows(table: s.Table, rows: list[dict], *, returning: s.Column) -> list:
+    """
+    Inserts the given rows into `table`, skipping any that conflict with existing rows.
+    If `table` has a key table (see app.db.key_table), the rows' keys are claimed in it as part of the same transaction.
+    Returns the value of the `returning` column for each row that was actually inserted.
+    Every row must have the same keys.
+
+    The insert is done with the backend configured in IMPORT_INGESTION_BACKEND:
+    insert = a single multi-row INSERT statement.
+    copy = COPY into a temporary staging table, then INSERT ... SELECT from it.
+    """
+    if not rows:
+        return []
+
+    backend = settings.IMPORT_INGESTION_BACKEND
+    if backend == "insert":
+        return _insert_values(table, rows, returning=returning)
+    elif backend == "copy":
+        return _insert_copy(table, rows, returning=returning)
+    else:
+        raise ValueError(f"Unknown import ingestion backend: {backend}. Expected one of insert, copy.")
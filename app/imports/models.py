@@ -1,13 +1,17 @@
 import sqlalchemy as s
 
-from app.db import Base, ModelMixin, auto_repr
+from app import postgres
+from app.db import PARTITION_BY, Base, ModelMixin, PartitionedModelMixin, auto_repr
 from app.feeds import FeedType
 
 
 @auto_repr
-class ImportTransaction(Base, ModelMixin):
+class ImportTransaction(Base, PartitionedModelMixin):
     __tablename__ = "import_transaction"
-    __table_args__ = (s.UniqueConstraint("provider_slug", "transaction_id", "feed_type", name="_slug_id_feed_uc"),)
+    __table_args__ = (
+        s.UniqueConstraint("provider_slug", "transaction_id", "feed_type", "created_at", name="_slug_id_feed_uc"),
+        {"postgresql_partition_by": PARTITION_BY, "info": {"key_table": "import_transaction_key"}},
+    )
 
     transaction_id = s.Column(s.String(100), nullable=False)
     feed_type = s.Column(s.Enum(FeedType), nullable=False)
@@ -18,6 +22,20 @@ class ImportTransaction(Base, ModelMixin):
     data = s.Column(s.JSON)
 
 
+@auto_repr
+class ImportTransactionKey(Base):
+    """The unique key of every row in the partitioned import_transaction table."""
+
+    __tablename__ = "import_transaction_key"
+
+    provider_slug = s.Column(s.String(50), primary_key=True)
+    transaction_id = s.Column(s.String(100), primary_key=True)
+    feed_type = s.Column(s.Enum(FeedType), primary_key=True)
+
+    # matches the import transaction's created_at, so keys can be purged along with the partitions holding their rows.
+    created_at = s.Column(s.DateTime, nullable=False, server_default=postgres.utcnow(), index=True)
+
+
 @auto_repr
 class ImportFileLog(Base, ModelMixin):
     __tablename__ = "import_file_log"
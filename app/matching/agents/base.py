@@ -8,6 +8,9 @@ from sqlalchemy.orm.query import Query
 from app import db, models
 from app.reporting import get_logger
 
+if t.TYPE_CHECKING:
+    from app.matching.index import SchemeTransactionIndex
+
 
 class MatchResult(t.NamedTuple):
     matched_transaction: models.MatchedTransaction
@@ -76,7 +79,8 @@ class BaseMatchingAgent:
         since = pendulum.now().date().add(days=-14)
         return db.run_query(
             lambda: session.query(models.SchemeTransaction).filter(
-                models.SchemeTransaction.mids.any(self.payment_transaction.mid),
+                # @> rather than = ANY(...) so that the GIN index on mids can be used.
+                models.SchemeTransaction.mids.contains([self.payment_transaction.mid]),
                 models.SchemeTransaction.status == models.TransactionStatus.PENDING,
                 models.SchemeTransaction.created_at >= since.isoformat(),
                 models.SchemeTransaction.spend_amount == self.payment_transaction.spend_amount,
@@ -126,6 +130,11 @@ class BaseMatchingAgent:
         scheme_transactions = self._find_applicable_scheme_transactions(session=session)
         return self.do_match(scheme_transactions)
 
+    def match_in_memory(self, index: "SchemeTransactionIndex") -> t.Optional[MatchResult]:
+        """Runs the same rules as `match` against candidates from a preloaded index instead of the database."""
+        self.log.info(f"Matching {self.payment_transaction} in memory.")
+        return self.do_match(index.query(self.payment_transaction))
+
     def do_match(self, scheme_transactions) -> t.Optional[MatchResult]:
         raise NotImplementedError("Matching agents must implement the do_match method")
 
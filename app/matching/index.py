@@ -0,0 +1,175 @@
+import bisect
+import operator
+import typing as t
+from collections import defaultdict
+from datetime import datetime
+
+import pendulum
+import sqlalchemy as s
+from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
+from sqlalchemy.sql import operators
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter, BooleanClauseList, ClauseList
+
+from app import models
+
+IndexKey = tuple[str, int, str]
+Predicate = t.Callable[[models.SchemeTransaction], bool]
+
+
+class UnsupportedCriterion(Exception):
+    pass
+
+
+_COMPARISONS: dict[t.Callable, t.Callable[[t.Any, t.Any], bool]] = {
+    operators.eq: operator.eq,
+    operators.ne: operator.ne,
+    operators.lt: operator.lt,
+    operators.le: operator.le,
+    operators.gt: operator.gt,
+    operators.ge: operator.ge,
+}
+
+
+def _coerce(column: s.Column, value: t.Any) -> t.Any:
+    """
+    Converts a bound parameter into the python type held on the model.
+    Matching agents compare dates against ISO strings, which Postgres reads as UTC if they have no offset.
+    """
+    if isinstance(column.type, s.DateTime):
+        if isinstance(value, str):
+            value = pendulum.parse(value, tz=pendulum.UTC)
+        elif isinstance(value, datetime) and value.tzinfo is None:
+            value = pendulum.instance(value, tz=pendulum.UTC)
+    return value
+
+
+def _bind_value(clause: t.Any) -> t.Any:
+    if not isinstance(clause, BindParameter):
+        raise UnsupportedCriterion(f"Can't evaluate {clause!r} in memory.")
+    return clause.value
+
+
+def _date_range(criterion: t.Any) -> t.Optional[tuple[datetime, datetime]]:
+    """Returns the bounds of a `transaction_date BETWEEN x AND y` criterion, or None for any other criterion."""
+    if (
+        isinstance(criterion, BinaryExpression)
+        and criterion.operator is operators.between_op
+        and getattr(criterion.left, "table", None) is models.SchemeTransaction.__table__
+        and criterion.left.key == "transaction_date"
+        and isinstance(criterion.right, ClauseList)
+    ):
+        lower, upper = (_coerce(criterion.left, _bind_value(clause)) for clause in criterion.right.clauses)
+        return lower, upper
+    return None
+
+
+def _compile(criterion: t.Any) -> Predicate:
+    """Converts a SQLAlchemy filter criterion on SchemeTransaction into a python predicate."""
+    if isinstance(criterion, BooleanClauseList) and criterion.operator is operators.and_:
+        predicates = [_compile(clause) for clause in criterion.clauses]
+        return lambda tx: all(predicate(tx) for predicate in predicates)
+
+    if not isinstance(criterion, BinaryExpression) or getattr(criterion.left, "table", None) is not (
+        models.SchemeTransaction.__table__
+    ):
+        raise UnsupportedCriterion(f"Can't evaluate {criterion} in memory.")
+
+    column = criterion.left
+    key = column.key
+
+    if criterion.operator is operators.between_op and isinstance(criterion.right, ClauseList):
+        lower, upper = (_coerce(column, _bind_value(clause)) for clause in criterion.right.clauses)
+        return lambda tx: lower <= getattr(tx, key) <= upper
+
+    if comparison := _COMPARISONS.get(criterion.operator):
+        value = _coerce(column, _bind_value(criterion.right))
+        return lambda tx: comparison(getattr(tx, key), value)
+
+    raise UnsupportedCriterion(f"Can't evaluate operator {criterion.operator} in memory.")
+
+
+def _transaction_date(scheme_transaction: models.SchemeTransaction) -> datetime:
+    return scheme_transaction.transaction_date
+
+
+class SchemeTransactionQuery:
+    """
+    An in-memory stand-in for the parts of the Query API that matching agents use on scheme transactions.
+    Rows are kept sorted by transaction date.
+    """
+
+    def __init__(self, scheme_transactions: list[models.SchemeTransaction]) -> None:
+        self._scheme_transactions = scheme_transactions
+
+    def filter(self, *criteria: t.Any) -> "SchemeTransactionQuery":
+        scheme_transactions = self._scheme_transactions
+        for criterion in criteria:
+            if date_range := _date_range(criterion):
+                # rows are sorted by date, so a date range is a slice.
+                lower, upper = date_range
+                start = bisect.bisect_left(scheme_transactions, lower, key=_transaction_date)
+                end = bisect.bisect_right(scheme_transactions, upper, key=_transaction_date)
+                scheme_transactions = scheme_transactions[start:end]
+            else:
+                predicate = _compile(criterion)
+                scheme_transactions = [tx for tx in scheme_transactions if predicate(tx)]
+        return SchemeTransactionQuery(scheme_transactions)
+
+    def all(self) -> list[models.SchemeTransaction]:
+        return list(self._scheme_transactions)
+
+    def one(self) -> models.SchemeTransaction:
+        if not self._scheme_transactions:
+            raise NoResultFound("No row was found when one was required")
+        if len(self._scheme_transactions) > 1:
+            raise MultipleResultsFound("Multiple rows were found when exactly one was required")
+        return self._scheme_transactions[0]
+
+    def __iter__(self) -> t.Iterator[models.SchemeTransaction]:
+        return iter(self._scheme_transactions)
+
+    def __len__(self) -> int:
+        return len(self._scheme_transactions)
+
+
+class SchemeTransactionIndex:
+    """
+    Pending scheme transactions indexed on (mid, spend amount, payment provider) for in-memory matching.
+    Each bucket is sorted by transaction date.
+    """
+
+    def __init__(self, scheme_transactions: t.Iterable[models.SchemeTransaction]) -> None:
+        self._buckets: defaultdict[IndexKey, list[models.SchemeTransaction]] = defaultdict(list)
+        self._by_id: dict[int, models.SchemeTransaction] = {}
+        for scheme_transaction in scheme_transactions:
+            self.add(scheme_transaction)
+
+    @staticmethod
+    def _keys(scheme_transaction: models.SchemeTransaction) -> t.Iterator[IndexKey]:
+        for mid in set(scheme_transaction.mids):
+            yield (mid, scheme_transaction.spend_amount, scheme_transaction.payment_provider_slug)
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def add(self, scheme_transaction: models.SchemeTransaction) -> None:
+        self._by_id[scheme_transaction.id] = scheme_transaction
+        for key in self._keys(scheme_transaction):
+            bisect.insort(self._buckets[key], scheme_transaction, key=_transaction_date)
+
+    def remove(self, scheme_transaction_id: int) -> None:
+        """Removes a scheme transaction from the index, usually because it has been matched."""
+        scheme_transaction = self._by_id.pop(scheme_transaction_id, None)
+        if scheme_transaction is None:
+            return
+
+        for key in self._keys(scheme_transaction):
+            self._buckets[key].remove(scheme_transaction)
+
+    def get(self, scheme_transaction_id: int) -> t.Optional[models.SchemeTransaction]:
+        return self._by_id.get(scheme_transaction_id)
+
+    def query(self, payment_transaction: models.PaymentTransaction) -> SchemeTransactionQuery:
+        """Returns the candidate scheme transactions for the given payment transaction."""
+        key = (payment_transaction.mid, payment_transaction.spend_amount, payment_transaction.provider_slug)
+        return SchemeTransactionQuery(self._buckets.get(key, []))
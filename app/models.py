@@ -3,13 +3,15 @@ from enum import Enum
 import sqlalchemy as s
 from sqlalchemy.dialects import postgresql as psql
 
+from app import postgres
+
 # import other module's models here to be recognised by alembic.
 from app.config.models import ConfigItem  # noqa
-from app.db import Base, ModelMixin, auto_repr, auto_str
+from app.db import PARTITION_BY, Base, ModelMixin, PartitionedModelMixin, auto_repr, auto_str
 from app.encryption import decrypt_credentials
 from app.exports.models import ExportTransaction, FileSequenceNumber, PendingExport  # noqa
 from app.feeds import FeedType
-from app.imports.models import ImportFileLog, ImportTransaction  # noqa
+from app.imports.models import ImportFileLog, ImportTransaction, ImportTransactionKey  # noqa
 
 
 @auto_repr
@@ -70,9 +72,12 @@ class TransactionStatus(Enum):
 
 @auto_repr
 @auto_str("id", "transaction_id")
-class Transaction(Base, ModelMixin):
+class Transaction(Base, PartitionedModelMixin):
     __tablename__ = "transaction"
-    __table_args__ = (s.UniqueConstraint("transaction_id", "feed_type", name="_transaction_id_feed_type_t_uc"),)
+    __table_args__ = (
+        s.UniqueConstraint("transaction_id", "feed_type", "created_at", name="_transaction_id_feed_type_t_uc"),
+        {"postgresql_partition_by": PARTITION_BY, "info": {"key_table": "transaction_key"}},
+    )
 
     # the type of transaction this is. unique together with the transaction ID.
     feed_type = s.Column(s.Enum(FeedType), nullable=False)
@@ -113,10 +118,39 @@ class Transaction(Base, ModelMixin):
     extra_fields = s.Column(psql.JSON)  # any extra data used for exports
 
 
+@auto_repr
+class TransactionKey(Base):
+    """The unique key of every row in the partitioned transaction table."""
+
+    __tablename__ = "transaction_key"
+
+    transaction_id = s.Column(s.String(100), primary_key=True)
+    feed_type = s.Column(s.Enum(FeedType), primary_key=True)
+
+    # matches the transaction's created_at, so keys can be purged along with the partitions holding their rows.
+    created_at = s.Column(s.DateTime, nullable=False, server_default=postgres.utcnow(), index=True)
+
+
 @auto_repr
 @auto_str("id", "transaction_id", "provider_slug", "payment_provider_slug")
-class SchemeTransaction(Base, ModelMixin):
+class SchemeTransaction(Base, PartitionedModelMixin):
     __tablename__ = "scheme_transaction"
+    __table_args__ = (
+        # matching only ever looks for pending scheme transactions by MID, spend amount, and age.
+        s.Index(
+            "ix_scheme_transaction_pending_mids",
+            "mids",
+            postgresql_using="gin",
+            postgresql_where=s.text("status = 'PENDING'"),
+        ),
+        s.Index(
+            "ix_scheme_transaction_pending_spend_amount_created_at",
+            "spend_amount",
+            "created_at",
+            postgresql_where=s.text("status = 'PENDING'"),
+        ),
+        {"postgresql_partition_by": PARTITION_BY},
+    )
 
     merchant_identifier_ids = s.Column(psql.ARRAY(s.Integer))
     mids = s.Column(psql.ARRAY(s.String(50)), nullable=False)
@@ -138,8 +172,19 @@ class SchemeTransaction(Base, ModelMixin):
 
 @auto_repr
 @auto_str("id", "transaction_id", "provider_slug")
-class PaymentTransaction(Base, ModelMixin):
+class PaymentTransaction(Base, PartitionedModelMixin):
     __tablename__ = "payment_transaction"
+    __table_args__ = (
+        # matching only ever looks for pending payment transactions by MID, spend amount, and age.
+        s.Index(
+            "ix_payment_transaction_pending_mid_spend_amount_created_at",
+            "mid",
+            "spend_amount",
+            "created_at",
+            postgresql_where=s.text("status = 'PENDING'"),
+        ),
+        {"postgresql_partition_by": PARTITION_BY},
+    )
 
     merchant_identifier_ids = s.Column(psql.ARRAY(s.Integer))
     mid = s.Column(s.String(50), nullable=False)
@@ -177,8 +222,9 @@ class MatchedTransactionStatus(Enum):
 
 @auto_repr
 @auto_str("id", "transaction_id")
-class MatchedTransaction(Base, ModelMixin):
+class MatchedTransaction(Base, PartitionedModelMixin):
     __tablename__ = "matched_transaction"
+    __table_args__ = ({"postgresql_partition_by": PARTITION_BY},)
 
     merchant_identifier_id = s.Column(s.Integer, s.ForeignKey("merchant_identifier.id"))
     mid = s.Column(s.String(50), nullable=False)
@@ -196,8 +242,9 @@ class MatchedTransaction(Base, ModelMixin):
 
 @auto_repr
 @auto_str("id", "user_id", "scheme_account_id")
-class UserIdentity(Base, ModelMixin):
+class UserIdentity(Base, PartitionedModelMixin):
     __tablename__ = "user_identity"
+    __table_args__ = ({"postgresql_partition_by": PARTITION_BY},)
 
     transaction_id = s.Column(s.String, nullable=False, index=True)
     loyalty_id = s.Column(s.String(250), nullable=False)
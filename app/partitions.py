@@ -0,0 +1,212 @@
+import re
+import typing as t
+from datetime import date, datetime, timedelta
+
+import sqlalchemy as s
+
+from app import db, models
+from app.reporting import get_logger
+
+log = get_logger("partitions")
+
+# tables that are range partitioned by created_at, one partition per week.
+PARTITIONED_MODELS: list[t.Type[db.Base]] = [
+    models.ExportTransaction,
+    models.MatchedTransaction,
+    models.SchemeTransaction,
+    models.PaymentTransaction,
+    models.Transaction,
+    models.ImportTransaction,
+    models.UserIdentity,
+]
+
+PARTITION_INTERVAL = timedelta(weeks=1)
+
+_BOUND = re.compile(r"^FOR VALUES FROM \((?:'([^']+)'|MINVALUE)\) TO \((?:'([^']+)'|MAXVALUE)\)$")
+
+
+class Partition(t.NamedTuple):
+    name: str
+    # the range of created_at values the partition holds. None means unbounded, as does the default partition.
+    start: t.Optional[datetime]
+    end: t.Optional[datetime]
+    is_default: bool = False
+
+    def overlaps(self, start: datetime, end: datetime) -> bool:
+        if self.is_default:
+            return False
+        return (self.start is None or self.start < end) and (self.end is None or start < self.end)
+
+
+def partition_start(day: date) -> datetime:
+    """Returns the start of the weekly partition that holds `day`. Weeks start on Monday."""
+    monday = day - timedelta(days=day.weekday())
+    return datetime(monday.year, monday.month, monday.day)
+
+
+def partition_name(table_name: str, start: datetime) -> str:
+    return f"{table_name}_{start:%Y%m%d}"
+
+
+def _quote(name: str, *, session: db.Session) -> str:
+    return session.bind.dialect.identifier_preparer.quote(name)
+
+
+def get_partitions(table_name: str, *, session: db.Session) -> list[Partition]:
+    def get_data():
+        return session.execute(
+            s.text(
+                "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid) "
+                "FROM pg_inherits "
+                "JOIN pg_class parent ON parent.oid = pg_inherits.inhparent "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE parent.relname = :table_name "
+                "ORDER BY child.relname"
+            ),
+            {"table_name": table_name},
+        ).all()
+
+    rows = db.run_query(get_data, session=session, read_only=True, description=f"find partitions of {table_name}")
+
+    partitions = []
+    for name, bound in rows:
+        if bound == "DEFAULT":
+            partitions.append(Partition(name, None, None, is_default=True))
+        elif match := _BOUND.match(bound):
+            start, end = (datetime.fromisoformat(value) if value else None for value in match.groups())
+            partitions.append(Partition(name, start, end))
+        else:
+            log.warning(f"Ignoring partition {name} of {table_name} with unexpected bound: {bound}")
+    return partitions
+
+
+def _create_partition(table_name: str, start: datetime, *, session: db.Session) -> str:
+    """
+    Creates a partition for the week starting at `start`.
+    Rows in that week that have already been put in the default partition are moved into the new one.
+    """
+    end = start + PARTITION_INTERVAL
+    name = partition_name(table_name, start)
+    table = _quote(table_name, session=session)
+    partition = _quote(name, session=session)
+    default = _quote(f"{table_name}_default", session=session)
+    params = {"start": start, "end": end}
+
+    def create():
+        session.execute(s.text(f"CREATE TABLE {partition} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+        session.execute(
+            s.text(
+                f"WITH moved AS ("
+                f"DELETE FROM {default} WHERE created_at >= :start AND created_at < :end RETURNING *"
+                f") INSERT INTO {partition} SELECT * FROM moved"
+            ),
+            params,
+        )
+        session.execute(
+            s.text(f"ALTER TABLE {table} ATTACH PARTITION {partition} FOR VALUES FROM (:start) TO (:end)"),
+            params,
+        )
+        session.commit()
+
+    db.run_query(create, session=session, description=f"create partition {name}")
+    return name
+
+
+def create_partitions(weeks: int, *, today: t.Optional[date] = None, session: db.Session) -> list[str]:
+    """
+    Makes sure every partitioned table has a partition for this week and each of the next `weeks` weeks.
+    Returns the names of the partitions that were created.
+    """
+    first = partition_start(today or datetime.utcnow().date())
+    created = []
+    for model in PARTITIONED_MODELS:
+        table_name = model.__tablename__
+        partitions = get_partitions(table_name, session=session)
+        for week in range(weeks + 1):
+            start = first + week * PARTITION_INTERVAL
+            if any(partition.overlaps(start, start + PARTITION_INTERVAL) for partition in partitions):
+                continue
+
+            created.append(_create_partition(table_name, start, session=session))
+            log.info(f"Created partition {created[-1]}.")
+    return created
+
+
+def _drop_partition(table_name: str, partition: Partition, *, session: db.Session) -> None:
+    table = _quote(table_name, session=session)
+    name = _quote(partition.name, session=session)
+
+    def drop():
+        if table_name == models.ExportTransaction.__tablename__:
+            # pending exports reference the partition's rows, which would stop it from being detached.
+            session.execute(
+                s.text(f"DELETE FROM pending_export WHERE export_transaction_id IN (SELECT id FROM {name})")
+            )
+        session.execute(s.text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+        session.execute(s.text(f"DROP TABLE {name}"))
+        session.commit()
+
+    db.run_query(drop, session=session, description=f"drop partition {partition.name}")
+
+
+def _delete_expired_rows(table_name: str, partition: Partition, before: datetime, *, session: db.Session) -> int:
+    name = _quote(partition.name, session=session)
+
+    def delete():
+        if table_name == models.ExportTransaction.__tablename__:
+            session.execute(
+                s.text(
+                    f"DELETE FROM pending_export WHERE export_transaction_id IN "
+                    f"(SELECT id FROM {name} WHERE created_at < :before)"
+                ),
+                {"before": before},
+            )
+        result = session.execute(s.text(f"DELETE FROM {name} WHERE created_at < :before"), {"before": before})
+        session.commit()
+        return result.rowcount
+
+    return db.run_query(delete, session=session, description=f"delete rows from {partition.name} before {before}")
+
+
+def _delete_expired_keys(key_table: s.Table, before: datetime, *, session: db.Session) -> int:
+    def delete():
+        result = session.execute(s.delete(key_table).where(key_table.c.created_at < before))
+        session.commit()
+        return result.rowcount
+
+    return db.run_query(delete, session=session, description=f"delete {key_table.name} rows from before {before}")
+
+
+def drop_partitions(before: datetime, *, session: db.Session) -> dict[str, list[str]]:
+    """
+    Detaches & drops every partition that only holds rows created before `before`.
+    Weekly partitions that straddle `before` are kept until they have fully expired.
+
+    The default partition, and the partition holding rows from before the tables were partitioned,
+    aren't aligned to weeks, so expired rows are deleted from those instead.
+
+    Keys are deleted from the table's key table (see app.db.key_table) once none of the remaining rows can have them.
+
+    Returns the names of the dropped partitions for each table.
+    """
+    dropped: dict[str, list[str]] = {}
+    for model in PARTITIONED_MODELS:
+        table_name = model.__tablename__
+        dropped[table_name] = []
+        # the earliest created_at of any row that is left in the table.
+        oldest = before
+        for partition in get_partitions(table_name, session=session):
+            if partition.end is not None and partition.end <= before:
+                _drop_partition(table_name, partition, session=session)
+                dropped[table_name].append(partition.name)
+                log.info(f"Dropped partition {partition.name}.")
+            elif partition.is_default or partition.start is None:
+                deleted = _delete_expired_rows(table_name, partition, before, session=session)
+                log.info(f"Deleted {deleted} rows from {partition.name}.")
+            else:
+                oldest = min(oldest, partition.start)
+
+        if (key_table := db.key_table(model.__table__)) is not None:
+            deleted = _delete_expired_keys(key_table, oldest, session=session)
+            log.info(f"Deleted {deleted} rows from {key_table.name}.")
+    return dropped
@@ -62,20 +62,91 @@ class BinkPrometheus:
                     documentation="Number of files received",
                     labelnames=("transaction_type", "process_type", "slug"),
                 ),
+                "queue_messages": Counter(
+                    name="queue_messages",
+                    documentation="Number of queue messages imported & acked",
+                    labelnames=("transaction_type", "process_type", "slug"),
+                ),
+                "export_agent_pool_hits": Counter(
+                    name="export_agent_pool_hits",
+                    documentation="Number of export jobs that reused a pooled export agent",
+                    labelnames=("transaction_type", "process_type", "slug"),
+                ),
+                "export_agent_pool_misses": Counter(
+                    name="export_agent_pool_misses",
+                    documentation="Number of export jobs that had to build a new export agent",
+                    labelnames=("transaction_type", "process_type", "slug"),
+                ),
+                "exports_deferred": Counter(
+                    name="exports_deferred",
+                    documentation="Number of exports deferred by a merchant's rate limit",
+                    labelnames=("transaction_type", "process_type", "slug"),
+                ),
+                "audit_messages_dropped": Counter(
+                    name="audit_messages_dropped",
+                    documentation="Number of audit messages dropped because the local spool was full",
+                    labelnames=("transaction_type", "process_type", "slug"),
+                ),
+                "db_pool_checkouts": Counter(
+                    name="db_pool_checkouts",
+                    documentation="Number of connections checked out of the database pool",
+                    labelnames=("transaction_type", "process_type", "slug"),
+                ),
             },
             "histograms": {
                 "request_latency": Histogram(
                     name="request_latency_seconds",
                     documentation="Request latency seconds",
                     labelnames=("process_type", "slug"),
-                )
+                ),
+                "queue_batch_size": Histogram(
+                    name="queue_batch_size",
+                    documentation="Number of queue messages imported in each batch",
+                    labelnames=("process_type", "slug"),
+                    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500, 1000),
+                ),
+                "queue_batch_duration": Histogram(
+                    name="queue_batch_duration_seconds",
+                    documentation="Time taken to import & ack a batch of queue messages",
+                    labelnames=("process_type", "slug"),
+                ),
+                "queue_message_latency": Histogram(
+                    name="queue_message_latency_seconds",
+                    documentation="Time between a queue message being received and acked",
+                    labelnames=("process_type", "slug"),
+                ),
+                "export_agent_construction": Histogram(
+                    name="export_agent_construction_seconds",
+                    documentation="Time taken to build & warm up an export agent",
+                    labelnames=("process_type", "slug"),
+                ),
+                "audit_publish_latency": Histogram(
+                    name="audit_publish_latency_seconds",
+                    documentation="Time taken to publish an audit message & receive its confirm",
+                    labelnames=("process_type", "slug"),
+                ),
+                "db_pool_checkout_wait": Histogram(
+                    name="db_pool_checkout_wait_seconds",
+                    documentation="Time spent waiting for a connection from the database pool",
+                    labelnames=("process_type", "slug"),
+                ),
             },
             "gauges": {
                 "last_file_timestamp": Gauge(
                     name="last_file_timestamp",
                     documentation="Timestamp of last file processed",
                     labelnames=("process_type", "slug"),
-                )
+                ),
+                "audit_spool_depth": Gauge(
+                    name="audit_spool_depth",
+                    documentation="Number of audit messages waiting to be published",
+                    labelnames=("process_type", "slug"),
+                ),
+                "db_pool_checked_out": Gauge(
+                    name="db_pool_checked_out",
+                    documentation="Number of database pool connections currently in use",
+                    labelnames=("process_type", "slug"),
+                ),
             },
         }
 
@@ -155,9 +226,34 @@ class BinkPrometheus:
         agent_metrics = getattr(agent, "prometheus_metrics", None)
         if agent_metrics:
             if histogram_name in agent_metrics.get("histograms", []):
-                context_manager = self.metric_types["histograms"]["request_latency"]
+                context_manager = self.metric_types["histograms"][histogram_name]
                 context_manager_stack.enter_context(context_manager.labels(process_type=process_type, slug=slug).time())
 
+    def observe_histogram(
+        self,
+        agent: object,
+        histogram_name: str,
+        value: t.Union[int, float],
+        process_type: t.Optional[str] = "",
+        slug: t.Optional[str] = "",
+    ) -> None:
+        """
+        Useful method for getting an instance's histogram, if it exists,
+        and recording an observation in it
+
+        :param agent: instance of an agent
+        :param histogram_name: e.g. 'request_latency'
+        :param value: the observed value, e.g. a duration in seconds
+        :param process_type: e.g import or export
+        :param slug: e.g wasabi-club, visa
+        """
+        agent_metrics = getattr(agent, "prometheus_metrics", None)
+        if agent_metrics:
+            if histogram_name in agent_metrics.get("histograms", []):
+                self.metric_types["histograms"][histogram_name].labels(process_type=process_type, slug=slug).observe(
+                    value
+                )
+
 
 # Singleton metric types
 bink_prometheus = BinkPrometheus()
@@ -34,6 +34,9 @@ class Registry(t.Generic[T]):
     def remove(self, key: str) -> None:
         del self._entries[key]
 
+    def keys(self) -> t.List[str]:
+        return list(self._entries)
+
     def registered_entries(self, key: str) -> t.List[str]:
         try:
             return self._entries[key].rsplit(".", 1)
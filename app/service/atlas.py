@@ -169,3 +169,18 @@ def queue_audit_message(message: MessagePayload, destination="all") -> None:
             # to affect other Harmonia processes. Logging will tell us about an issues.
             event_id = sentry_sdk.capture_exception()
             log.warning(f"Problem during Atlas audit process. {type(ex).__name__}. Sentry event ID: {event_id}")
+
+
+def flush_audit_messages() -> None:
+    """
+    Publishes any audit messages still waiting in this process' spool.
+    This should be called at the end of each job, as RQ job processes don't live long enough to flush on exit.
+    """
+    if not settings.AUDIT_EXPORTS:
+        return
+
+    try:
+        exchange.flush()
+    except Exception as ex:
+        event_id = sentry_sdk.capture_exception()
+        log.warning(f"Problem flushing Atlas audit messages. {type(ex).__name__}. Sentry event ID: {event_id}")
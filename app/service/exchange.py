@@ -1,8 +1,15 @@
+import atexit
 import logging
+import os
+import threading
+import time
+import typing as t
+from collections import deque
 
-from kombu import Connection, Exchange, Queue
+from kombu import Connection, Exchange, Producer, Queue
 
 import settings
+from app.prometheus import bink_prometheus
 
 log = logging.getLogger(__name__)
 
@@ -10,24 +17,218 @@ exchange = Exchange("tx_export_exchange", type="direct", durable=False)
 atlas_queue = Queue("tx_matching", exchange=exchange, routing_key="atlas")
 plutus_queue = Queue("tx_plutus_dw", exchange=exchange, routing_key="dw")
 
+# how long to wait after failing to reach RabbitMQ before trying again.
+RECONNECT_DELAY = 5
+
+# how long to wait for RabbitMQ to confirm a batch of published messages.
+CONFIRM_TIMEOUT = 10
+
 
 def _on_error(exc, interval):
     log.warning(f"Failed to connect to RabbitMQ: {exc}. Will retry after {interval:.1f}s...")
 
 
-def publish(message: dict, *, provider: str, destination="all") -> None:
-    with Connection(settings.RABBITMQ_DSN, connect_timeout=3) as conn:
-        conn.ensure_connection(
-            errback=_on_error, max_retries=3, interval_start=0.2, interval_step=0.4, interval_max=1, timeout=3
-        )
-        producer = conn.Producer(serializer="json")
-        # Always send a message to Atlas
-        producer.publish(
-            message, exchange=exchange, headers={"X-Provider": provider}, declare=[atlas_queue], routing_key="atlas"
-        )
+class _Envelope(t.NamedTuple):
+    message: dict
+    provider: str
+    routing_key: str
+    spooled_at: float
+
+
+class Publisher:
+    """
+    Publishes messages over a single long-lived RabbitMQ connection with publisher confirms.
+
+    Messages are held in a bounded local spool and published in batches of AUDIT_PUBLISH_BATCH_SIZE, or once the
+    oldest message is AUDIT_PUBLISH_INTERVAL seconds old. Each batch is published in full before waiting for RabbitMQ
+    to confirm it. If RabbitMQ can't be reached, messages stay in the spool until a later flush succeeds.
+    When the spool is full the oldest messages are dropped.
+
+    A forked process starts with an empty spool & no connection, leaving the parent's messages to the parent.
+    """
+
+    prometheus_metrics = {
+        "counters": ["audit_messages_dropped"],
+        "histograms": ["audit_publish_latency"],
+        "gauges": ["audit_spool_depth"],
+    }
+
+    def __init__(self) -> None:
+        self._spool: t.Deque[_Envelope] = deque()
+        self._lock = threading.RLock()
+        self._connection: t.Optional[Connection] = None
+        self._producer: t.Optional[Producer] = None
+        self._retry_at = 0.0
 
-        # Almost always send a message to the data warehouse, except where a message destination is only for atlas
-        if destination == "all":
-            producer.publish(
-                message, exchange=exchange, headers={"X-Provider": provider}, declare=[plutus_queue], routing_key="dw"
+        # delivery tags of published messages that RabbitMQ hasn't confirmed yet.
+        self._confirms = False
+        self._delivery_tag = 0
+        self._unconfirmed: t.Set[int] = set()
+        self._nacked = False
+
+    def _after_fork(self) -> None:
+        self.__init__()  # type: ignore[misc]
+
+    def __len__(self) -> int:
+        return len(self._spool)
+
+    def _connect(self) -> Producer:
+        if self._producer is not None:
+            return self._producer
+
+        connection = Connection(settings.RABBITMQ_DSN, connect_timeout=3)
+        try:
+            connection.ensure_connection(
+                errback=_on_error, max_retries=3, interval_start=0.2, interval_step=0.4, interval_max=1, timeout=3
             )
+            producer = connection.Producer(serializer="json")
+            producer.maybe_declare(atlas_queue)
+            producer.maybe_declare(plutus_queue)
+
+            # confirms are a RabbitMQ extension, so transports without them (such as memory://) publish unconfirmed.
+            channel = producer.channel
+            self._confirms = hasattr(channel, "confirm_select")
+            if self._confirms:
+                channel.confirm_select()
+                channel.events["basic_ack"].add(self._on_ack)
+                channel.events["basic_nack"].add(self._on_nack)
+                self._delivery_tag = 0
+        except Exception:
+            connection.release()
+            raise
+
+        self._connection, self._producer = connection, producer
+        return producer
+
+    def _disconnect(self) -> None:
+        if self._connection is not None:
+            try:
+                self._connection.release()
+            except Exception as ex:
+                log.debug(f"Error closing RabbitMQ connection: {ex}")
+        self._connection = self._producer = None
+        self._unconfirmed.clear()
+
+    def _confirmed(self, delivery_tag: int, multiple: bool) -> None:
+        if multiple:
+            self._unconfirmed = {tag for tag in self._unconfirmed if tag > delivery_tag}
+        else:
+            self._unconfirmed.discard(delivery_tag)
+
+    def _on_ack(self, delivery_tag: int, multiple: bool) -> None:
+        self._confirmed(delivery_tag, multiple)
+
+    def _on_nack(self, delivery_tag: int, multiple: bool) -> None:
+        self._nacked = True
+        self._confirmed(delivery_tag, multiple)
+
+    def _wait_for_confirms(self) -> None:
+        assert self._connection is not None
+        deadline = time.monotonic() + CONFIRM_TIMEOUT
+        while self._unconfirmed:
+            self._connection.drain_events(timeout=max(deadline - time.monotonic(), 0))
+
+        if self._nacked:
+            self._nacked = False
+            raise ConnectionError("RabbitMQ rejected one or more audit messages.")
+
+    def _update_spool_depth(self) -> None:
+        bink_prometheus.update_gauge(
+            agent=self, gauge_name="audit_spool_depth", value=len(self._spool), process_type="export"
+        )
+
+    def publish(self, message: dict, *, provider: str, routing_keys: t.Iterable[str]) -> None:
+        with self._lock:
+            now = time.monotonic()
+            for routing_key in routing_keys:
+                self._spool.append(_Envelope(message, provider, routing_key, now))
+
+            dropped = len(self._spool) - settings.AUDIT_SPOOL_SIZE
+            if dropped > 0:
+                for _ in range(dropped):
+                    envelope = self._spool.popleft()
+                    bink_prometheus.increment_counter(
+                        agent=self,
+                        counter_name="audit_messages_dropped",
+                        increment_by=1,
+                        process_type="export",
+                        slug=envelope.provider,
+                    )
+                log.warning(f"Audit message spool is full. Dropped the {dropped} oldest messages.")
+
+            self._update_spool_depth()
+
+            oldest_age = now - self._spool[0].spooled_at if self._spool else 0
+            if len(self._spool) >= settings.AUDIT_PUBLISH_BATCH_SIZE or oldest_age >= settings.AUDIT_PUBLISH_INTERVAL:
+                self.flush()
+
+    def flush(self) -> None:
+        """
+        Publishes every spooled message. Raises if RabbitMQ can't be reached, leaving unsent messages in the spool.
+        Does nothing for RECONNECT_DELAY seconds after a failure, so that an unreachable broker doesn't hold up callers.
+        """
+        with self._lock:
+            if not self._spool or time.monotonic() < self._retry_at:
+                return
+
+            try:
+                producer = self._connect()
+                batch = list(self._spool)
+                start = time.perf_counter()
+                for envelope in batch:
+                    producer.publish(
+                        envelope.message,
+                        exchange=exchange,
+                        headers={"X-Provider": envelope.provider},
+                        routing_key=envelope.routing_key,
+                    )
+                    if self._confirms:
+                        self._delivery_tag += 1
+                        self._unconfirmed.add(self._delivery_tag)
+                self._wait_for_confirms()
+
+                # the whole batch stays spooled until it's confirmed, so a failure part way through resends all of it.
+                latency = time.perf_counter() - start
+                for envelope in batch:
+                    self._spool.popleft()
+                    bink_prometheus.observe_histogram(
+                        agent=self,
+                        histogram_name="audit_publish_latency",
+                        value=latency,
+                        process_type="export",
+                        slug=envelope.provider,
+                    )
+            except Exception:
+                self._disconnect()
+                self._retry_at = time.monotonic() + RECONNECT_DELAY
+                raise
+            finally:
+                self._update_spool_depth()
+
+    def close(self) -> None:
+        try:
+            self.flush()
+        except Exception as ex:
+            log.warning(f"Failed to publish {len(self._spool)} spooled messages: {ex}")
+        finally:
+            self._disconnect()
+
+
+publisher = Publisher()
+atexit.register(publisher.close)
+os.register_at_fork(after_in_child=publisher._after_fork)
+
+
+def publish(message: dict, *, provider: str, destination="all") -> None:
+    # Always send a message to Atlas
+    routing_keys = [atlas_queue.routing_key]
+
+    # Almost always send a message to the data warehouse, except where a message destination is only for atlas
+    if destination == "all":
+        routing_keys.append(plutus_queue.routing_key)
+
+    publisher.publish(message, provider=provider, routing_keys=routing_keys)
+
+
+def flush() -> None:
+    publisher.flush()
@@ -40,11 +40,15 @@ class Hermes:
         return response.json()
 
     def payment_card_user_info(self, loyalty_scheme_slug: str, payment_card_token: str) -> dict:
+        return self.payment_cards_user_info(loyalty_scheme_slug, [payment_card_token])
+
+    def payment_cards_user_info(self, loyalty_scheme_slug: str, payment_card_tokens: list[str]) -> dict:
+        """Looks up the users of several payment cards at once. The response is keyed on payment card token."""
         loyalty_scheme_slug = self._format_slug(loyalty_scheme_slug)
         endpoint = f"/payment_cards/accounts/payment_card_user_info/{loyalty_scheme_slug}"
 
         try:
-            return self.post(endpoint, {"payment_cards": [payment_card_token]}, name="payment card user info")
+            return self.post(endpoint, {"payment_cards": payment_card_tokens}, name="payment card user info")
         except HTTPError as ex:
             # hermes will raise a 404 if the scheme is not found.
             # this is usually because it's been deleted or the slug has been changed.
@@ -1,6 +1,7 @@
 import typing as t
-from functools import cached_property
+from datetime import datetime
 
+import pendulum
 import redis
 import rq
 import sentry_sdk
@@ -9,7 +10,10 @@ from tenacity import retry, stop_after_attempt, wait_exponential
 import settings
 from app import config, db, models, reporting
 from app.core import export_director, identifier, import_director, matching_director, matching_worker, streaming_worker
+from app.data_warehouse import queue as data_warehouse_queue
+from app.exports.agent_pool import export_agent_pool
 from app.feeds import FeedType
+from app.service import atlas
 
 log = reporting.get_logger("tasks")
 
@@ -49,23 +53,99 @@ class LoggedQueue(rq.Queue):
 
         return result
 
-    @cached_property
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=5, min=5),
+        reraise=True,
+    )
+    def enqueue_batch(self, f, calls: t.Iterable[t.Tuple[tuple, dict]]) -> t.List[rq.job.Job]:
+        """
+        Enqueues one job per (args, kwargs) pair in `calls` using a single redis pipeline.
+        """
+        job_datas = [
+            self.prepare_data(f, args=args, kwargs=kwargs, retry=rq.Retry(max=3, interval=[10, 30, 60]))
+            for args, kwargs in calls
+        ]
+        if not job_datas:
+            return []
+
+        try:
+            result = self.enqueue_many(job_datas)
+            log.debug(f"{len(job_datas)} {f.__name__} tasks enqueued on queue {self.name}")
+        except redis.RedisError:
+            raise TasksRedisException
+
+        return result
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=5, min=5),
+        reraise=True,
+    )
+    def schedule_batch(self, f, calls: t.Iterable[t.Tuple[datetime, tuple, dict]]) -> t.List[rq.job.Job]:
+        """
+        Schedules one job per (enqueue_at, args, kwargs) tuple in `calls` using a single redis pipeline.
+        Scheduled jobs are moved onto the queue by a worker running with the scheduler enabled.
+        """
+        pipe = self.connection.pipeline()
+        jobs = [
+            self.schedule_job(
+                self.create_job(f, args=args, kwargs=kwargs, retry=rq.Retry(max=3, interval=[10, 30, 60])),
+                enqueue_at,
+                pipeline=pipe,
+            )
+            for enqueue_at, args, kwargs in calls
+        ]
+        if not jobs:
+            return []
+
+        try:
+            pipe.execute()
+            log.debug(f"{len(jobs)} {f.__name__} tasks scheduled on queue {self.name}")
+        except redis.RedisError:
+            raise TasksRedisException
+
+        return jobs
+
+    @property
     def queue_limit(self) -> int:
-        with db.session_scope() as session:
-            ql = self.config.get("queue_limit", session=session)
-        return int(ql)
+        return int(self.config.get("queue_limit"))
 
     def has_capacity(self) -> bool:
         return self.count < self.queue_limit
 
 
+class RefreshExportAgentsWorker(rq.Worker):
+    """
+    Refreshes pooled export agents in the worker process before each export job.
+    Jobs run in a forked work horse, so this is the only place a refreshed agent outlives the job that uses it.
+    """
+
+    def execute_job(self, job: rq.job.Job, queue: rq.Queue) -> None:
+        if queue.name == export_queue.name:
+            export_agent_pool.refresh_stale()
+        super().execute_job(job, queue)
+
+
 def run_worker(queue_names: t.List[str], *, burst: bool = False, workerclass: t.Type[rq.Worker] = rq.Worker):
     if not queue_names:
         log.warning("No queues were passed to tasks.run_worker, exiting early.")
         return  # no queues, nothing to do
     queues = [LoggedQueue(name, connection=db.redis_raw) for name in queue_names]
+
+    # export agents are built before any jobs are run so that every job can reuse them.
+    warm_up_export_agents = settings.EXPORT_AGENT_POOL and export_queue.name in queue_names
+    if warm_up_export_agents:
+        export_agent_pool.warm_up()
+        workerclass = type(workerclass.__name__, (RefreshExportAgentsWorker, workerclass), {})
+
     worker = workerclass(queues, connection=db.redis_raw, log_job_description=False)
-    worker.work(burst=burst, with_scheduler=True)
+
+    try:
+        worker.work(burst=burst, with_scheduler=True)
+    finally:
+        if warm_up_export_agents:
+            export_agent_pool.teardown()
 
 
 import_queue = LoggedQueue(name="import", connection=db.redis_raw)
@@ -105,6 +185,62 @@ def identify_user(
     import_queue.enqueue(import_transaction, transaction_id, feed_type, match_group)
 
 
+def _retry_identify_users(
+    identify_args: t.List[identifier.IdentifyArgs], *, feed_type: FeedType, match_group: str, attempt: int
+) -> None:
+    if attempt >= settings.IDENTIFY_USERS_MAX_RETRIES:
+        log.warning(
+            f"Failed to get user info for {len(identify_args)} transactions in group #{match_group} "
+            f"after {attempt} retries. These will not be retried again."
+        )
+        return
+
+    delay = settings.IDENTIFY_USERS_RETRY_DELAY * 2**attempt
+    log.debug(f"Failed to get user info for {len(identify_args)} transactions. These will be retried in {delay}s.")
+    identify_user_queue.schedule_batch(
+        identify_users,
+        [
+            (
+                pendulum.now("UTC").add(seconds=delay),
+                (),
+                dict(identify_args=identify_args, feed_type=feed_type, match_group=match_group, attempt=attempt + 1),
+            )
+        ],
+    )
+
+
+def identify_users(
+    *, identify_args: t.List[identifier.IdentifyArgs], feed_type: FeedType, match_group: str, attempt: int = 0
+) -> None:
+    log.debug(f"Task started: identify users for {len(identify_args)} transactions in group #{match_group}")
+
+    with db.session_scope() as session:
+        try:
+            result = identifier.identify_users(identify_args, session=session)
+        except identifier.RetryableLookupFailure:
+            event_id = sentry_sdk.capture_exception()
+            log.debug(f"Failed to get user info from Hermes. Sentry event ID: {event_id}")
+            _retry_identify_users(identify_args, feed_type=feed_type, match_group=match_group, attempt=attempt)
+            return
+        except Exception as ex:
+            if settings.DEBUG:
+                raise
+            event_id = sentry_sdk.capture_exception()
+            log.warning(
+                f"Failed to identify users for {len(identify_args)} transactions in group #{match_group}: {repr(ex)}. "
+                f"Sentry event ID: {event_id}"
+            )
+            return
+
+    if result.retry:
+        _retry_identify_users(result.retry, feed_type=feed_type, match_group=match_group, attempt=attempt)
+
+    import_queue.enqueue_batch(
+        import_transaction,
+        [((transaction_id, feed_type, match_group), {}) for transaction_id in result.identified],
+    )
+
+
 def import_transaction(transaction_id: str, feed_type: FeedType, match_group: str) -> None:
     log.debug(f"Task started: import {feed_type.name} transaction #{transaction_id}")
 
@@ -150,9 +286,7 @@ def persist_auth_payment_transactions(
     director = matching_director.PaymentMatchingDirector()
 
     with db.session_scope() as session:
-        # TODO: replace with batch process
-        for payment_transaction in payment_transactions:
-            director.handle_auth_payment_transaction(payment_transaction, session=session)
+        director.handle_auth_payment_transactions(payment_transactions, session=session)
 
 
 def persist_settled_payment_transactions(
@@ -162,9 +296,7 @@ def persist_settled_payment_transactions(
     director = matching_director.PaymentMatchingDirector()
 
     with db.session_scope() as session:
-        # TODO: replace with batch process
-        for payment_transaction in payment_transactions:
-            director.handle_settled_payment_transaction(payment_transaction, session=session)
+        director.handle_settled_payment_transactions(payment_transactions, session=session)
 
 
 def match_payment_transaction(settlement_key: str) -> None:
@@ -219,5 +351,9 @@ def export_singular_transaction(pending_export_id: int) -> None:
     log.debug(f"Task started: handle pending export #{pending_export_id}")
     director = export_director.ExportDirector()
 
-    with db.session_scope() as session:
-        director.handle_pending_export(pending_export_id, session=session)
+    try:
+        with db.session_scope() as session:
+            director.handle_pending_export(pending_export_id, session=session)
+    finally:
+        atlas.flush_audit_messages()
+        data_warehouse_queue.flush()
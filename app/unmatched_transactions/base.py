@@ -1,8 +1,10 @@
 from collections.abc import Iterable
 from functools import cached_property
 
+import sqlalchemy as s
+
 from app import db, tasks  # noqa
-from app.core.export_director import ExportFields, create_export
+from app.core.export_director import ExportFields, create_exports
 from app.models import MerchantIdentifier, PaymentTransaction, TransactionStatus, UserIdentity
 from app.reporting import get_logger
 from app.scheduler import CronScheduler
@@ -45,13 +47,21 @@ class BaseAgent:
 
     def load_unmatched_transactions(self) -> None:
         with db.session_scope() as session:
-            pt_updates: list = []
+            export_fields: list[ExportFields] = []
+            pt_keys: list[tuple] = []
             for ptx, uid, mid in self.find_unmatched_transactions(session=session):
-                self.create_export_transaction(ptx, uid, mid, session=session)
-                pt_updates.append({"id": ptx.id, "status": TransactionStatus.MATCHED.name})
+                export_fields.append(self.make_export_fields(ptx, uid, mid))
+                # payment_transaction is partitioned by created_at, so filtering on it lets postgres prune partitions.
+                pt_keys.append((ptx.id, ptx.created_at))
 
-            if len(pt_updates) > 0:
-                session.bulk_update_mappings(PaymentTransaction, pt_updates)
+            if len(pt_keys) > 0:
+                create_exports(export_fields, session=session)
+                session.execute(
+                    s.update(PaymentTransaction)
+                    .where(s.tuple_(PaymentTransaction.id, PaymentTransaction.created_at).in_(pt_keys))
+                    .values(status=TransactionStatus.MATCHED)
+                    .execution_options(synchronize_session=False)
+                )
 
     def find_unmatched_transactions(
         self, session: db.Session
@@ -60,39 +70,34 @@ class BaseAgent:
             "Override the find_unmatched_transactions method in your agent to obtained unmatched transactions."
         )
 
-    def create_export_transaction(
+    def make_export_fields(
         self,
         transaction: PaymentTransaction,
         user_identity: UserIdentity,
         merchant_identifier: MerchantIdentifier,
-        *,
-        session: db.Session,
-    ) -> None:
-        create_export(
-            ExportFields(
-                transaction_id=transaction.transaction_id,
-                feed_type=None,
-                merchant_slug=self.provider_slug,
-                transaction_date=transaction.transaction_date,
-                spend_amount=transaction.spend_amount,
-                spend_currency=transaction.spend_currency,
-                loyalty_id=user_identity.loyalty_id,
-                mid=merchant_identifier.identifier,
-                primary_identifier=transaction.mid,
-                location_id=merchant_identifier.location_id,
-                merchant_internal_id=merchant_identifier.merchant_internal_id,
-                user_id=user_identity.user_id,
-                scheme_account_id=user_identity.scheme_account_id,
-                payment_card_account_id=user_identity.payment_card_account_id,
-                credentials=user_identity.credentials,
-                settlement_key=transaction.settlement_key,
-                last_four=user_identity.last_four,
-                expiry_month=user_identity.expiry_month,
-                expiry_year=user_identity.expiry_year,
-                payment_provider_slug=transaction.provider_slug,
-                auth_code=transaction.auth_code,
-                approval_code=transaction.approval_code,
-                extra_fields=transaction.extra_fields,
-            ),
-            session=session,
+    ) -> ExportFields:
+        return ExportFields(
+            transaction_id=transaction.transaction_id,
+            feed_type=None,
+            merchant_slug=self.provider_slug,
+            transaction_date=transaction.transaction_date,
+            spend_amount=transaction.spend_amount,
+            spend_currency=transaction.spend_currency,
+            loyalty_id=user_identity.loyalty_id,
+            mid=merchant_identifier.identifier,
+            primary_identifier=transaction.mid,
+            location_id=merchant_identifier.location_id,
+            merchant_internal_id=merchant_identifier.merchant_internal_id,
+            user_id=user_identity.user_id,
+            scheme_account_id=user_identity.scheme_account_id,
+            payment_card_account_id=user_identity.payment_card_account_id,
+            credentials=user_identity.credentials,
+            settlement_key=transaction.settlement_key,
+            last_four=user_identity.last_four,
+            expiry_month=user_identity.expiry_month,
+            expiry_year=user_identity.expiry_year,
+            payment_provider_slug=transaction.provider_slug,
+            auth_code=transaction.auth_code,
+            approval_code=transaction.approval_code,
+            extra_fields=transaction.extra_fields,
         )
@@ -0,0 +1,113 @@
+"""
+Times the import ingestion backends against harness-generated Iceland files.
+
+    python -m harness.benchmark_ingestion --rows 10000 --rows 100000 --rows 1000000
+"""
+import time
+import typing as t
+from uuid import uuid4
+
+import click
+import toml
+
+import settings
+from app import db, models
+from app.imports import ingestion
+from app.imports.agents.iceland import Iceland
+from harness.providers.iceland import Iceland as IcelandProvider
+
+BACKENDS = ["insert", "copy"]
+
+
+def make_file(fixture_file: str, n_rows: int) -> bytes:
+    fixture = toml.load(fixture_file)
+    user = fixture["users"][0]
+
+    # the provider gives every row its own transaction ID, so repeating a transaction is enough.
+    user["transactions"] = user["transactions"][:1] * n_rows
+    fixture["users"] = [user]
+
+    return IcelandProvider().provide(fixture)
+
+
+def build_inserts(data: bytes, match_group: str) -> tuple[list[dict], list[dict]]:
+    agent = Iceland()
+    import_transaction_inserts = []
+    transaction_inserts = []
+
+    with db.session_scope() as session:
+        for tx_data in agent.yield_transactions_data(data):
+            import_transaction_insert, transaction_insert, _ = agent._build_inserts(
+                tx_data, match_group, "benchmark", session=session
+            )
+            import_transaction_inserts.append(import_transaction_insert)
+            if transaction_insert:
+                transaction_inserts.append(transaction_insert)
+
+    return import_transaction_inserts, transaction_inserts
+
+
+def ingest(import_transaction_inserts: list[dict], transaction_inserts: list[dict], *, chunk_size: int) -> float:
+    import_transaction_table = models.ImportTransaction.__table__
+    transaction_table = models.Transaction.__table__
+
+    start = time.perf_counter()
+    for i in range(0, len(import_transaction_inserts), chunk_size):
+        ingestion.insert_rows(
+            import_transaction_table,
+            import_transaction_inserts[i : i + chunk_size],
+            returning=import_transaction_table.c.transaction_id,
+        )
+        ingestion.insert_rows(
+            transaction_table,
+            transaction_inserts[i : i + chunk_size],
+            returning=transaction_table.c.transaction_id,
+        )
+    return time.perf_counter() - start
+
+
+def delete_match_group(match_group: str) -> None:
+    with db.session_scope() as session:
+        session.query(models.ImportTransaction).filter(models.ImportTransaction.match_group == match_group).delete()
+        session.query(models.Transaction).filter(models.Transaction.match_group == match_group).delete()
+
+
+@click.command()
+@click.option(
+    "--fixture-file",
+    "-f",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    default="harness/fixtures/default.toml",
+    show_default=True,
+)
+@click.option("--rows", "-n", type=int, multiple=True, default=[10_000, 100_000, 1_000_000], show_default=True)
+@click.option(
+    "--chunk-size",
+    type=int,
+    default=settings.IMPORT_CHUNK_SIZE,
+    help="Rows per insert. 0 inserts each file in one go.",
+    show_default=True,
+)
+def main(fixture_file: str, rows: t.Iterable[int], chunk_size: int) -> None:
+    db.Base.metadata.create_all(bind=db.engine)
+
+    for n_rows in rows:
+        match_group = uuid4().hex
+        import_transaction_inserts, transaction_inserts = build_inserts(make_file(fixture_file, n_rows), match_group)
+
+        for backend in BACKENDS:
+            settings.IMPORT_INGESTION_BACKEND = backend
+            try:
+                elapsed = ingest(import_transaction_inserts, transaction_inserts, chunk_size=chunk_size or n_rows)
+            finally:
+                delete_match_group(match_group)
+
+            click.secho(
+                f"{n_rows:>9} rows  {backend:<6}  {elapsed:8.2f}s  {n_rows / elapsed:10.0f} rows/s",
+                fg="cyan",
+                bold=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Times the Mastercard TGX2 settlement parser against the line-by-line parser it replaced.
+
+    python -m harness.benchmark_parsing --rows 10000 --rows 100000 --rows 1000000
+"""
+import time
+import typing as t
+from uuid import uuid4
+
+import click
+import pendulum
+import toml
+
+from app.imports.agents.mastercard import DATETIME_FORMAT, MastercardTGX2Settlement
+from harness.providers.mastercard import MastercardTGX2Settlement as MastercardTGX2SettlementProvider
+
+
+def make_file(fixture_file: str, n_rows: int) -> bytes:
+    fixture = toml.load(fixture_file)
+    user = fixture["users"][0]
+    transaction = user["transactions"][0]
+    start = pendulum.instance(transaction["date"])
+
+    # a day's worth of transactions, so that the date parsing sees a realistic number of distinct timestamps.
+    user["transactions"] = [
+        {**transaction, "date": start.add(seconds=i * 86400 // n_rows), "settlement_key": str(uuid4())}
+        for i in range(n_rows)
+    ]
+    fixture["users"] = [user]
+
+    return MastercardTGX2SettlementProvider().provide(fixture)
+
+
+def legacy_yield_transactions_data(agent: MastercardTGX2Settlement, data: bytes) -> t.Iterable[dict]:
+    lines = data.decode().split("\n")[1:]
+    for line in lines:
+        raw_data = {field.name: line[field.start : field.start + field.length].strip() for field in agent.fields}
+
+        if raw_data["record_type"] != "D":
+            continue
+
+        legacy_get_transaction_date(raw_data)
+
+        yield {k: agent.field_transforms.get(k, str)(v) for k, v in raw_data.items()}
+
+
+def legacy_get_transaction_date(data: dict) -> pendulum.DateTime:
+    return pendulum.from_format(f"{data['date']} {data['time']}", DATETIME_FORMAT, tz="Europe/London")
+
+
+def run_legacy(data: bytes) -> float:
+    agent = MastercardTGX2Settlement()
+    start = time.perf_counter()
+    for transaction_data in legacy_yield_transactions_data(agent, data):
+        # the file agent and to_transaction_fields both parse the date again.
+        legacy_get_transaction_date(transaction_data)
+        legacy_get_transaction_date(transaction_data)
+    return time.perf_counter() - start
+
+
+def run_current(data: bytes) -> float:
+    agent = MastercardTGX2Settlement()
+    start = time.perf_counter()
+    for transaction_data in agent.yield_transactions_data(data):
+        agent.get_transaction_date(transaction_data)
+        agent.get_transaction_date(transaction_data)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option(
+    "--fixture-file",
+    "-f",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    default="harness/fixtures/default.toml",
+    show_default=True,
+)
+@click.option("--rows", "-n", type=int, multiple=True, default=[10_000, 100_000, 1_000_000], show_default=True)
+def main(fixture_file: str, rows: t.Iterable[int]) -> None:
+    for n_rows in rows:
+        data = make_file(fixture_file, n_rows)
+
+        for name, run in [("legacy", run_legacy), ("current", run_current)]:
+            elapsed = run(data)
+            click.secho(
+                f"{n_rows:>9} rows  {name:<7}  {elapsed:8.2f}s  {n_rows / elapsed:10.0f} rows/s",
+                fg="cyan",
+                bold=True,
+            )
+
+
+if __name__ == "__main__":
+    main()
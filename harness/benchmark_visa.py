@@ -0,0 +1,83 @@
+"""
+Times the per-message CPU cost of the Visa import agents, with and without indexed message elements.
+
+    python -m harness.benchmark_visa --messages 10000
+
+Merchant slug lookups are stubbed out, so only the agents' own work on each message is measured.
+"""
+import time
+import typing as t
+from unittest import mock
+from uuid import uuid4
+
+import click
+import toml
+
+from app.imports.agents import visa
+from harness.providers import visa as visa_providers
+
+AGENTS: list[tuple[str, t.Type[visa.VisaQueueAgent], t.Type]] = [
+    ("auth", visa.VisaAuth, visa_providers.VisaAuth),
+    ("settlement", visa.VisaSettlement, visa_providers.VisaSettlement),
+    ("refund", visa.VisaRefund, visa_providers.VisaRefund),
+]
+
+
+# each run is repeated and the fastest is reported, to smooth out noise from the rest of the machine.
+REPEATS = 3
+
+
+def make_messages(fixture_file: str, provider_class: t.Type, n_messages: int) -> list[dict]:
+    fixture = toml.load(fixture_file)
+    user = fixture["users"][0]
+    transaction = user["transactions"][0]
+    user["transactions"] = [{**transaction, "settlement_key": str(uuid4())} for _ in range(n_messages)]
+    fixture["users"] = [user]
+    return provider_class().provide(fixture)
+
+
+def handle_message(agent: visa.VisaQueueAgent, message: dict) -> None:
+    # the same calls the import makes for each message.
+    agent.get_transaction_id(message)
+    agent.get_transaction_id(message)
+    agent.get_primary_mids(message)
+    agent._all_identifiers(message)
+    agent.to_transaction_fields(message)
+
+
+def run(agent: visa.VisaQueueAgent, messages: list[dict], *, indexed: bool) -> float:
+    start = time.perf_counter()
+    for message in messages:
+        if indexed:
+            message = agent.prepare_message(message)
+        handle_message(agent, message)
+    return time.perf_counter() - start
+
+
+@click.command()
+@click.option(
+    "--fixture-file",
+    "-f",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    default="harness/fixtures/default.toml",
+    show_default=True,
+)
+@click.option("--messages", "-n", "n_messages", type=int, default=10_000, show_default=True)
+def main(fixture_file: str, n_messages: int) -> None:
+    for name, agent_class, provider_class in AGENTS:
+        messages = make_messages(fixture_file, provider_class, n_messages)
+        # a plain function rather than a mock, which would record every call & skew the timings.
+        with mock.patch.object(agent_class, "get_merchant_slug", new=lambda self, data: "iceland-bonus-card"):
+            agent = agent_class()
+            for indexed in (False, True):
+                elapsed = min(run(agent, messages, indexed=indexed) for _ in range(REPEATS))
+                label = "indexed" if indexed else "linear"
+                click.secho(
+                    f"{name:<10}  {label:<7}  {elapsed * 1_000_000 / n_messages:8.1f}µs/message",
+                    fg="cyan",
+                    bold=True,
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Checks that the matching queries use the pending transaction indexes rather than scanning whole tables.
+
+    python -m harness.bulk_load_db --scheme-transaction-count 10000000 --payment-transaction-count 10000000
+    python -m harness.explain_matching
+
+Exits with a non-zero status if any query plans a sequential scan on scheme_transaction or payment_transaction.
+On small tables a sequential scan is often the right plan, so the check refuses to run below --min-rows unless
+--disable-seqscan is given, which only checks that the indexes can be used at all.
+"""
+import json
+import sys
+import typing as t
+
+import click
+import pendulum
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Query
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from app import db, models
+from app.core.matching_worker import pending_payment_transactions_query, pending_scheme_transactions_query
+from app.matching.agents.base import BaseMatchingAgent
+
+TABLES = ["scheme_transaction", "payment_transaction"]
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement: ClauseElement) -> None:
+        self.statement = statement
+
+
+@compiles(Explain, "postgresql")
+def _compile_explain(element: Explain, compiler, **kwargs) -> str:
+    return f"EXPLAIN (FORMAT JSON) {compiler.process(element.statement, **kwargs)}"
+
+
+def explain(query: Query, *, session: db.Session) -> dict:
+    plan = session.execute(Explain(query.statement)).scalar()
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+
+
+def walk(plan: dict) -> t.Iterator[dict]:
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk(child)
+
+
+def seq_scans(plan: dict) -> list[str]:
+    return [node["Relation Name"] for node in walk(plan) if node["Node Type"] == "Seq Scan"]
+
+
+def index_names(plan: dict) -> list[str]:
+    return [node["Index Name"] for node in walk(plan) if "Index Name" in node]
+
+
+def estimated_rows(table: str, *, session: db.Session) -> int:
+    return session.execute("SELECT reltuples::bigint FROM pg_class WHERE relname = :table", {"table": table}).scalar()
+
+
+def make_queries(*, session: db.Session) -> dict[str, Query]:
+    """
+    Builds each matching query with values taken from the pending transactions in the database, if there are any.
+    """
+    since = pendulum.now().date().add(days=-14)
+
+    scheme_transaction = (
+        session.query(models.SchemeTransaction)
+        .filter(models.SchemeTransaction.status == models.TransactionStatus.PENDING)
+        .first()
+    )
+    if scheme_transaction:
+        group = (
+            session.query(models.SchemeTransaction.mids, models.SchemeTransaction.spend_amount)
+            .filter(models.SchemeTransaction.match_group == scheme_transaction.match_group)
+            .all()
+        )
+        mids = {mid for group_mids, _ in group for mid in group_mids}
+        amounts = {spend_amount for _, spend_amount in group}
+    else:
+        mids, amounts = {"explain-mid"}, {100}
+
+    payment_transaction = (
+        session.query(models.PaymentTransaction)
+        .filter(models.PaymentTransaction.status == models.TransactionStatus.PENDING)
+        .first()
+    ) or models.PaymentTransaction(mid="explain-mid", spend_amount=100)
+
+    return {
+        "find pending scheme transactions for matching": BaseMatchingAgent(
+            payment_transaction, None  # type: ignore
+        )._find_applicable_scheme_transactions(session=session),
+        "find pending payment transactions to match scheme transaction": pending_payment_transactions_query(
+            mids=mids, amounts=amounts, since=since, session=session
+        ),
+        "load pending scheme transactions for group matching": pending_scheme_transactions_query(
+            mids=mids, amounts=amounts, since=since, session=session
+        ),
+    }
+
+
+@click.command()
+@click.option("--min-rows", type=int, default=10_000_000, show_default=True)
+@click.option("--disable-seqscan", is_flag=True, help="Plan with enable_seqscan off, to check the indexes can be used.")
+def main(min_rows: int, disable_seqscan: bool) -> None:
+    with db.session_scope() as session:
+        if disable_seqscan:
+            session.execute("SET LOCAL enable_seqscan = off")
+        else:
+            for table in TABLES:
+                rows = estimated_rows(table, session=session)
+                if rows < min_rows:
+                    click.secho(
+                        f"{table} has about {rows} rows, fewer than {min_rows}. "
+                        "Load more with harness.bulk_load_db, or use --disable-seqscan.",
+                        fg="red",
+                        bold=True,
+                    )
+                    sys.exit(2)
+
+        failed = False
+        for description, query in make_queries(session=session).items():
+            plan = explain(query, session=session)
+            if scanned := seq_scans(plan):
+                failed = True
+                click.secho(f"FAIL  {description}: sequential scan on {', '.join(scanned)}", fg="red", bold=True)
+                click.echo(json.dumps(plan, indent=2))
+            else:
+                click.secho(f"OK    {description}: {', '.join(index_names(plan))}", fg="green", bold=True)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
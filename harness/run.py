@@ -36,6 +36,7 @@ with mocked_auth_decorator():
     import settings
     from app import db, encryption, feeds, models, tasks
     from app.exports.agents import BatchExportAgent, export_agents
+    from app.identifiers import index as mid_index
     from app.imports.agents.bases.active_api_agent import ActiveAPIAgent
     from app.imports.agents.bases.base import BaseAgent
     from app.imports.agents.bases.file_agent import FileAgent
@@ -323,6 +324,7 @@ def create_merchant_identifier(fixture: dict, session: db.Session):
                 merchant_identifier.id = mid_id
             session.merge(merchant_identifier)
     session.commit()
+    mid_index.bump_version()
 
 
 def preload_import_transactions(count: int, *, fixture: dict, session: db.Session):
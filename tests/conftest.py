@@ -2,6 +2,22 @@ import pytest
 from sqlalchemy.orm import Session
 
 from app import db
+from app.config import config
+from app.identifiers import index as mid_index
+
+
+@pytest.fixture(autouse=True)
+def clear_config_cache():
+    # tests often set config values directly in redis, which doesn't invalidate the cache.
+    config.cache.invalidate()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def clear_mid_index():
+    # tests create merchant identifiers directly in the database, which doesn't bump the index version.
+    mid_index.index.invalidate()
+    yield
 
 
 @pytest.fixture()
@@ -1,6 +1,7 @@
 import contextlib
 import inspect
 import secrets
+import time
 from functools import partial
 from unittest import mock
 
@@ -97,6 +98,29 @@ def test_all_keys(redis, token0):
     assert realised == [(k, token0)], "there should be a single config key stored"
 
 
+def test_all_keys_prefix(redis, token0, token1):
+    keys = [make_key(f"test-all-keys-prefix.{i}") for i in range(5)]
+    for key in keys:
+        redis.set(key, token0)
+    redis.set(make_key("test-all-keys-other"), token1)
+
+    with mock.patch.object(config, "SCAN_COUNT", 2):
+        realised = sorted(config.all_keys("test-all-keys-prefix."))
+
+    assert realised == [(key, token0) for key in keys]
+
+
+def test_all_keys_redis_error(redis, token0, db_session):
+    k = make_key("test-all-keys-redis-error-0")
+    db_session.add(models.ConfigItem(key=k, value=token0))
+    db_session.add(models.ConfigItem(key=make_key("other-0"), value=token0))
+
+    with mock.patch.object(config.redis, "scan", side_effect=config.RedisError("redis is down")):
+        realised = list(config.all_keys("test-all-keys-", session=db_session))
+
+    assert realised == [(k, token0)]
+
+
 def test_config(redis, token0, token1, db_session):
     k = make_key("test-config-value-with-default-0")
     cv = config.ConfigValue("cv-name", key=k, default=token0)
@@ -156,3 +180,57 @@ def test_update_key_api(redis, token0, token1, api_client, db_session):
 
         resp = api_client.put(url_for("config_api.update_key", key=k), json={"bad": True})
         assert resp.status_code == 400, resp.json
+
+
+def test_get_is_cached(redis, token0, token1, db_session):
+    k = make_key("test-get-is-cached-0")
+    redis.set(k, token0)
+    assert config.get(k, session=db_session) == token0
+
+    redis.set(k, token1)
+    assert config.get(k, session=db_session) == token0, "the previous get should have cached the value"
+
+    with mock.patch.object(config.settings, "CONFIG_CACHE_TTL", 0):
+        config.cache.invalidate(k)
+        assert config.get(k, session=db_session) == token1
+        redis.set(k, token0)
+        assert config.get(k, session=db_session) == token0, "values should not be cached with a TTL of 0"
+
+
+def test_update_invalidates_cache(redis, token0, token1, db_session):
+    k = make_key("test-update-invalidates-cache-0")
+    db_session.add(models.ConfigItem(key=k, value=token0))
+    assert config.get(k, session=db_session) == token0
+
+    # simulate another process caching the value
+    config.cache.set(k, token0)
+    with mock.patch.object(config.cache, "invalidate", wraps=config.cache.invalidate) as mock_invalidate:
+        redis.publish(config.INVALIDATION_CHANNEL, k)
+        for _ in range(50):
+            if mock_invalidate.called:
+                break
+            time.sleep(0.1)
+
+    mock_invalidate.assert_called_with(k)
+    assert config.cache.get(k) is None
+
+    config.update(k, token1, session=db_session)
+    assert config.get(k, session=db_session) == token1
+
+
+def test_list_keys_api_pagination(redis, token0, api_client):
+    keys = [make_key(f"test-list-keys-api-page.{i}") for i in range(3)]
+    for key in keys:
+        redis.set(key, token0)
+    redis.set(make_key("test-list-keys-api-other"), token0)
+
+    resp = api_client.get(url_for("config_api.list_keys", prefix="test-list-keys-api-page.", limit=2))
+    assert resp.status_code == 200, resp.json
+    assert resp.json == {"keys": [{"key": key, "value": token0} for key in keys[:2]]}
+
+    resp = api_client.get(url_for("config_api.list_keys", prefix="test-list-keys-api-page.", after=keys[1], limit=2))
+    assert resp.status_code == 200, resp.json
+    assert resp.json == {"keys": [{"key": keys[2], "value": token0}]}
+
+    resp = api_client.get(url_for("config_api.list_keys", limit=0))
+    assert resp.status_code == 400, resp.json
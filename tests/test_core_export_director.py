@@ -0,0 +1,97 @@
+from unittest import mock
+
+import pendulum
+
+import settings
+from app import db, models, tasks
+from app.core import export_director
+from app.core.export_director import ExportFields, create_export, create_exports
+from app.exports.models import ExportTransactionStatus
+from app.feeds import FeedType
+
+MERCHANT_SLUG = "iceland-bonus-card"
+
+
+def make_export_fields(**kwargs) -> ExportFields:
+    return ExportFields(
+        **{
+            "transaction_id": "tx-1",
+            "feed_type": FeedType.MERCHANT,
+            "merchant_slug": MERCHANT_SLUG,
+            "transaction_date": pendulum.datetime(2023, 1, 1, 12, 0, 0),
+            "spend_amount": 1500,
+            "spend_currency": "GBP",
+            "loyalty_id": "loyalty-1",
+            "mid": "mid-1",
+            "primary_identifier": "mid-1",
+            "location_id": "location-1",
+            "merchant_internal_id": "internal-1",
+            "user_id": 1,
+            "scheme_account_id": 2,
+            "payment_card_account_id": 3,
+            "credentials": "credentials",
+            "settlement_key": "settlement-key-1",
+            "last_four": "1234",
+            "expiry_month": 12,
+            "expiry_year": 2030,
+            "payment_provider_slug": "visa",
+            "auth_code": "123456",
+            "approval_code": "",
+            "extra_fields": {"key": "value"},
+            **kwargs,
+        }
+    )
+
+
+@mock.patch.object(settings, "EXPORT_ASYNC_SLUGS", [])
+@mock.patch.object(tasks.export_queue, "enqueue_batch")
+def test_create_export(mock_enqueue_batch, db_session: db.Session) -> None:
+    create_export(make_export_fields(), session=db_session)
+
+    pending_export = db_session.query(models.PendingExport).one()
+    export_transaction = pending_export.export_transaction
+    assert pending_export.provider_slug == MERCHANT_SLUG
+    assert pending_export.retry_count == 0
+    assert export_transaction.transaction_id == "tx-1"
+    assert export_transaction.status == ExportTransactionStatus.PENDING
+    assert export_transaction.extra_fields == {"key": "value"}
+    assert export_transaction.export_uid is not None
+
+    mock_enqueue_batch.assert_called_once_with(tasks.export_singular_transaction, [((pending_export.id,), {})])
+
+
+@mock.patch.object(settings, "EXPORT_ASYNC_SLUGS", ["async-merchant"])
+@mock.patch.object(export_director, "INSERT_CHUNK_SIZE", 2)
+@mock.patch.object(tasks.export_queue, "enqueue_batch")
+def test_create_exports(mock_enqueue_batch, db_session: db.Session) -> None:
+    pending_export_ids = create_exports(
+        [
+            make_export_fields(transaction_id="tx-1"),
+            make_export_fields(transaction_id="tx-2"),
+            make_export_fields(transaction_id="tx-3", merchant_slug="async-merchant"),
+        ],
+        session=db_session,
+    )
+
+    pending_exports = {
+        pe.export_transaction.transaction_id: pe
+        for pe in db_session.query(models.PendingExport).filter(models.PendingExport.id.in_(pending_export_ids))
+    }
+    assert len(pending_export_ids) == 3
+    assert {transaction_id: pe.provider_slug for transaction_id, pe in pending_exports.items()} == {
+        "tx-1": MERCHANT_SLUG,
+        "tx-2": MERCHANT_SLUG,
+        "tx-3": "async-merchant",
+    }
+
+    # the async merchant's pending export is left for the async export executor.
+    mock_enqueue_batch.assert_called_once()
+    f, calls = mock_enqueue_batch.call_args.args
+    assert f == tasks.export_singular_transaction
+    assert sorted(calls) == sorted([((pending_exports[tx].id,), {}) for tx in ("tx-1", "tx-2")])
+
+
+@mock.patch.object(tasks.export_queue, "enqueue_batch")
+def test_create_exports_nothing_to_export(mock_enqueue_batch, db_session: db.Session) -> None:
+    assert create_exports([], session=db_session) == []
+    mock_enqueue_batch.assert_not_called()
@@ -0,0 +1,97 @@
+from unittest import mock
+
+import requests
+
+import settings
+from app import db, models
+from app.core import identifier
+from app.core.identifier import IdentifyArgs
+from tests.fixtures import Default, get_or_create_merchant_identifier, get_or_create_user_identity
+
+USER_INFO = {
+    "loyalty_id": Default.loyalty_id,
+    "scheme_account_id": Default.scheme_account_id,
+    "payment_card_account_id": 1,
+    "user_id": Default.user_id,
+    "credentials": Default.credentials,
+    "card_information": {"first_six": Default.first_six, "last_four": Default.last_four},
+}
+
+
+def identify_args(transaction_id: str, card_token: str, merchant_identifier_id: int) -> IdentifyArgs:
+    return IdentifyArgs(
+        transaction_id=transaction_id, merchant_identifier_ids=[merchant_identifier_id], card_token=card_token
+    )
+
+
+@mock.patch.object(settings, "HERMES_USER_INFO_CACHE_TTL", 0)
+@mock.patch("app.core.identifier.hermes.payment_cards_user_info")
+def test_identify_users(mock_payment_cards_user_info, db_session: db.Session) -> None:
+    mock_payment_cards_user_info.return_value = {"token-1": USER_INFO, "token-2": {"scheme_account_id": None}}
+    merchant_identifier = get_or_create_merchant_identifier(session=db_session)
+    get_or_create_user_identity(session=db_session, transaction_id="tx-0")
+
+    result = identifier.identify_users(
+        [
+            identify_args("tx-0", "token-0", merchant_identifier.id),
+            identify_args("tx-1", "token-1", merchant_identifier.id),
+            identify_args("tx-2", "token-2", merchant_identifier.id),
+            identify_args("tx-3", "token-1", merchant_identifier.id),
+        ],
+        session=db_session,
+    )
+
+    mock_payment_cards_user_info.assert_called_once_with(Default.merchant_slug, ["token-1", "token-2"])
+    assert result == identifier.IdentifyResult(identified=["tx-0", "tx-1", "tx-3"], retry=[])
+
+    transaction_ids = {row[0] for row in db_session.query(models.UserIdentity.transaction_id)}
+    assert transaction_ids == {"tx-0", "tx-1", "tx-3"}
+
+
+@mock.patch.object(settings, "HERMES_USER_INFO_CACHE_TTL", 0)
+@mock.patch("app.core.identifier.hermes.payment_cards_user_info")
+def test_identify_users_malformed_user_info(mock_payment_cards_user_info, db_session: db.Session) -> None:
+    malformed = {key: value for key, value in USER_INFO.items() if key != "user_id"}
+    mock_payment_cards_user_info.return_value = {"malformed-token-1": USER_INFO, "malformed-token-2": malformed}
+    merchant_identifier = get_or_create_merchant_identifier(session=db_session)
+
+    result = identifier.identify_users(
+        [
+            identify_args("tx-1", "malformed-token-1", merchant_identifier.id),
+            identify_args("tx-2", "malformed-token-2", merchant_identifier.id),
+        ],
+        session=db_session,
+    )
+
+    assert result == identifier.IdentifyResult(identified=["tx-1"], retry=[])
+    assert [row[0] for row in db_session.query(models.UserIdentity.transaction_id)] == ["tx-1"]
+
+
+@mock.patch("app.core.identifier.hermes.payment_cards_user_info", side_effect=requests.ConnectionError)
+def test_identify_users_retry(mock_payment_cards_user_info, db_session: db.Session) -> None:
+    merchant_identifier = get_or_create_merchant_identifier(session=db_session)
+    args = identify_args("tx-1", "uncached-token", merchant_identifier.id)
+
+    result = identifier.identify_users([args], session=db_session)
+
+    assert result == identifier.IdentifyResult(identified=[], retry=[args])
+    assert db_session.query(models.UserIdentity).count() == 0
+
+
+@mock.patch.object(settings, "HERMES_USER_INFO_BATCH_SIZE", 2)
+@mock.patch("app.core.identifier.hermes.payment_cards_user_info")
+def test_payment_cards_user_info_cache(mock_payment_cards_user_info) -> None:
+    mock_payment_cards_user_info.return_value = {"cached-token-1": USER_INFO}
+    slug = "test-cache-slug"
+
+    try:
+        first = identifier.payment_cards_user_info(slug, ["cached-token-1", "cached-token-2", "cached-token-3"])
+        second = identifier.payment_cards_user_info(slug, ["cached-token-1"])
+    finally:
+        db.redis.delete(identifier._user_info_cache_key(slug, "cached-token-1"))
+
+    assert first == second == {"cached-token-1": USER_INFO}
+    assert mock_payment_cards_user_info.call_args_list == [
+        mock.call(slug, ["cached-token-1", "cached-token-2"]),
+        mock.call(slug, ["cached-token-3"]),
+    ]
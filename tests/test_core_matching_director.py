@@ -0,0 +1,87 @@
+from unittest import mock
+
+import pytest
+
+from app import db, models, tasks
+from app.core.matching_director import PaymentMatchingDirector
+from tests.fixtures import get_or_create_payment_transaction
+
+
+def make_payment_transaction(transaction_id: str, settlement_key: str | None, **kwargs) -> models.PaymentTransaction:
+    return get_or_create_payment_transaction(
+        transaction_id=transaction_id,
+        settlement_key=settlement_key,
+        status=models.TransactionStatus.PENDING,
+        **kwargs,
+    )
+
+
+@mock.patch("app.core.matching_director.tasks.matching_queue.enqueue_batch")
+def test_handle_auth_payment_transactions(mock_enqueue_batch, db_session: db.Session) -> None:
+    get_or_create_payment_transaction(
+        session=db_session, transaction_id="settled-1", settlement_key="key-1", status=models.TransactionStatus.PENDING
+    )
+
+    director = PaymentMatchingDirector()
+    director.handle_auth_payment_transactions(
+        [
+            make_payment_transaction("auth-1", "key-1"),
+            make_payment_transaction("auth-2", "key-2"),
+            make_payment_transaction("auth-3", "key-3"),
+            make_payment_transaction("auth-3-duplicate", "key-3"),
+        ],
+        session=db_session,
+    )
+
+    transaction_ids = {row[0] for row in db_session.query(models.PaymentTransaction.transaction_id)}
+    assert transaction_ids == {"settled-1", "auth-2", "auth-3"}
+    mock_enqueue_batch.assert_called_once_with(tasks.match_payment_transaction, [(("key-2",), {}), (("key-3",), {})])
+
+
+def test_handle_auth_payment_transactions_no_settlement_key(db_session: db.Session) -> None:
+    director = PaymentMatchingDirector()
+    with pytest.raises(PaymentMatchingDirector.InvalidAuthTransaction):
+        director.handle_auth_payment_transactions([make_payment_transaction("auth-1", None)], session=db_session)
+
+
+@mock.patch("app.core.matching_director.tasks.matching_queue.enqueue_batch")
+def test_handle_settled_payment_transactions(mock_enqueue_batch, db_session: db.Session) -> None:
+    get_or_create_payment_transaction(
+        session=db_session,
+        transaction_id="auth-pending",
+        settlement_key="key-pending",
+        status=models.TransactionStatus.PENDING,
+        spend_amount=100,
+        first_six=None,
+    )
+    get_or_create_payment_transaction(
+        session=db_session,
+        transaction_id="auth-matched",
+        settlement_key="key-matched",
+        status=models.TransactionStatus.MATCHED,
+    )
+
+    director = PaymentMatchingDirector()
+    director.handle_settled_payment_transactions(
+        [
+            make_payment_transaction("settled-pending", "key-pending", spend_amount=150, first_six="123456"),
+            make_payment_transaction("settled-matched", "key-matched"),
+            make_payment_transaction("settled-new", "key-new"),
+        ],
+        session=db_session,
+    )
+
+    overridden = (
+        db_session.query(models.PaymentTransaction)
+        .filter(models.PaymentTransaction.settlement_key == "key-pending")
+        .one()
+    )
+    assert overridden.transaction_id == "settled-pending"
+    assert overridden.spend_amount == 150
+    assert overridden.first_six == "123456"
+
+    transaction_ids = {row[0] for row in db_session.query(models.PaymentTransaction.transaction_id)}
+    assert transaction_ids == {"settled-pending", "auth-matched", "settled-new"}
+    mock_enqueue_batch.assert_called_once_with(
+        tasks.match_payment_transaction, [(("key-pending",), {}), (("key-new",), {})]
+    )
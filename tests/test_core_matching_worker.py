@@ -6,7 +6,7 @@ import pytest
 import responses
 
 import settings
-from app import db, models
+from app import db, models, tasks
 from app.core import identifier
 from app.core.matching_worker import MatchingWorker
 from app.models import IdentifierType
@@ -15,6 +15,7 @@ from tests.fixtures import (
     get_or_create_payment_transaction,
     get_or_create_scheme_transaction,
     get_or_create_transaction,
+    get_or_create_user_identity,
 )
 
 PAYMENT_PROVIDER_SLUG = "visa"
@@ -267,6 +268,7 @@ def test_get_agent_for_payment_transaction_multiple_mids(
     assert mock_instantiate.call_args[0][0] == MERCHANT_SLUG
 
 
+@mock.patch.object(settings, "GROUP_MATCHING_SLUGS", [])
 @mock.patch("app.tasks.LoggedQueue.enqueue")
 @mock.patch("app.core.matching_worker.get_logger")
 def test_handle_scheme_transactions_multiple_payment_transaction_mids(
@@ -341,3 +343,178 @@ def test_handle_scheme_transactions_multiple_payment_transaction_mids(
     assert "Received 2 scheme transactions. Looking for potential matches now." in logs
     assert "Found 2 potential matching payment transactions. Enqueueing matching jobs on matching_slow queue." in logs
     assert mock_enqueue.call_count == 2
+
+
+@mock.patch.object(settings, "GROUP_MATCHING_SLUGS", [MERCHANT_SLUG])
+@mock.patch("app.core.matching_worker.MatchingWorker.export_transactions")
+@mock.patch("app.tasks.LoggedQueue.enqueue_batch")
+def test_handle_scheme_transactions_in_memory(
+    mock_enqueue_batch, mock_export_transactions, mid_primary: int, db_session: db.Session
+) -> None:
+    match_group = "5d5b9b5a-1b0e-4a4a-9d4d-3bb0c1f8a0b5"
+    transaction_date = pendulum.now().replace(microsecond=0)
+
+    payment_transactions = [
+        get_or_create_payment_transaction(
+            session=db_session,
+            merchant_identifier_ids=[mid_primary],
+            mid="test-mid-primary",
+            provider_slug="visa",
+            transaction_id=f"ptx{i}_id",
+            settlement_key=f"ptx{i}_key",
+            transaction_date=transaction_date,
+            spend_amount=2400,
+            card_token=f"ptx{i}_token",
+            auth_code=auth_code,
+            status=models.TransactionStatus.PENDING,
+        )
+        for i, auth_code in enumerate(["111111", "222222", "333333"])
+    ]
+    for payment_transaction in payment_transactions[:2]:
+        get_or_create_user_identity(session=db_session, transaction_id=payment_transaction.transaction_id)
+
+    for i, auth_code in enumerate(["111111", "222222"]):
+        get_or_create_scheme_transaction(
+            session=db_session,
+            mid="test-mid-primary",
+            provider_slug=MERCHANT_SLUG,
+            payment_provider_slug="visa",
+            transaction_id=f"stx{i}_id",
+            transaction_date=transaction_date,
+            spend_amount=2400,
+            auth_code=auth_code,
+            match_group=match_group,
+            status=models.TransactionStatus.PENDING,
+        )
+
+    worker = MatchingWorker()
+    worker.handle_scheme_transactions(match_group, session=db_session)
+
+    matched = db_session.query(models.MatchedTransaction.transaction_id).order_by(models.MatchedTransaction.id).all()
+    assert [row[0] for row in matched] == ["stx0_id", "stx1_id"]
+    assert {
+        tx.transaction_id: tx.status
+        for tx in db_session.query(models.SchemeTransaction).filter_by(match_group=match_group)
+    } == {"stx0_id": models.TransactionStatus.MATCHED, "stx1_id": models.TransactionStatus.MATCHED}
+    assert [tx.status for tx in payment_transactions] == [
+        models.TransactionStatus.MATCHED,
+        models.TransactionStatus.MATCHED,
+        models.TransactionStatus.PENDING,
+    ]
+    mock_export_transactions.assert_called_once()
+    assert len(mock_export_transactions.call_args.args[0]) == 2
+
+    # the payment transaction without a user identity is left for the individual matching job.
+    mock_enqueue_batch.assert_called_once_with(tasks.match_payment_transaction, [(("ptx2_key",), {})])
+
+
+@mock.patch.object(settings, "GROUP_MATCHING_SLUGS", [MERCHANT_SLUG])
+@mock.patch("app.core.matching_worker.MatchingWorker.export_transactions")
+@mock.patch("app.tasks.LoggedQueue.enqueue_batch")
+def test_handle_scheme_transactions_in_memory_unknown_mids(
+    mock_enqueue_batch, mock_export_transactions, mid_primary: int, db_session: db.Session
+) -> None:
+    match_group = "0b8e7f62-3c1d-4d6a-8a43-9d6f5c2e1a77"
+    transaction_date = pendulum.now().replace(microsecond=0)
+
+    payment_transaction = get_or_create_payment_transaction(
+        session=db_session,
+        merchant_identifier_ids=[mid_primary + 1000],
+        mid="test-mid-primary",
+        provider_slug="visa",
+        transaction_id="ptx_id",
+        settlement_key="ptx_key",
+        transaction_date=transaction_date,
+        spend_amount=2400,
+        card_token="ptx_token",
+        auth_code="111111",
+        status=models.TransactionStatus.PENDING,
+    )
+    get_or_create_user_identity(session=db_session, transaction_id=payment_transaction.transaction_id)
+    get_or_create_scheme_transaction(
+        session=db_session,
+        mid="test-mid-primary",
+        provider_slug=MERCHANT_SLUG,
+        payment_provider_slug="visa",
+        transaction_id="stx_id",
+        transaction_date=transaction_date,
+        spend_amount=2400,
+        auth_code="111111",
+        match_group=match_group,
+        status=models.TransactionStatus.PENDING,
+    )
+
+    worker = MatchingWorker()
+    worker.handle_scheme_transactions(match_group, session=db_session)
+
+    # none of the payment transaction's MIDs have a scheme slug, so it's left for the individual matching job.
+    assert payment_transaction.status == models.TransactionStatus.PENDING
+    mock_enqueue_batch.assert_called_once_with(tasks.match_payment_transaction, [(("ptx_key",), {})])
+
+
+@mock.patch.object(settings, "GROUP_MATCHING_SLUGS", [MERCHANT_SLUG])
+@mock.patch("app.core.matching_worker.MatchingWorker.export_transactions")
+@mock.patch("app.tasks.LoggedQueue.enqueue_batch")
+def test_handle_scheme_transactions_in_memory_already_matched(
+    mock_enqueue_batch, mock_export_transactions, mid_primary: int, db_session: db.Session
+) -> None:
+    match_group = "9a3c2d71-6e4b-4f0a-b8d5-2c7e1f9a4b63"
+    transaction_date = pendulum.now().replace(microsecond=0)
+
+    payment_transactions = [
+        get_or_create_payment_transaction(
+            session=db_session,
+            merchant_identifier_ids=[mid_primary],
+            mid="test-mid-primary",
+            provider_slug="visa",
+            transaction_id=f"ptx{i}_id",
+            settlement_key=f"ptx{i}_key",
+            transaction_date=transaction_date,
+            spend_amount=2400,
+            card_token=f"ptx{i}_token",
+            auth_code=auth_code,
+            status=models.TransactionStatus.PENDING,
+        )
+        for i, auth_code in enumerate(["111111", "222222"])
+    ]
+    for payment_transaction in payment_transactions:
+        get_or_create_user_identity(session=db_session, transaction_id=payment_transaction.transaction_id)
+
+    for i, auth_code in enumerate(["111111", "222222"]):
+        get_or_create_scheme_transaction(
+            session=db_session,
+            mid="test-mid-primary",
+            provider_slug=MERCHANT_SLUG,
+            payment_provider_slug="visa",
+            transaction_id=f"stx{i}_id",
+            transaction_date=transaction_date,
+            spend_amount=2400,
+            auth_code=auth_code,
+            match_group=match_group,
+            status=models.TransactionStatus.PENDING,
+        )
+
+    worker = MatchingWorker()
+    finalise_matches = worker._finalise_matches
+
+    def match_concurrently(*args, **kwargs):
+        # another job matches stx1 between the in-memory match and the finalising update.
+        db_session.query(models.SchemeTransaction).filter_by(transaction_id="stx1_id").update(
+            {models.SchemeTransaction.status: models.TransactionStatus.MATCHED}, synchronize_session=False
+        )
+        return finalise_matches(*args, **kwargs)
+
+    with mock.patch.object(worker, "_finalise_matches", side_effect=match_concurrently):
+        worker.handle_scheme_transactions(match_group, session=db_session)
+
+    matched = db_session.query(models.MatchedTransaction.transaction_id).all()
+    assert [row[0] for row in matched] == ["stx0_id"]
+    assert [tx.status for tx in payment_transactions] == [
+        models.TransactionStatus.MATCHED,
+        models.TransactionStatus.PENDING,
+    ]
+    mock_export_transactions.assert_called_once()
+    assert [tx for _, tx in mock_export_transactions.call_args.args[0]] == [payment_transactions[0]]
+
+    # the dropped match's payment transaction is left for the individual matching job.
+    mock_enqueue_batch.assert_called_once_with(tasks.match_payment_transaction, [(("ptx1_key",), {})])
@@ -0,0 +1,69 @@
+from unittest import mock
+
+import pytest
+
+from app import db, models, tasks
+from app.core.streaming_worker import StreamingWorker
+from app.feeds import FeedType
+from tests.fixtures import get_or_create_merchant_identifier, get_or_create_transaction, get_or_create_user_identity
+
+MERCHANT_SLUG = "bpl-viator"
+MATCH_GROUP = "3c5a2f0e-7d1b-4f8e-9a6c-2b4d6e8f0a1c"
+
+
+@pytest.fixture
+def merchant_identifier_ids(db_session: db.Session) -> list[int]:
+    return [
+        get_or_create_merchant_identifier(
+            session=db_session, identifier=identifier, merchant_slug=MERCHANT_SLUG, payment_provider_slug="visa"
+        ).id
+        for identifier in ("mid-1", "mid-2")
+    ]
+
+
+def make_transaction(
+    db_session: db.Session,
+    transaction_id: str,
+    feed_type: FeedType,
+    merchant_identifier_ids: list[int],
+    match_group: str = MATCH_GROUP,
+) -> models.Transaction:
+    return get_or_create_transaction(
+        session=db_session,
+        transaction_id=transaction_id,
+        feed_type=feed_type,
+        merchant_slug=MERCHANT_SLUG,
+        merchant_identifier_ids=merchant_identifier_ids,
+        mids=["mid-1"],
+        match_group=match_group,
+    )
+
+
+@mock.patch.object(tasks.export_queue, "enqueue_batch")
+def test_handle_transactions(mock_enqueue_batch, merchant_identifier_ids: list[int], db_session: db.Session) -> None:
+    # two refunds, one of which has two merchant identifiers, an auth that BPL doesn't stream, and an unidentified one.
+    make_transaction(db_session, "refund-1", FeedType.REFUND, merchant_identifier_ids)
+    make_transaction(db_session, "refund-2", FeedType.REFUND, merchant_identifier_ids[:1])
+    make_transaction(db_session, "auth-1", FeedType.AUTH, merchant_identifier_ids[:1])
+    make_transaction(db_session, "refund-unidentified", FeedType.REFUND, merchant_identifier_ids[:1])
+    make_transaction(
+        db_session, "refund-other-group", FeedType.REFUND, merchant_identifier_ids[:1], match_group="other-group"
+    )
+    for transaction_id in ("refund-1", "refund-2", "auth-1", "refund-other-group"):
+        get_or_create_user_identity(session=db_session, transaction_id=transaction_id)
+
+    StreamingWorker().handle_transactions(MATCH_GROUP, session=db_session)
+
+    export_transactions = db_session.query(models.ExportTransaction).order_by(models.ExportTransaction.id).all()
+    assert [(tx.transaction_id, tx.mid) for tx in export_transactions] == [("refund-1", "mid-1"), ("refund-2", "mid-1")]
+    assert {tx.provider_slug for tx in export_transactions} == {MERCHANT_SLUG}
+    assert db_session.query(models.PendingExport).count() == 2
+    mock_enqueue_batch.assert_called_once()
+
+
+@mock.patch.object(tasks.export_queue, "enqueue_batch")
+def test_handle_transactions_empty_group(mock_enqueue_batch, db_session: db.Session) -> None:
+    StreamingWorker().handle_transactions(MATCH_GROUP, session=db_session)
+
+    assert db_session.query(models.ExportTransaction).count() == 0
+    mock_enqueue_batch.assert_not_called()
@@ -1,6 +1,9 @@
+import os
 from unittest import mock
 
+import pytest
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.pool import NullPool
 
 from app import db
 from app.models import ConfigItem
@@ -28,3 +31,51 @@ def test_get_or_create_integrity_error(db_session):
         ci, created = db.get_or_create(ConfigItem, key="potato", defaults={"value": "chipped"}, session=db_session)
         assert created is False
         assert ci.value == "boiled"
+
+
+def test_pool_args_null():
+    assert db._pool_args("null") == {"poolclass": NullPool}
+
+
+def test_pool_args_queue():
+    pool_args = db._pool_args("queue")
+    assert pool_args["poolclass"] is db.InstrumentedQueuePool
+    assert "pool_use_lifo" not in pool_args
+
+
+def test_pool_args_pgbouncer():
+    pool_args = db._pool_args("pgbouncer")
+    assert pool_args["poolclass"] is db.InstrumentedQueuePool
+    assert pool_args["pool_pre_ping"] is False
+    assert pool_args["pool_use_lifo"] is True
+
+
+def test_pool_args_invalid():
+    with pytest.raises(ValueError):
+        db._pool_args("potato")
+
+
+def test_pool_is_reset_after_fork():
+    with mock.patch.object(db.engine, "dispose") as mock_dispose:
+        pid = os.fork()
+        if pid == 0:
+            # the mock is copied into the child, so report back through the exit code.
+            os._exit(0 if mock_dispose.call_args == mock.call(close=False) else 1)
+
+        _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    mock_dispose.assert_not_called()
+
+
+def test_redis_locks() -> None:
+    keys = ["test-lock:1", "test-lock:2"]
+
+    with db.redis.lock("test-lock:2", timeout=10):
+        with db.redis_locks(keys, timeout=10) as acquired:
+            assert acquired == {"test-lock:1"}
+            assert db.redis.lock("test-lock:1").acquire(blocking=False) is False
+
+        assert db.redis.get("test-lock:1") is None
+        # locks held by someone else are left alone.
+        assert db.redis.get("test-lock:2") is not None
@@ -1,8 +1,13 @@
+from unittest import mock
+
 import pendulum
 import time_machine
 
 import settings
+from app import db, models
 from app.exports.agents.wasabi import Wasabi
+from app.exports.retry_worker import ExportRetryWorker
+from tests.fixtures import get_or_create_export_transaction, get_or_create_pending_export
 
 settings.EUROPA_URL = "http://europa"
 settings.VAULT_URL = "https://vault"
@@ -24,3 +29,49 @@ def test_next_day_available_retry_time() -> None:
 
     retry_time = wasabi.next_available_retry_time(7)
     assert retry_time.to_datetime_string() == pendulum.datetime(2020, 1, 5, 7, 0, 0).to_datetime_string()
+
+
+def make_pending_export(session: db.Session, transaction_id: str, **kwargs) -> models.PendingExport:
+    export_transaction = get_or_create_export_transaction(session=session, transaction_id=transaction_id)
+    return get_or_create_pending_export(session=session, export_transaction=export_transaction, **kwargs)
+
+
+@mock.patch("app.tasks.export_queue.schedule_batch")
+def test_requeue_pending_exports(mock_schedule_batch, db_session: db.Session) -> None:
+    now = pendulum.now("UTC")
+    due = make_pending_export(db_session, "tx-due", retry_at=now.subtract(minutes=1), retry_count=1)
+    missed = make_pending_export(db_session, "tx-missed", created_at=now.subtract(days=2))
+    not_due = make_pending_export(db_session, "tx-not-due", retry_at=now.add(minutes=1), retry_count=1)
+    new = make_pending_export(db_session, "tx-new")
+    db_session.commit()
+
+    with mock.patch.object(settings, "EXPORT_RETRY_CHUNK_SIZE", 1):
+        requeued = ExportRetryWorker().requeue_pending_exports(session=db_session)
+
+    assert requeued == 2
+    assert mock_schedule_batch.call_count == 2
+    calls = [call for (_, calls), _ in mock_schedule_batch.call_args_list for call in calls]
+    assert [args for _, args, _ in calls] == [(due.id,), (missed.id,)]
+    assert all(now <= enqueue_at <= now.add(seconds=settings.EXPORT_RETRY_JITTER + 1) for enqueue_at, _, _ in calls)
+
+    for pending_export in (due, missed, not_due, new):
+        db_session.refresh(pending_export)
+    assert (due.retry_at, due.retry_count) == (None, 2)
+    assert (missed.retry_at, missed.retry_count) == (None, 0)
+    assert missed.updated_at is not None
+    assert not_due.retry_count == 1
+    assert new.updated_at is None
+
+    # nothing is due any more
+    assert ExportRetryWorker().requeue_pending_exports(session=db_session) == 0
+
+
+@mock.patch("app.tasks.export_queue.enqueue_batch")
+def test_requeue_pending_exports_without_jitter(mock_enqueue_batch, db_session: db.Session) -> None:
+    due = make_pending_export(db_session, "tx-due", retry_at=pendulum.now("UTC").subtract(minutes=1))
+    db_session.commit()
+
+    with mock.patch.object(settings, "EXPORT_RETRY_JITTER", 0):
+        ExportRetryWorker().requeue_pending_exports(session=db_session)
+
+    mock_enqueue_batch.assert_called_once_with(mock.ANY, [((due.id,), {})])
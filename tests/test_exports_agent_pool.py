@@ -0,0 +1,114 @@
+from unittest import mock
+
+import pytest
+
+import settings
+from app import db
+from app.config import KEY_PREFIX, Config, ConfigValue
+from app.exports.agent_pool import ExportAgentPool
+from app.exports.agents import BaseAgent
+from app.exports.agents.registry import export_agents
+from app.registry import NoSuchAgent
+
+MERCHANT_SLUG = "mock-pooled-agent"
+CONFIG_KEY = f"{KEY_PREFIX}exports.agents.{MERCHANT_SLUG}.base_url"
+
+
+class MockPooledAgent(BaseAgent):
+    provider_slug = MERCHANT_SLUG
+    config = Config(ConfigValue("base_url", key=CONFIG_KEY, default="http://localhost"))
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.warm_up = mock.MagicMock()
+        self.refresh = mock.MagicMock()
+        self.teardown = mock.MagicMock()
+
+
+@pytest.fixture
+def pool():
+    export_agents.add(MERCHANT_SLUG, f"{__name__}.MockPooledAgent")
+    pool = ExportAgentPool()
+    yield pool
+    export_agents.remove(MERCHANT_SLUG)
+    db.redis.delete(CONFIG_KEY)
+
+
+def test_get_reuses_agent(pool: ExportAgentPool) -> None:
+    agent = pool.get(MERCHANT_SLUG)
+
+    assert isinstance(agent, MockPooledAgent)
+    agent.warm_up.assert_called_once_with()
+    assert pool.get(MERCHANT_SLUG) is agent
+    agent.refresh.assert_not_called()
+
+
+def test_get_does_not_refresh(pool: ExportAgentPool) -> None:
+    agent = pool.get(MERCHANT_SLUG)
+
+    db.redis.set(CONFIG_KEY, "http://merchant.example")
+    with mock.patch.object(settings, "EXPORT_AGENT_MAX_AGE", 0):
+        assert pool.get(MERCHANT_SLUG) is agent
+
+    agent.refresh.assert_not_called()
+
+
+def test_refresh_stale_on_config_change(pool: ExportAgentPool) -> None:
+    db.redis.set(CONFIG_KEY, "http://localhost")
+    agent = pool.get(MERCHANT_SLUG)
+
+    pool.refresh_stale()
+    agent.refresh.assert_not_called()
+
+    db.redis.set(CONFIG_KEY, "http://merchant.example")
+    pool.refresh_stale()
+    pool.refresh_stale()
+
+    assert pool.get(MERCHANT_SLUG) is agent
+    agent.refresh.assert_called_once_with()
+
+
+def test_refresh_stale_after_max_age(pool: ExportAgentPool) -> None:
+    agent = pool.get(MERCHANT_SLUG)
+
+    with mock.patch.object(settings, "EXPORT_AGENT_MAX_AGE", 0):
+        pool.refresh_stale()
+
+    assert pool.get(MERCHANT_SLUG) is agent
+    agent.refresh.assert_called_once_with()
+
+
+def test_refresh_stale_rebuilds_agent_if_refresh_fails(pool: ExportAgentPool) -> None:
+    agent = pool.get(MERCHANT_SLUG)
+    agent.refresh.side_effect = Exception("refresh failed")
+
+    with mock.patch.object(settings, "EXPORT_AGENT_MAX_AGE", 0):
+        pool.refresh_stale()
+
+    assert pool.get(MERCHANT_SLUG) is not agent
+    agent.teardown.assert_called_once_with()
+
+
+def test_get_pool_disabled(pool: ExportAgentPool) -> None:
+    with mock.patch.object(settings, "EXPORT_AGENT_POOL", False):
+        assert pool.get(MERCHANT_SLUG) is not pool.get(MERCHANT_SLUG)
+
+    assert MERCHANT_SLUG not in pool
+
+
+def test_get_no_such_agent(pool: ExportAgentPool) -> None:
+    with pytest.raises(NoSuchAgent):
+        pool.get("not-an-agent")
+
+
+def test_warm_up_and_teardown(pool: ExportAgentPool) -> None:
+    pool.warm_up([MERCHANT_SLUG, "not-an-agent"])
+
+    assert MERCHANT_SLUG in pool
+    assert "not-an-agent" not in pool
+    agent = pool.get(MERCHANT_SLUG)
+
+    pool.teardown()
+
+    assert MERCHANT_SLUG not in pool
+    agent.teardown.assert_called_once_with()
@@ -0,0 +1,188 @@
+import time
+from unittest import mock
+
+import pendulum
+import pytest
+
+from app import db, models
+from app.config import KEY_PREFIX
+from app.exports import rate_limit
+from app.exports.agents import AgentExportData, SingularExportAgent
+from app.exports.async_executor import AsyncExportExecutor
+from app.exports.exceptions import MissingExportData
+from app.exports.models import ExportTransactionStatus
+from tests.fixtures import get_or_create_export_transaction, get_or_create_pending_export
+
+MERCHANT_SLUG = "mock-async-export-agent"
+LIMIT_KEYS = [
+    f"{KEY_PREFIX}exports.agents.{MERCHANT_SLUG}.{name}"
+    for name in ("rate_limit", "rate_limit_burst", "concurrency_limit")
+]
+
+
+# exports from every instance of the agent, since the executor creates one per concurrent send.
+EXPORTED: list[str] = []
+
+
+class MockAsyncExportAgent(SingularExportAgent):
+    provider_slug = MERCHANT_SLUG
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.in_use = False
+
+    def find_export_transaction(
+        self, pending_export: models.PendingExport, *, session: db.Session
+    ) -> models.ExportTransaction:
+        export_transaction = super().find_export_transaction(pending_export, session=session)
+        if export_transaction.transaction_id == "tx-already-rewarded":
+            raise db.NoResultFound
+        return export_transaction
+
+    def make_export_data(self, export_transaction: models.ExportTransaction, session: db.Session) -> AgentExportData:
+        if export_transaction.transaction_id == "tx-missing-data":
+            raise MissingExportData("no credentials")
+        return AgentExportData(
+            outputs=[], transactions=[export_transaction], extra_data={"id": export_transaction.transaction_id}
+        )
+
+    def export(self, export_data: AgentExportData, *, retry_count: int = 0, session: db.Session) -> None:
+        assert not self.in_use, "agent is being used by more than one thread"
+        self.in_use = True
+        time.sleep(0.01)
+        self.in_use = False
+
+        transaction_id = export_data.extra_data["id"]
+        if transaction_id == "tx-fail":
+            raise Exception("merchant API is down")
+        if transaction_id == "tx-fail-last-retry" and retry_count >= 4:
+            raise Exception("merchant API is still down")
+        EXPORTED.append(transaction_id)
+
+
+@pytest.fixture(autouse=True)
+def clear_exported():
+    EXPORTED.clear()
+
+
+@pytest.fixture
+def unlimited():
+    for key in LIMIT_KEYS:
+        db.redis.set(key, "1" if key.endswith("burst") else "0")
+    yield
+    db.redis.delete(*LIMIT_KEYS)
+
+
+def make_pending_export(session: db.Session, transaction_id: str, **kwargs) -> models.PendingExport:
+    export_transaction = get_or_create_export_transaction(
+        session=session, transaction_id=transaction_id, provider_slug=MERCHANT_SLUG
+    )
+    return get_or_create_pending_export(
+        session=session, export_transaction=export_transaction, provider_slug=MERCHANT_SLUG, **kwargs
+    )
+
+
+def test_run_batch(unlimited, db_session: db.Session) -> None:
+    now = pendulum.now("UTC")
+    ok = make_pending_export(db_session, "tx-ok")
+    retried = make_pending_export(db_session, "tx-retried", retry_at=now.subtract(minutes=1), retry_count=1)
+    fail = make_pending_export(db_session, "tx-fail")
+    fail_last_retry = make_pending_export(
+        db_session, "tx-fail-last-retry", retry_at=now.subtract(minutes=1), retry_count=3
+    )
+    missing_data = make_pending_export(db_session, "tx-missing-data")
+    already_rewarded = make_pending_export(db_session, "tx-already-rewarded")
+    not_due = make_pending_export(db_session, "tx-not-due", retry_at=now.add(minutes=1))
+    db_session.commit()
+    export_transactions = {
+        pe.export_transaction.transaction_id: pe.export_transaction
+        for pe in (ok, retried, fail, fail_last_retry, missing_data, already_rewarded)
+    }
+    fail_id, not_due_id = fail.id, not_due.id
+
+    assert AsyncExportExecutor(MockAsyncExportAgent(), concurrency=2).run_batch(session=db_session) == 6
+
+    assert sorted(EXPORTED) == ["tx-ok", "tx-retried"]
+
+    remaining = {pe.id: pe for pe in db_session.query(models.PendingExport)}
+    assert set(remaining) == {fail_id, not_due_id}
+    db_session.refresh(remaining[fail_id])
+    assert remaining[fail_id].retry_count == 0
+    assert remaining[fail_id].retry_at is not None
+    assert remaining[fail_id].leased_until is None
+    assert remaining[fail_id].failure_reason == "Exception('merchant API is down')"
+
+    for export_transaction in export_transactions.values():
+        db_session.refresh(export_transaction)
+    assert export_transactions["tx-ok"].status == ExportTransactionStatus.EXPORTED
+    assert export_transactions["tx-retried"].status == ExportTransactionStatus.EXPORTED
+    assert export_transactions["tx-fail"].status == ExportTransactionStatus.PENDING
+    assert export_transactions["tx-fail-last-retry"].status == ExportTransactionStatus.EXPORT_FAILED
+    assert export_transactions["tx-missing-data"].status == ExportTransactionStatus.EXPORT_FAILED
+    assert export_transactions["tx-already-rewarded"].status == ExportTransactionStatus.PENDING
+
+
+def test_run_batch_nothing_due(unlimited, db_session: db.Session) -> None:
+    assert AsyncExportExecutor(MockAsyncExportAgent()).run_batch(session=db_session) == 0
+
+
+def test_run_batch_agents_not_shared_between_threads(unlimited, db_session: db.Session) -> None:
+    for i in range(20):
+        make_pending_export(db_session, f"tx-{i}")
+    db_session.commit()
+
+    executor = AsyncExportExecutor(MockAsyncExportAgent(), concurrency=4)
+    assert executor.run_batch(session=db_session) == 20
+
+    assert len(EXPORTED) == 20
+    assert executor._idle_agents.qsize() <= 4
+
+
+def test_claim_pending_exports_leases_claimed_exports(unlimited, db_session: db.Session) -> None:
+    now = pendulum.now("UTC")
+    first = make_pending_export(db_session, "tx-first")
+    retried = make_pending_export(db_session, "tx-retried", retry_at=now.subtract(minutes=1))
+    db_session.commit()
+    first_id, retried_id = first.id, retried.id
+    executor = AsyncExportExecutor(MockAsyncExportAgent())
+
+    claimed = executor._claim_pending_exports(session=db_session)
+
+    assert sorted(claimed) == sorted([first_id, retried_id])
+    db_session.expire_all()
+    assert all(pe.leased_until > now.naive() for pe in db_session.query(models.PendingExport))
+    # the lease doesn't touch retry_at, which is what marks an export as a retry.
+    assert db_session.query(models.PendingExport).filter_by(id=first_id).one().retry_at is None
+
+    # leased exports aren't claimed again until the lease runs out.
+    assert executor._claim_pending_exports(session=db_session) == []
+
+
+def test_run_batch_expired_lease_is_not_a_retry(unlimited, db_session: db.Session) -> None:
+    # the executor stopped while sending this export, before it could save the outcome.
+    pending_export = make_pending_export(db_session, "tx-fail", leased_until=pendulum.now("UTC").subtract(minutes=1))
+    db_session.commit()
+    pending_export_id = pending_export.id
+
+    assert AsyncExportExecutor(MockAsyncExportAgent()).run_batch(session=db_session) == 1
+
+    retried = db_session.query(models.PendingExport).filter_by(id=pending_export_id).one()
+    db_session.refresh(retried)
+    assert retried.retry_count == 0
+    assert retried.retry_at is not None
+
+
+@mock.patch("app.exports.async_executor.rate_limit.limit", side_effect=rate_limit.RateLimited(MERCHANT_SLUG, 1.0))
+def test_run_batch_rate_limited(mock_limit, db_session: db.Session) -> None:
+    pending_export = make_pending_export(db_session, "tx-deferred")
+    db_session.commit()
+    pending_export_id = pending_export.id
+
+    assert AsyncExportExecutor(MockAsyncExportAgent()).run_batch(session=db_session) == 0
+
+    # the lease is given back, so the export is due again straight away.
+    deferred = db_session.query(models.PendingExport).filter_by(id=pending_export_id).one()
+    assert deferred.retry_at is None
+    assert deferred.leased_until is None
+    assert deferred.retry_count == 0
+    assert EXPORTED == []
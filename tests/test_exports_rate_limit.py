@@ -0,0 +1,85 @@
+from unittest import mock
+
+import pytest
+
+from app import db, tasks
+from app.config import KEY_PREFIX
+from app.core.export_director import ExportDirector
+from app.exports import rate_limit
+from tests.fixtures import get_or_create_export_transaction, get_or_create_pending_export
+
+PROVIDER_SLUG = "test-rate-limited-merchant"
+KEY = f"{KEY_PREFIX}exports.agents.{PROVIDER_SLUG}"
+
+
+@pytest.fixture
+def limits():
+    def set_limits(rate: float = 0, burst: int = 1, concurrency: int = 0) -> None:
+        db.redis.set(f"{KEY}.rate_limit", str(rate))
+        db.redis.set(f"{KEY}.rate_limit_burst", str(burst))
+        db.redis.set(f"{KEY}.concurrency_limit", str(concurrency))
+
+    yield set_limits
+
+    bucket_key = f"{rate_limit.settings.REDIS_KEY_PREFIX}:export-rate-limit:{PROVIDER_SLUG}"
+    db.redis.delete(f"{KEY}.rate_limit", f"{KEY}.rate_limit_burst", f"{KEY}.concurrency_limit")
+    db.redis.delete(bucket_key, f"{bucket_key}:leases")
+
+
+def test_limit_unlimited(limits) -> None:
+    limits()
+
+    for _ in range(10):
+        with rate_limit.limit(PROVIDER_SLUG):
+            pass
+
+
+def test_limit_rate(limits) -> None:
+    limits(rate=1, burst=2)
+
+    with rate_limit.limit(PROVIDER_SLUG), rate_limit.limit(PROVIDER_SLUG):
+        pass
+
+    with pytest.raises(rate_limit.RateLimited) as ex:
+        with rate_limit.limit(PROVIDER_SLUG):
+            pass
+
+    assert 0 < ex.value.retry_after <= 1
+
+
+def test_limit_concurrency(limits) -> None:
+    limits(concurrency=1)
+
+    with rate_limit.limit(PROVIDER_SLUG):
+        with pytest.raises(rate_limit.RateLimited) as ex:
+            with rate_limit.limit(PROVIDER_SLUG):
+                pass
+        assert ex.value.retry_after == rate_limit.CONCURRENCY_RETRY_SECONDS
+
+    # the lease is released when the first export finishes.
+    with rate_limit.limit(PROVIDER_SLUG):
+        pass
+
+
+@mock.patch.object(tasks.export_queue, "schedule_batch")
+@mock.patch("app.core.export_director.export_agent_pool")
+def test_handle_pending_export_rate_limited(mock_pool, mock_schedule_batch, limits, db_session: db.Session) -> None:
+    limits(concurrency=1)
+    export_transaction = get_or_create_export_transaction(session=db_session, provider_slug=PROVIDER_SLUG)
+    pending_export = get_or_create_pending_export(
+        session=db_session, export_transaction=export_transaction, provider_slug=PROVIDER_SLUG
+    )
+
+    with rate_limit.limit(PROVIDER_SLUG):
+        ExportDirector().handle_pending_export(pending_export.id, session=db_session)
+
+    mock_pool.get.return_value.handle_pending_export.assert_not_called()
+    mock_schedule_batch.assert_called_once()
+    [(_, args, _)] = mock_schedule_batch.call_args[0][1]
+    assert args == (pending_export.id,)
+
+    db_session.refresh(pending_export)
+    assert (pending_export.retry_count, pending_export.retry_at) == (0, None)
+
+    ExportDirector().handle_pending_export(pending_export.id, session=db_session)
+    mock_pool.get.return_value.handle_pending_export.assert_called_once_with(pending_export, session=db_session)
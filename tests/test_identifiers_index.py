@@ -0,0 +1,100 @@
+from unittest import mock
+
+import pytest
+from sqlalchemy.orm.exc import MultipleResultsFound
+
+from app import db
+from app.identifiers import index as mid_index
+from app.imports.agents.bases.base import get_merchant_slug, get_mids_by_location_id
+from app.models import IdentifierType
+from tests.fixtures import get_or_create_merchant_identifier
+
+
+@pytest.fixture
+def mid_ids(db_session: db.Session) -> list[int]:
+    return [
+        get_or_create_merchant_identifier(
+            session=db_session,
+            identifier="mid-1",
+            merchant_slug="iceland-bonus-card",
+            payment_provider_slug="visa",
+            location_id="store-1",
+        ).id,
+        get_or_create_merchant_identifier(
+            session=db_session,
+            identifier="mid-2",
+            identifier_type=IdentifierType.SECONDARY,
+            merchant_slug="iceland-bonus-card",
+            payment_provider_slug="visa",
+            location_id="store-1",
+        ).id,
+        get_or_create_merchant_identifier(
+            session=db_session, identifier="mid-1", merchant_slug="wasabi-club", payment_provider_slug="amex"
+        ).id,
+    ]
+
+
+def test_get(mid_ids: list[int], db_session: db.Session) -> None:
+    snapshot = mid_index.MIDIndex().get(session=db_session)
+
+    assert len(snapshot) == 3
+    mid = snapshot.by_key[("mid-1", IdentifierType.PRIMARY, "visa")]
+    assert mid.id == mid_ids[0]
+    assert mid.loyalty_scheme_slug == "iceland-bonus-card"
+    assert mid.location_id == "store-1"
+    assert snapshot.by_id[mid_ids[2]].payment_provider_slug == "amex"
+    assert [mid.id for mid in snapshot.by_identifier[("mid-1", "visa")]] == [mid_ids[0]]
+    assert snapshot.location_id_mid_map("iceland-bonus-card") == {"store-1": ["mid-1", "mid-2"]}
+
+
+@mock.patch.object(mid_index.settings, "MID_INDEX_CHECK_INTERVAL", 0)
+def test_get_reloads_on_version_bump(mid_ids: list[int], db_session: db.Session) -> None:
+    index = mid_index.MIDIndex()
+    snapshot = index.get(session=db_session)
+    assert index.get(session=db_session) is snapshot
+
+    db.redis.incr(mid_index.VERSION_KEY)
+
+    assert index.get(session=db_session) is not snapshot
+
+
+@mock.patch.object(mid_index.settings, "MID_INDEX_CHECK_INTERVAL", 3600)
+def test_get_waits_for_check_interval(mid_ids: list[int], db_session: db.Session) -> None:
+    index = mid_index.MIDIndex()
+    snapshot = index.get(session=db_session)
+
+    db.redis.incr(mid_index.VERSION_KEY)
+
+    assert index.get(session=db_session) is snapshot
+
+
+def test_bump_version_invalidates_local_index(mid_ids: list[int], db_session: db.Session) -> None:
+    snapshot = mid_index.index.get(session=db_session)
+
+    mid_index.bump_version()
+
+    assert mid_index.index.get(session=db_session) is not snapshot
+
+
+def test_get_merchant_slug(mid_ids: list[int], db_session: db.Session) -> None:
+    with mock.patch("app.db.session_scope", return_value=db_session):
+        assert get_merchant_slug((IdentifierType.PRIMARY, "mid-1"), payment_provider_slug="amex") == "wasabi-club"
+        assert get_merchant_slug((IdentifierType.PRIMARY, "unknown"), payment_provider_slug="amex") is None
+
+
+def test_get_merchant_slug_multiple_schemes(mid_ids: list[int], db_session: db.Session) -> None:
+    get_or_create_merchant_identifier(
+        session=db_session, identifier="mid-3", merchant_slug="wasabi-club", payment_provider_slug="visa"
+    )
+    with mock.patch("app.db.session_scope", return_value=db_session):
+        with pytest.raises(MultipleResultsFound):
+            get_merchant_slug(
+                (IdentifierType.PRIMARY, "mid-1"), (IdentifierType.PRIMARY, "mid-3"), payment_provider_slug="visa"
+            )
+
+
+def test_get_mids_by_location_id(mid_ids: list[int], db_session: db.Session) -> None:
+    with mock.patch("app.db.session_scope", return_value=db_session):
+        mids = get_mids_by_location_id("store-1", scheme_slug="iceland-bonus-card", payment_slug="visa")
+
+    assert mids == ["mid-1"]
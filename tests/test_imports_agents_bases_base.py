@@ -4,8 +4,8 @@ from unittest import mock
 
 import pendulum
 import pytest
-from redis.lock import Lock
 
+import settings
 from app import db, models
 from app.feeds import FeedType
 from app.imports.agents.bases.base import (
@@ -18,7 +18,12 @@ from app.imports.agents.bases.base import (
 from app.imports.agents.visa import VisaAuth
 from app.imports.exceptions import MissingMID
 from app.models import IdentifierType, TransactionStatus
-from tests.fixtures import Default, SampleTransactions, get_or_create_merchant_identifier
+from tests.fixtures import (
+    Default,
+    SampleTransactions,
+    get_or_create_import_transaction,
+    get_or_create_merchant_identifier,
+)
 
 PAYMENT_PROVIDER_SLUG = "visa"
 MATCH_GROUP = "da34aa2a4abf4cc190c3519f7c6e2f88"
@@ -182,6 +187,13 @@ def test_get_merchant_slug_secondary_mid_visa(mid_secondary: int, db_session: db
         assert slug == Default.merchant_slug
 
 
+def test_get_merchant_slug_missing_mid_visa(db_session: db.Session) -> None:
+    with mock.patch("app.db.session_scope", return_value=db_session):
+        agent = VisaAuth()
+        with pytest.raises(MissingMID):
+            agent.get_merchant_slug(VISA_TRANSACTION)
+
+
 def test_provider_slug_not_implemented() -> None:
     with pytest.raises(NotImplementedError) as e:
         BaseAgent()
@@ -279,9 +291,13 @@ def test_import_transactions(
     # Check that there are no new import transactions once one has been added
     result = list(agent._import_transactions([body], source=SOURCE, session=db_session))
     assert result == []
-    assert caplog.messages[0] == "Found 1 new transactions in import set of 1 total transactions."
-    assert caplog.messages[2] == "Found 0 new transactions in import set of 1 total transactions."
-    assert caplog.messages[3] == f'No new transactions found in source "{SOURCE}", exiting early.'
+    # ignore messages logged by the task queue
+    messages = [record.getMessage() for record in caplog.records if record.name == agent.log.name]
+    assert messages == [
+        "Found 1 new transactions in import set of 1 total transactions.",
+        "Found 0 new transactions in import set of 1 total transactions.",
+        f'No new transactions found in source "{SOURCE}", exiting early.',
+    ]
 
 
 @mock.patch.object(BaseAgent, "get_primary_mids", return_value=Default.primary_mids)
@@ -294,9 +310,12 @@ def test_import_transactions_lock_acquire_false(
     caplog.set_level(logging.DEBUG)
     agent.log.propagate = True
 
-    with mock.patch.object(Lock, "acquire", return_value=False):
+    lock_key = f"txmatch:import-lock:{PAYMENT_PROVIDER_SLUG}:{Default.transaction_id}"
+    with db.redis.lock(lock_key, timeout=10):
         list(agent._import_transactions([VISA_TRANSACTION], source=SOURCE, session=db_session))
 
+    assert db_session.query(models.ImportTransaction).count() == 0
+
     assert caplog.messages == [
         "Found 1 new transactions in import set of 1 total transactions.",
         f"Transaction txmatch:import-lock:{PAYMENT_PROVIDER_SLUG}:{Default.transaction_id} is already locked. "
@@ -305,9 +324,10 @@ def test_import_transactions_lock_acquire_false(
 
 
 @mock.patch("app.imports.agents.bases.base.tasks.import_queue.enqueue")
-@mock.patch("app.imports.agents.bases.base.tasks.identify_user_queue.enqueue")
+@mock.patch("app.imports.agents.bases.base.tasks.identify_user_queue.enqueue_batch")
 @mock.patch.object(BaseAgent, "_update_metrics")
 @mock.patch.object(BaseAgent, "feed_type", new_callable=mock.PropertyMock, return_value=FeedType.AUTH)
+@mock.patch.object(settings, "HERMES_USER_INFO_BATCH_SIZE", 2)
 def test_persist_and_enqueue_payment_feed(
     mock_feed_type,
     mock_update_metrics,
@@ -315,22 +335,25 @@ def test_persist_and_enqueue_payment_feed(
     mock_enqueue_import_queue,
     db_session: db.Session,
 ) -> None:
+    transaction_ids = [Default.transaction_id, "tx2", "tx3"]
+    identify_args = [IDENTIFY._replace(transaction_id=transaction_id) for transaction_id in transaction_ids]
+    transaction_inserts = [
+        {**TRANSACTION_INSERT, "transaction_id": transaction_id} for transaction_id in transaction_ids
+    ]
     agent = MockBaseAgent()
-    agent._persist_and_enqueue([IMPORT_TRANSACTION_INSERT], [TRANSACTION_INSERT], [IDENTIFY], MATCH_GROUP)
+    agent._persist_and_enqueue([IMPORT_TRANSACTION_INSERT], transaction_inserts, identify_args, MATCH_GROUP)
 
-    assert mock_enqueue_identify_user_queue.call_args.args[0].__name__ == "identify_user"
-    assert mock_enqueue_identify_user_queue.call_args.kwargs == {
-        "feed_type": FeedType.AUTH,
-        "transaction_id": Default.transaction_id,
-        "merchant_identifier_ids": [1],
-        "card_token": CARD_TOKEN,
-        "match_group": MATCH_GROUP,
-    }
+    f, calls = mock_enqueue_identify_user_queue.call_args.args
+    assert f.__name__ == "identify_users"
+    assert calls == [
+        ((), {"identify_args": identify_args[:2], "feed_type": FeedType.AUTH, "match_group": MATCH_GROUP}),
+        ((), {"identify_args": identify_args[2:], "feed_type": FeedType.AUTH, "match_group": MATCH_GROUP}),
+    ]
     assert mock_enqueue_import_queue.called is False
 
 
 @mock.patch("app.imports.agents.bases.base.tasks.import_queue.enqueue")
-@mock.patch("app.imports.agents.bases.base.tasks.identify_user_queue.enqueue")
+@mock.patch("app.imports.agents.bases.base.tasks.identify_user_queue.enqueue_batch")
 @mock.patch.object(BaseAgent, "_update_metrics")
 @mock.patch.object(BaseAgent, "feed_type", new_callable=mock.PropertyMock, return_value=FeedType.MERCHANT)
 def test_persist_and_enqueue_merchant_feed(
@@ -400,3 +423,24 @@ def test_build_inserts_import_error(
         e.value.args[0] == "visa agent is configured with a feed type of FeedType.AUTH,  but provided "
         "SchemeTransactionFields instead of PaymentTransactionFields"
     )
+
+
+@mock.patch.object(BaseAgent, "feed_type", new_callable=mock.PropertyMock, return_value=FeedType.AUTH)
+@mock.patch.object(BaseAgent, "get_transaction_id", side_effect=lambda tx: tx["id"])
+def test_find_new_transactions_checks_candidates_only(
+    mock_get_transaction_id, mock_feed_type, db_session: db.Session
+) -> None:
+    get_or_create_import_transaction(session=db_session, transaction_id="tx-1", provider_slug=PAYMENT_PROVIDER_SLUG)
+    agent = MockBaseAgent()
+    agent.dedup_index.rebuild(session=db_session)
+
+    try:
+        with mock.patch.object(
+            agent, "_find_imported_transaction_ids", wraps=agent._find_imported_transaction_ids
+        ) as mock_find_imported:
+            new = agent._find_new_transactions([{"id": "tx-1"}, {"id": "tx-2"}, {"id": "tx-2"}], session=db_session)
+    finally:
+        db.redis.delete(agent.dedup_index.key, agent.dedup_index.ready_key)
+
+    assert new == [{"id": "tx-2"}]
+    mock_find_imported.assert_called_once_with({"tx-1"}, session=db_session)
@@ -6,7 +6,8 @@ import pendulum
 import pytest
 import time_machine
 
-from app import db
+import settings
+from app import db, models
 from app.config import KEY_PREFIX, Config, ConfigValue
 from app.feeds import FeedType
 from app.imports.agents.bases.file_agent import FileAgent, FileSourceBase, LocalFileSource
@@ -120,3 +121,39 @@ class TestFileAgent:
         mock_has_capacity.assert_called_once()
         mock_retry_exponential_delay.assert_not_called()
         mock_provide.assert_called_once()
+
+    @mock.patch.object(settings, "IMPORT_CHUNK_SIZE", 2)
+    @mock.patch.object(MockFileAgent, "_update_file_metrics")
+    @mock.patch.object(MockFileAgent, "_import_transactions")
+    @mock.patch.object(MockFileAgent, "get_transaction_date", side_effect=lambda tx: tx["date"])
+    @mock.patch.object(MockFileAgent, "yield_transactions_data")
+    def test_do_import_in_chunks(
+        self,
+        mock_yield_transactions_data,
+        mock_get_transaction_date,
+        mock_import_transactions,
+        mock_update_file_metrics,
+        db_session: db.Session,
+    ) -> None:
+        mock_yield_transactions_data.return_value = [
+            {"id": i, "date": pendulum.datetime(2023, 1, 5 - i)} for i in range(5)
+        ]
+        chunks = []
+
+        def import_transactions(provider_transactions, *, session, source):
+            chunks.append([tx["id"] for tx in provider_transactions])
+            yield
+            return len(provider_transactions) - 1
+
+        mock_import_transactions.side_effect = import_transactions
+
+        list(MockFileAgent()._do_import(b"", source="test-source"))
+
+        assert chunks == [[0, 1], [2, 3], [4]]
+
+        import_file_log = db_session.query(models.ImportFileLog).one()
+        assert import_file_log.imported is True
+        assert import_file_log.transaction_count == 5
+        assert import_file_log.unique_transaction_count == 2
+        assert import_file_log.date_range_from == pendulum.datetime(2023, 1, 1).naive()
+        assert import_file_log.date_range_to == pendulum.datetime(2023, 1, 5).naive()
@@ -41,3 +41,54 @@ def test_queue_agent_do_import(db_session: db.Session) -> None:
     agent._do_import(SampleTransactions().visa_auth())
 
     assert db_session.query(models.ImportTransaction.transaction_id).one()[0] == "db0b14a3-0ca8-4281-9a77-57b5b88ec0a4"
+
+
+def test_queue_agent_do_import_batch(db_session: db.Session) -> None:
+    agent = VisaAuth()
+    agent._do_import_batch(
+        [SampleTransactions().visa_auth(transaction_id="tx-1"), SampleTransactions().visa_auth(transaction_id="tx-2")]
+    )
+
+    transaction_ids = {row[0] for row in db_session.query(models.ImportTransaction.transaction_id)}
+    assert transaction_ids == {"tx-1", "tx-2"}
+
+
+def test_consumer_batches_messages() -> None:
+    agent = mock.MagicMock(provider_slug="visa")
+    messages = [mock.MagicMock(), mock.MagicMock(), mock.MagicMock()]
+    consumer = Consumer(mock.MagicMock(), "visa-auth", agent, batch_size=2, batch_timeout=60, prefetch_count=1)
+
+    assert consumer.prefetch_count == 2
+
+    for i, message in enumerate(messages):
+        consumer.on_message({"id": i}, message)
+
+    agent._do_import_batch.assert_called_once_with([{"id": 0}, {"id": 1}])
+    messages[1].ack.assert_called_once_with(multiple=True)
+
+    # the partial batch waits for the timeout.
+    consumer.on_iteration()
+    assert agent._do_import_batch.call_count == 1
+
+    consumer.batch_timeout = 0
+    consumer.on_iteration()
+    agent._do_import_batch.assert_called_with([{"id": 2}])
+    messages[2].ack.assert_called_once_with(multiple=True)
+    messages[0].ack.assert_not_called()
+
+
+def test_consumer_discards_batch_on_reconnect() -> None:
+    agent = mock.MagicMock(provider_slug="visa")
+    message = mock.MagicMock()
+    consumer = Consumer(mock.MagicMock(), "visa-auth", agent, batch_size=2, batch_timeout=60)
+
+    consumer.on_message({"id": 0}, message)
+    consumer.on_connection_revived()
+
+    # the message is redelivered on the new channel, and only imported then.
+    redelivered = mock.MagicMock()
+    consumer.on_message({"id": 0}, redelivered)
+    consumer.on_message({"id": 1}, mock.MagicMock())
+
+    agent._do_import_batch.assert_called_once_with([{"id": 0}, {"id": 1}])
+    message.ack.assert_not_called()
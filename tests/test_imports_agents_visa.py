@@ -7,7 +7,15 @@ import pytest
 
 from app import db
 from app.feeds import FeedType
-from app.imports.agents.visa import VisaAuth, VisaRefund, VisaSettlement, get_key_value, validate_mids
+from app.imports.agents.visa import (
+    MessageElements,
+    VisaAuth,
+    VisaRefund,
+    VisaSettlement,
+    get_key_value,
+    index_message_elements,
+    validate_mids,
+)
 from app.models import IdentifierType
 from tests.fixtures import Default, SampleTransactions, get_or_create_import_transaction
 
@@ -83,6 +91,35 @@ def test_get_key_value() -> None:
     assert e.value.args[0] == f"Key not_a_valid_key not found in data: {data}"
 
 
+def test_get_key_value_indexed() -> None:
+    data = VisaAuth().prepare_message(copy.deepcopy(AUTH_TX1))
+
+    assert isinstance(data["MessageElementsCollection"], MessageElements)
+    assert get_key_value(data, "Transaction.MerchantCardAcceptorId") == PRIMARY_ID
+    with pytest.raises(KeyError):
+        get_key_value(data, "not_a_valid_key")
+
+
+def test_index_message_elements() -> None:
+    data = copy.deepcopy(AUTH_TX1)
+    data["MessageElementsCollection"].append({"Key": "Transaction.AuthCode", "Value": "duplicate"})
+
+    indexed = index_message_elements(data)
+
+    # the first value is used, as with a linear scan, and the message is stored exactly as it was received.
+    assert get_key_value(indexed, "Transaction.AuthCode") == AUTH_TX1_AUTH_CODE
+    assert json.loads(json.dumps(indexed)) == data
+    assert index_message_elements(indexed) is indexed
+
+
+@patch("app.imports.agents.visa.VisaAuth.get_merchant_slug", return_value="merchant")
+def test_auth_to_transaction_fields_indexed(mock_get_merchant_slug) -> None:
+    agent = VisaAuth()
+    assert agent.to_transaction_fields(agent.prepare_message(copy.deepcopy(AUTH_TX1))) == agent.to_transaction_fields(
+        copy.deepcopy(AUTH_TX1)
+    )
+
+
 @pytest.mark.parametrize(
     "input, expected",
     [
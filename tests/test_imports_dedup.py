@@ -0,0 +1,62 @@
+from unittest import mock
+
+import pytest
+
+import settings
+from app import db
+from app.feeds import FeedType
+from app.imports.dedup import DedupIndex
+from tests.fixtures import get_or_create_import_transaction
+
+PROVIDER_SLUG = "test-dedup-provider"
+
+
+@pytest.fixture
+def dedup_index():
+    index = DedupIndex(PROVIDER_SLUG, FeedType.AUTH)
+    yield index
+    db.redis.delete(index.key, index.ready_key)
+
+
+def test_candidates_before_rebuild(dedup_index: DedupIndex) -> None:
+    dedup_index.add(["tx-1"])
+
+    assert dedup_index.is_ready() is False
+    assert dedup_index.candidates(["tx-1", "tx-2"]) == {"tx-1", "tx-2"}
+
+
+def test_rebuild(dedup_index: DedupIndex, db_session: db.Session) -> None:
+    get_or_create_import_transaction(session=db_session, transaction_id="tx-1", provider_slug=PROVIDER_SLUG)
+    get_or_create_import_transaction(
+        session=db_session, transaction_id="tx-other", provider_slug=PROVIDER_SLUG, feed_type=FeedType.SETTLED
+    )
+
+    assert dedup_index.rebuild(session=db_session) == 1
+    assert dedup_index.is_ready() is True
+    assert dedup_index.candidates(["tx-1", "tx-2", "tx-other"]) == {"tx-1"}
+
+    dedup_index.add(["tx-2"])
+    assert dedup_index.candidates(["tx-1", "tx-2", "tx-3"]) == {"tx-1", "tx-2"}
+
+
+def test_resized_index_is_not_ready(dedup_index: DedupIndex, db_session: db.Session) -> None:
+    dedup_index.rebuild(session=db_session)
+
+    with mock.patch.object(settings, "IMPORT_DEDUP_INDEX_BITS", 1024):
+        assert dedup_index.is_ready() is False
+
+
+def test_rebuild_empty(dedup_index: DedupIndex, db_session: db.Session) -> None:
+    assert dedup_index.rebuild(session=db_session) == 0
+    assert dedup_index.is_ready() is True
+    assert dedup_index.candidates(["tx-1"]) == set()
+
+
+def test_evicted_index_is_not_ready(dedup_index: DedupIndex, db_session: db.Session) -> None:
+    get_or_create_import_transaction(session=db_session, transaction_id="tx-1", provider_slug=PROVIDER_SLUG)
+    dedup_index.rebuild(session=db_session)
+
+    db.redis.delete(dedup_index.key)
+
+    assert dedup_index.is_ready() is False
+    assert dedup_index.candidates(["tx-1"]) == {"tx-1"}
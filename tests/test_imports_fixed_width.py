@@ -0,0 +1,45 @@
+import pytest
+
+from app.imports.fixed_width import FixedWidthField, FixedWidthParser
+
+FIELDS = [
+    FixedWidthField(name="record_type", start=0, length=1),
+    FixedWidthField(name="name", start=1, length=6),
+    FixedWidthField(name="amount", start=7, length=5),
+]
+
+DATA = b"\n".join(
+    [
+        b"H20230101",
+        b"Dalice 00150",
+        b"Dbob   00020",
+        b"T00002",
+    ]
+)
+
+
+def test_parse_line() -> None:
+    parser = FixedWidthParser(FIELDS, converters={"amount": int})
+    assert parser.parse_line("Dalice 00150") == {"record_type": "D", "name": "alice", "amount": "00150"}
+
+
+def test_parse_line_short() -> None:
+    assert FixedWidthParser(FIELDS).parse_line("Dbob") == {"record_type": "D", "name": "bob", "amount": ""}
+
+
+def test_parse() -> None:
+    parser = FixedWidthParser(FIELDS, converters={"amount": int})
+    assert list(parser.parse(DATA, skip_lines=1, where={"record_type": "D"})) == [
+        {"record_type": "D", "name": "alice", "amount": 150},
+        {"record_type": "D", "name": "bob", "amount": 20},
+    ]
+
+
+def test_parse_without_filter() -> None:
+    records = list(FixedWidthParser(FIELDS).parse(DATA))
+    assert [record["record_type"] for record in records] == ["H", "D", "D", "T"]
+
+
+def test_parse_unknown_filter_field() -> None:
+    with pytest.raises(KeyError):
+        list(FixedWidthParser(FIELDS).parse(DATA, where={"missing": "D"}))
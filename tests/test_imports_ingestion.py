@@ -0,0 +1,127 @@
+import threading
+from unittest import mock
+
+import pendulum
+import pytest
+
+import settings
+from app import db, models
+from app.feeds import FeedType
+from app.imports import ingestion
+from app.service.hermes import PaymentProviderSlug
+from tests.fixtures import Default
+
+TRANSACTION_DATE = pendulum.datetime(2023, 5, 1, 12, 30, 15)
+
+
+def make_transaction_insert(transaction_id: str, **kwargs) -> dict:
+    return {
+        "feed_type": FeedType.MERCHANT,
+        "status": models.TransactionStatus.IMPORTED,
+        "merchant_identifier_ids": [1, 2],
+        "mids": ['mid "1"', "mid\\2"],
+        "transaction_id": transaction_id,
+        "match_group": Default.match_group,
+        "merchant_slug": Default.merchant_slug,
+        "payment_provider_slug": PaymentProviderSlug.MASTERCARD,
+        "transaction_date": TRANSACTION_DATE,
+        "has_time": True,
+        "spend_amount": 1000,
+        "spend_multiplier": 100,
+        "spend_currency": "GBP",
+        "first_six": None,
+        "last_four": "1234",
+        "auth_code": "line\tone\nline two",
+        "extra_fields": {"store": "Ascot", "amount": 10.5},
+        **kwargs,
+    }
+
+
+@pytest.mark.parametrize("backend", ["insert", "copy"])
+def test_insert_rows(backend: str, db_session: db.Session) -> None:
+    table = models.Transaction.__table__
+
+    with mock.patch.object(settings, "IMPORT_INGESTION_BACKEND", backend):
+        first = ingestion.insert_rows(table, [make_transaction_insert("tx-1")], returning=table.c.transaction_id)
+        second = ingestion.insert_rows(
+            table,
+            [make_transaction_insert("tx-1"), make_transaction_insert("tx-2"), make_transaction_insert("tx-2")],
+            returning=table.c.transaction_id,
+        )
+
+    assert first == ["tx-1"]
+    assert second == ["tx-2"]
+
+    transaction = db_session.query(models.Transaction).filter(models.Transaction.transaction_id == "tx-2").one()
+    assert transaction.feed_type == FeedType.MERCHANT
+    assert transaction.status == models.TransactionStatus.IMPORTED
+    assert transaction.merchant_identifier_ids == [1, 2]
+    assert transaction.mids == ['mid "1"', "mid\\2"]
+    assert transaction.payment_provider_slug == "mastercard"
+    assert transaction.transaction_date == TRANSACTION_DATE
+    assert transaction.has_time is True
+    assert transaction.first_six is None
+    assert transaction.auth_code == "line\tone\nline two"
+    assert transaction.extra_fields == {"store": "Ascot", "amount": 10.5}
+
+
+@pytest.mark.parametrize("backend", ["insert", "copy"])
+def test_insert_rows_claims_keys(backend: str, db_session: db.Session) -> None:
+    table = models.Transaction.__table__
+
+    # a key without a transaction in the current partition, as if its transaction was created in an earlier one.
+    with db.engine.begin() as connection:
+        connection.execute(
+            models.TransactionKey.__table__.insert().values(transaction_id="tx-1", feed_type=FeedType.MERCHANT)
+        )
+
+    with mock.patch.object(settings, "IMPORT_INGESTION_BACKEND", backend):
+        inserted = ingestion.insert_rows(
+            table, [make_transaction_insert("tx-1"), make_transaction_insert("tx-2")], returning=table.c.transaction_id
+        )
+
+    assert inserted == ["tx-2"]
+    keys = db_session.query(models.TransactionKey.transaction_id).order_by(models.TransactionKey.transaction_id)
+    assert [key for key, in keys] == ["tx-1", "tx-2"]
+
+
+@pytest.mark.parametrize("backend", ["insert", "copy"])
+def test_insert_rows_concurrent(backend: str, test_db: None) -> None:
+    table = models.Transaction.__table__
+    key_table = models.TransactionKey.__table__
+    results: list[list] = []
+
+    def insert() -> None:
+        with mock.patch.object(settings, "IMPORT_INGESTION_BACKEND", backend):
+            results.append(
+                ingestion.insert_rows(table, [make_transaction_insert("tx-1")], returning=table.c.transaction_id)
+            )
+
+    # another import has claimed the key, but hasn't committed yet.
+    with db.engine.begin() as connection:
+        connection.execute(key_table.insert().values(transaction_id="tx-1", feed_type=FeedType.MERCHANT))
+        thread = threading.Thread(target=insert)
+        thread.start()
+        thread.join(timeout=0.5)
+        assert thread.is_alive()
+
+    thread.join(timeout=5)
+    assert results == [[]]
+
+
+def test_insert_rows_unknown_backend() -> None:
+    table = models.Transaction.__table__
+    with mock.patch.object(settings, "IMPORT_INGESTION_BACKEND", "carrier-pigeon"), pytest.raises(ValueError):
+        ingestion.insert_rows(table, [make_transaction_insert("tx-1")], returning=table.c.transaction_id)
+
+
+def test_insert_rows_empty() -> None:
+    table = models.Transaction.__table__
+    assert ingestion.insert_rows(table, [], returning=table.c.transaction_id) == []
+
+
+def test_copy_stream() -> None:
+    stream = ingestion._CopyStream(iter(["abc\n", "defgh\n", "i\n"]))
+    assert stream.read(5) == "abc\nd"
+    assert stream.read(100) == "efgh\ni\n"
+    assert stream.read(100) == ""
@@ -0,0 +1,84 @@
+import pendulum
+import pytest
+from sqlalchemy.orm.exc import MultipleResultsFound, NoResultFound
+
+from app import models
+from app.matching.index import SchemeTransactionIndex, UnsupportedCriterion
+from tests.fixtures import get_or_create_payment_transaction, get_or_create_scheme_transaction
+
+TRANSACTION_DATE = pendulum.datetime(2023, 5, 1, 12, 0, 0)
+
+
+def make_scheme_transaction(id: int, payment_provider_slug: str = "visa", **kwargs) -> models.SchemeTransaction:
+    scheme_transaction = get_or_create_scheme_transaction(
+        transaction_id=f"stx{id}",
+        payment_provider_slug=payment_provider_slug,
+        spend_amount=1000,
+        **kwargs,
+    )
+    scheme_transaction.id = id
+    return scheme_transaction
+
+
+@pytest.fixture
+def index() -> SchemeTransactionIndex:
+    return SchemeTransactionIndex(
+        [
+            make_scheme_transaction(1, transaction_date=TRANSACTION_DATE.add(minutes=5), auth_code="111111"),
+            make_scheme_transaction(2, transaction_date=TRANSACTION_DATE, auth_code="222222"),
+            make_scheme_transaction(3, transaction_date=TRANSACTION_DATE.add(days=1), auth_code="111111"),
+            make_scheme_transaction(4, transaction_date=TRANSACTION_DATE, payment_provider_slug="amex"),
+        ]
+    )
+
+
+@pytest.fixture
+def payment_transaction() -> models.PaymentTransaction:
+    return get_or_create_payment_transaction(provider_slug="visa", spend_amount=1000)
+
+
+def test_query_uses_mid_amount_and_provider(index, payment_transaction) -> None:
+    assert [tx.id for tx in index.query(payment_transaction)] == [2, 1, 3]
+
+    payment_transaction.spend_amount = 999
+    assert index.query(payment_transaction).all() == []
+
+
+def test_filter_between_iso_strings(index, payment_transaction) -> None:
+    query = index.query(payment_transaction).filter(
+        models.SchemeTransaction.transaction_date.between(
+            TRANSACTION_DATE.subtract(minutes=1).isoformat(), TRANSACTION_DATE.add(minutes=1).isoformat()
+        )
+    )
+    assert query.one().id == 2
+
+
+def test_filter_between_naive_iso_strings_are_utc(index, payment_transaction) -> None:
+    query = index.query(payment_transaction).filter(
+        models.SchemeTransaction.auth_code == "111111",
+        models.SchemeTransaction.transaction_date.between("2023-05-01T00:00:00", "2023-05-01T23:59:59.999999"),
+    )
+    assert query.one().id == 1
+
+
+def test_one_raises(index, payment_transaction) -> None:
+    query = index.query(payment_transaction)
+
+    with pytest.raises(MultipleResultsFound):
+        query.one()
+
+    with pytest.raises(NoResultFound):
+        query.filter(models.SchemeTransaction.auth_code == "999999").one()
+
+
+def test_remove(index, payment_transaction) -> None:
+    index.remove(2)
+
+    assert [tx.id for tx in index.query(payment_transaction)] == [1, 3]
+    assert index.get(2) is None
+    assert len(index) == 3
+
+
+def test_unsupported_criterion(index, payment_transaction) -> None:
+    with pytest.raises(UnsupportedCriterion):
+        index.query(payment_transaction).filter(models.SchemeTransaction.auth_code.like("1%"))
@@ -0,0 +1,93 @@
+from datetime import date, datetime, timedelta
+
+from app import db, models, partitions
+from app.feeds import FeedType
+from tests.fixtures import get_or_create_export_transaction, get_or_create_pending_export, get_or_create_transaction
+
+TODAY = date(2024, 3, 13)  # a wednesday
+THIS_WEEK = datetime(2024, 3, 11)
+
+
+def partition_of(transaction: models.Transaction, *, session: db.Session) -> str:
+    return session.execute(
+        "SELECT tableoid::regclass::text FROM transaction WHERE id = :id", {"id": transaction.id}
+    ).scalar()
+
+
+def test_partition_start() -> None:
+    assert partitions.partition_start(TODAY) == THIS_WEEK
+    assert partitions.partition_start(THIS_WEEK.date()) == THIS_WEEK
+
+
+def test_get_partitions(db_session: db.Session) -> None:
+    assert partitions.get_partitions("transaction", session=db_session) == [
+        partitions.Partition("transaction_default", None, None, is_default=True)
+    ]
+
+
+def test_create_partitions(db_session: db.Session) -> None:
+    transaction = get_or_create_transaction(session=db_session, created_at=THIS_WEEK + timedelta(days=1))
+    assert partition_of(transaction, session=db_session) == "transaction_default"
+
+    created = partitions.create_partitions(1, today=TODAY, session=db_session)
+
+    assert len(created) == 2 * len(partitions.PARTITIONED_MODELS)
+    assert partitions.get_partitions("transaction", session=db_session) == [
+        partitions.Partition("transaction_20240311", THIS_WEEK, THIS_WEEK + timedelta(weeks=1)),
+        partitions.Partition("transaction_20240318", THIS_WEEK + timedelta(weeks=1), THIS_WEEK + timedelta(weeks=2)),
+        partitions.Partition("transaction_default", None, None, is_default=True),
+    ]
+
+    # the row is moved out of the default partition.
+    assert partition_of(transaction, session=db_session) == "transaction_20240311"
+
+    # partitions that already exist are left alone.
+    assert partitions.create_partitions(1, today=TODAY, session=db_session) == []
+
+
+def test_drop_partitions(db_session: db.Session) -> None:
+    partitions.create_partitions(1, today=TODAY, session=db_session)
+    dropped_transaction = get_or_create_transaction(
+        session=db_session, transaction_id="dropped", created_at=THIS_WEEK + timedelta(days=2)
+    )
+    kept_transaction = get_or_create_transaction(
+        session=db_session, transaction_id="kept", created_at=THIS_WEEK + timedelta(weeks=1, days=2)
+    )
+    deleted_transaction = get_or_create_transaction(
+        session=db_session, transaction_id="deleted", created_at=THIS_WEEK - timedelta(weeks=10)
+    )
+    future_transaction = get_or_create_transaction(
+        session=db_session, transaction_id="future", created_at=THIS_WEEK + timedelta(weeks=10)
+    )
+    export_transaction = get_or_create_export_transaction(session=db_session, created_at=THIS_WEEK)
+    get_or_create_pending_export(session=db_session, export_transaction=export_transaction)
+    ids = [tx.id for tx in (dropped_transaction, kept_transaction, deleted_transaction, future_transaction)]
+    db_session.expunge_all()
+
+    dropped = partitions.drop_partitions(THIS_WEEK + timedelta(weeks=1, days=1), session=db_session)
+
+    assert dropped["transaction"] == ["transaction_20240311"]
+    assert dropped["export_transaction"] == ["export_transaction_20240311"]
+    remaining = db_session.query(models.Transaction.id).filter(models.Transaction.id.in_(ids)).all()
+    assert {id for id, in remaining} == {kept_transaction.id, future_transaction.id}
+    assert db_session.query(models.PendingExport).count() == 0
+
+
+def test_drop_partitions_deletes_keys(db_session: db.Session) -> None:
+    partitions.create_partitions(1, today=TODAY, session=db_session)
+    for transaction_id, created_at in [
+        ("deleted", THIS_WEEK - timedelta(weeks=10)),
+        ("dropped", THIS_WEEK + timedelta(days=2)),
+        # before the cutoff, but its transaction is in a partition that is kept.
+        ("straddling", THIS_WEEK + timedelta(weeks=1, hours=12)),
+        ("kept", THIS_WEEK + timedelta(weeks=1, days=2)),
+    ]:
+        db_session.add(
+            models.TransactionKey(transaction_id=transaction_id, feed_type=FeedType.MERCHANT, created_at=created_at)
+        )
+    db_session.commit()
+
+    partitions.drop_partitions(THIS_WEEK + timedelta(weeks=1, days=1), session=db_session)
+
+    keys = db_session.query(models.TransactionKey.transaction_id).all()
+    assert {transaction_id for transaction_id, in keys} == {"straddling", "kept"}
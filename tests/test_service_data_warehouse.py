@@ -1,8 +1,10 @@
 from unittest import mock
 
 import pendulum
+from kombu import Connection
 
-from app.data_warehouse import models
+import settings
+from app.data_warehouse import models, queue
 from app.exports.models import ExportTransactionStatus
 from app.feeds import FeedType
 
@@ -72,3 +74,34 @@ def test_queue_data_warehouse_part_message(mocked_queue):
     assert mocked_queue.call_args[0][0]["transaction_id"] == 345
     assert mocked_queue.call_args[0][0]["feed_type"] is None
     assert mocked_queue.call_args[0][0]["merchant_internal_id"] is None
+
+
+def test_emitter_publishes_batches() -> None:
+    emitter = queue.Emitter()
+
+    with mock.patch.object(settings, "RABBITMQ_DSN", "memory://"), Connection("memory://") as conn:
+        dw_queue = conn.SimpleQueue(queue.dw_queue)
+        emitter.add({"transaction_id": 1})
+        emitter.add({"transaction_id": 2})
+
+        assert emitter.flush(timeout=5) is True
+        assert len(emitter) == 0
+
+        payloads = []
+        while dw_queue.qsize():
+            message = dw_queue.get(timeout=1)
+            payloads.append(message.payload)
+            message.ack()
+        dw_queue.close()
+
+    assert payloads == [{"transaction_id": 1}, {"transaction_id": 2}]
+
+
+def test_emitter_drops_oldest_when_spool_is_full() -> None:
+    emitter = queue.Emitter()
+
+    with mock.patch.object(settings, "DW_SPOOL_SIZE", 2), mock.patch.object(emitter, "_ensure_thread"):
+        for i in range(3):
+            emitter.add({"transaction_id": i})
+
+    assert list(emitter._events) == [{"transaction_id": 1}, {"transaction_id": 2}]
@@ -0,0 +1,130 @@
+from unittest import mock
+
+import pytest
+from kombu import Connection
+
+import settings
+from app.service import exchange
+
+
+@pytest.fixture
+def publisher():
+    publisher = exchange.Publisher()
+    with mock.patch.object(settings, "RABBITMQ_DSN", "memory://"):
+        yield publisher
+        publisher.close()
+
+
+def get_messages(queue) -> list:
+    messages = []
+    with Connection("memory://") as conn:
+        simple_queue = conn.SimpleQueue(queue)
+        while simple_queue.qsize():
+            message = simple_queue.get(timeout=1)
+            messages.append((message.payload, message.headers))
+            message.ack()
+        simple_queue.close()
+    return messages
+
+
+def test_publish_batches_messages(publisher: exchange.Publisher) -> None:
+    with mock.patch.object(settings, "AUDIT_PUBLISH_BATCH_SIZE", 3):
+        publisher.publish({"id": 1}, provider="test-slug", routing_keys=["atlas", "dw"])
+        assert len(publisher) == 2
+        assert get_messages(exchange.atlas_queue) == []
+
+        publisher.publish({"id": 2}, provider="test-slug", routing_keys=["atlas"])
+
+    assert len(publisher) == 0
+    assert get_messages(exchange.atlas_queue) == [
+        ({"id": 1}, {"X-Provider": "test-slug"}),
+        ({"id": 2}, {"X-Provider": "test-slug"}),
+    ]
+    assert get_messages(exchange.plutus_queue) == [({"id": 1}, {"X-Provider": "test-slug"})]
+
+
+def test_publish_reuses_connection(publisher: exchange.Publisher) -> None:
+    with mock.patch.object(settings, "AUDIT_PUBLISH_BATCH_SIZE", 1), mock.patch.object(
+        exchange, "Connection", wraps=Connection
+    ) as mock_connection:
+        publisher.publish({"id": 1}, provider="test-slug", routing_keys=["atlas"])
+        publisher.publish({"id": 2}, provider="test-slug", routing_keys=["atlas"])
+
+    mock_connection.assert_called_once()
+    assert len(get_messages(exchange.atlas_queue)) == 2
+
+
+def test_flush_failure_keeps_spool(publisher: exchange.Publisher) -> None:
+    publisher.publish({"id": 1}, provider="test-slug", routing_keys=["atlas"])
+
+    with mock.patch.object(publisher, "_connect", side_effect=ConnectionError("broker down")):
+        with pytest.raises(ConnectionError):
+            publisher.flush()
+
+    assert len(publisher) == 1
+
+    # flushes are skipped until the reconnect delay has passed.
+    publisher.flush()
+    assert len(publisher) == 1
+
+    publisher._retry_at = 0
+    publisher.flush()
+    assert len(publisher) == 0
+    assert get_messages(exchange.atlas_queue) == [({"id": 1}, {"X-Provider": "test-slug"})]
+
+
+def test_publish_drops_oldest_when_spool_is_full(publisher: exchange.Publisher) -> None:
+    with mock.patch.object(settings, "AUDIT_SPOOL_SIZE", 2):
+        for i in range(3):
+            publisher.publish({"id": i}, provider="test-slug", routing_keys=["atlas"])
+
+    publisher.flush()
+    assert [payload for payload, _ in get_messages(exchange.atlas_queue)] == [{"id": 1}, {"id": 2}]
+
+
+@pytest.fixture
+def confirming_publisher(publisher: exchange.Publisher):
+    # stands in for a RabbitMQ channel with publisher confirms.
+    publisher._producer = mock.MagicMock()
+    publisher._connection = mock.MagicMock()
+    publisher._confirms = True
+    return publisher
+
+
+def test_flush_waits_for_confirms_once_per_batch(confirming_publisher: exchange.Publisher) -> None:
+    publisher = confirming_publisher
+    publisher._connection.drain_events.side_effect = lambda timeout: publisher._on_ack(3, True)
+
+    with mock.patch.object(settings, "AUDIT_PUBLISH_BATCH_SIZE", 3):
+        publisher.publish({"id": 1}, provider="test-slug", routing_keys=["atlas", "dw"])
+        publisher.publish({"id": 2}, provider="test-slug", routing_keys=["atlas"])
+
+    assert publisher._producer.publish.call_count == 3
+    publisher._connection.drain_events.assert_called_once()
+    assert len(publisher) == 0
+
+
+def test_flush_nacked_keeps_spool(confirming_publisher: exchange.Publisher) -> None:
+    publisher = confirming_publisher
+    connection = publisher._connection
+    connection.drain_events.side_effect = lambda timeout: publisher._on_nack(1, False)
+
+    publisher.publish({"id": 1}, provider="test-slug", routing_keys=["atlas"])
+    with pytest.raises(ConnectionError):
+        publisher.flush()
+
+    assert len(publisher) == 1
+    connection.release.assert_called_once()
+
+
+def test_after_fork_resets_publisher(confirming_publisher: exchange.Publisher) -> None:
+    publisher = confirming_publisher
+    connection = publisher._connection
+    publisher.publish({"id": 1}, provider="test-slug", routing_keys=["atlas"])
+
+    publisher._after_fork()
+
+    assert len(publisher) == 0
+    assert publisher._connection is None
+    # the parent's connection is left for the parent to use.
+    connection.release.assert_not_called()
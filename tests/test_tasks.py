@@ -1,6 +1,14 @@
+from unittest import mock
+
 import fakeredis
+import pendulum
 import pytest
+import rq
 
+from app import tasks
+from app.core import identifier
+from app.core.identifier import IdentifyArgs, IdentifyResult
+from app.feeds import FeedType
 from app.tasks import LoggedQueue, TasksRedisException
 
 
@@ -16,3 +24,125 @@ def test_enqueue_exception() -> None:
 
     with pytest.raises(TasksRedisException):
         test_queue.enqueue(do_a_job, "test_thing")
+
+
+def test_enqueue_batch() -> None:
+    test_queue = LoggedQueue(name="testing", connection=fakeredis.FakeRedis())
+
+    jobs = test_queue.enqueue_batch(do_a_job, [(("first",), {}), (("second",), {})])
+
+    assert [job.args for job in jobs] == [("first",), ("second",)]
+    assert test_queue.count == 2
+
+
+def test_enqueue_batch_empty() -> None:
+    test_queue = LoggedQueue(name="testing", connection=fakeredis.FakeRedis())
+
+    assert test_queue.enqueue_batch(do_a_job, []) == []
+
+
+def test_schedule_batch() -> None:
+    test_queue = LoggedQueue(name="testing", connection=fakeredis.FakeRedis())
+    enqueue_at = pendulum.now("UTC").add(minutes=1)
+
+    jobs = test_queue.schedule_batch(do_a_job, [(enqueue_at, ("first",), {}), (enqueue_at, ("second",), {})])
+
+    assert [job.args for job in jobs] == [("first",), ("second",)]
+    assert test_queue.count == 0
+    assert sorted(test_queue.scheduled_job_registry.get_job_ids()) == sorted(job.id for job in jobs)
+
+
+@mock.patch("app.tasks.import_queue.enqueue_batch")
+@mock.patch("app.tasks.identify_user_queue.schedule_batch")
+@mock.patch("app.tasks.identifier.identify_users")
+def test_identify_users(mock_identify_users, mock_identify_schedule_batch, mock_import_enqueue_batch) -> None:
+    retry = IdentifyArgs(transaction_id="tx-2", merchant_identifier_ids=[1], card_token="token-2")
+    mock_identify_users.return_value = IdentifyResult(identified=["tx-1"], retry=[retry])
+    now = pendulum.datetime(2024, 3, 11, 12)
+
+    with pendulum.test(now):
+        tasks.identify_users(identify_args=[], feed_type=FeedType.AUTH, match_group="group", attempt=1)
+
+    mock_identify_schedule_batch.assert_called_once_with(
+        tasks.identify_users,
+        [
+            (
+                now.add(seconds=tasks.settings.IDENTIFY_USERS_RETRY_DELAY * 2),
+                (),
+                dict(identify_args=[retry], feed_type=FeedType.AUTH, match_group="group", attempt=2),
+            )
+        ],
+    )
+    mock_import_enqueue_batch.assert_called_once_with(
+        tasks.import_transaction, [(("tx-1", FeedType.AUTH, "group"), {})]
+    )
+
+
+@mock.patch("app.tasks.import_queue.enqueue_batch")
+@mock.patch("app.tasks.identify_user_queue.schedule_batch")
+@mock.patch("app.tasks.identifier.identify_users", side_effect=identifier.RetryableLookupFailure)
+def test_identify_users_lookup_failure(
+    mock_identify_users, mock_identify_schedule_batch, mock_import_enqueue_batch
+) -> None:
+    args = [IdentifyArgs(transaction_id="tx-1", merchant_identifier_ids=[1], card_token="token-1")]
+
+    tasks.identify_users(identify_args=args, feed_type=FeedType.AUTH, match_group="group")
+
+    ((f, [(_, _, kwargs)]), _) = mock_identify_schedule_batch.call_args
+    assert f is tasks.identify_users
+    assert kwargs == dict(identify_args=args, feed_type=FeedType.AUTH, match_group="group", attempt=1)
+    mock_import_enqueue_batch.assert_not_called()
+
+
+@mock.patch("app.tasks.import_queue.enqueue_batch")
+@mock.patch("app.tasks.identify_user_queue.schedule_batch")
+@mock.patch("app.tasks.identifier.identify_users", side_effect=identifier.RetryableLookupFailure)
+def test_identify_users_lookup_failure_out_of_retries(
+    mock_identify_users, mock_identify_schedule_batch, mock_import_enqueue_batch
+) -> None:
+    args = [IdentifyArgs(transaction_id="tx-1", merchant_identifier_ids=[1], card_token="token-1")]
+
+    tasks.identify_users(
+        identify_args=args,
+        feed_type=FeedType.AUTH,
+        match_group="group",
+        attempt=tasks.settings.IDENTIFY_USERS_MAX_RETRIES,
+    )
+
+    mock_identify_schedule_batch.assert_not_called()
+    mock_import_enqueue_batch.assert_not_called()
+
+
+@mock.patch.object(tasks.settings, "DEBUG", False)
+@mock.patch("app.tasks.sentry_sdk.capture_exception")
+@mock.patch("app.tasks.import_queue.enqueue_batch")
+@mock.patch("app.tasks.identify_user_queue.schedule_batch")
+@mock.patch("app.tasks.identifier.identify_users", side_effect=RuntimeError("bad payload"))
+def test_identify_users_drops_on_error(
+    mock_identify_users, mock_identify_schedule_batch, mock_import_enqueue_batch, mock_capture_exception
+) -> None:
+    args = [IdentifyArgs(transaction_id="tx-1", merchant_identifier_ids=[1], card_token="token-1")]
+
+    tasks.identify_users(identify_args=args, feed_type=FeedType.AUTH, match_group="group")
+
+    mock_capture_exception.assert_called_once()
+    mock_identify_schedule_batch.assert_not_called()
+    mock_import_enqueue_batch.assert_not_called()
+
+
+@mock.patch("app.tasks.export_agent_pool.refresh_stale")
+@mock.patch("rq.SimpleWorker.execute_job")
+def test_refresh_export_agents_worker(mock_execute_job, mock_refresh_stale) -> None:
+    connection = fakeredis.FakeRedis()
+    other_queue = LoggedQueue(name="import", connection=connection)
+    export_queue = LoggedQueue(name=tasks.export_queue.name, connection=connection)
+    workerclass = type("SimpleWorker", (tasks.RefreshExportAgentsWorker, rq.SimpleWorker), {})
+    worker = workerclass([export_queue, other_queue], connection=connection)
+    job = mock.MagicMock()
+
+    worker.execute_job(job, other_queue)
+    mock_refresh_stale.assert_not_called()
+
+    worker.execute_job(job, export_queue)
+    mock_refresh_stale.assert_called_once_with()
+    assert mock_execute_job.call_args_list == [mock.call(job, other_queue), mock.call(job, export_queue)]
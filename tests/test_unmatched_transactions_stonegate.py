@@ -1,7 +1,11 @@
+import contextlib
+from functools import partial
+from unittest import mock
+
 import pendulum
 import pytest
 
-from app import db, models
+from app import db, models, tasks
 from app.unmatched_transactions.stonegate import Stonegate
 from tests.fixtures import (
     get_or_create_merchant_identifier,
@@ -16,7 +20,7 @@ def stonegate():
     return Stonegate()
 
 
-def test_find_unmatched_transactions(stonegate, db_session: db.Session) -> None:
+def make_unmatched_transaction(db_session: db.Session) -> models.PaymentTransaction:
     transaction_date = pendulum.now().subtract(days=3)
     payment_transaction = get_or_create_payment_transaction(
         session=db_session, provider_slug="amex", transaction_date=transaction_date
@@ -35,6 +39,29 @@ def test_find_unmatched_transactions(stonegate, db_session: db.Session) -> None:
         merchant_slug="stonegate",
         payment_provider_slug="amex",
     )
+    return payment_transaction
+
+
+def test_find_unmatched_transactions(stonegate, db_session: db.Session) -> None:
+    payment_transaction = make_unmatched_transaction(db_session)
 
     for ptx, uid, mid in stonegate.find_unmatched_transactions(db_session):
         assert ptx.transaction_id == payment_transaction.transaction_id
+
+
+@mock.patch.object(tasks.export_queue, "enqueue_batch")
+def test_load_unmatched_transactions(mock_enqueue_batch, stonegate, db_session: db.Session) -> None:
+    payment_transaction = make_unmatched_transaction(db_session)
+    with mock.patch(
+        "app.unmatched_transactions.base.db.session_scope",
+        new=partial(contextlib.nullcontext, enter_result=db_session),
+    ):
+        stonegate.load_unmatched_transactions()
+
+    pending_export = db_session.query(models.PendingExport).one()
+    assert pending_export.provider_slug == "stonegate-unmatched"
+    assert pending_export.export_transaction.transaction_id == payment_transaction.transaction_id
+    mock_enqueue_batch.assert_called_once_with(tasks.export_singular_transaction, [((pending_export.id,), {})])
+
+    db_session.refresh(payment_transaction)
+    assert payment_transaction.status == models.TransactionStatus.MATCHED